@@ -1,34 +1,56 @@
 # filename: app.py
 # Aplicação Flask principal com .env.
 import os
-import shutil
 import zipfile
-import threading
 from datetime import datetime
 import time
 from functools import wraps
 import json
-import uuid
+import gzip
+import hashlib
 import platform
+import threading
+from collections import OrderedDict
 
 from flask import (
     Flask,
+    Response,
     request,
     redirect,
     url_for,
     render_template,
     session,
     send_from_directory,
+    send_file,
     flash,
     jsonify,
     Blueprint,
+    stream_with_context,
 )
 from werkzeug.security import check_password_hash
+from werkzeug.http import http_date, parse_date
 from dotenv import load_dotenv
 
 from db import SessionLocal, init_db_and_seed_admin, get_paths
 from models import User, UploadLog
-from rpa import run_rpa_enter_google_folder, _ensure_local_zip_from_drive
+from rpa import _ensure_local_zip_from_drive, invalidar_sessao
+from rpa_worker import WORKER_ATIVO, enviar_comando
+import scheduler
+import checkpoints
+import artifacts
+import run_events
+import spans
+import uploads
+import archives
+
+try:  # opcionais: mais rápido / melhor compressão quando instalados
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Carrega variáveis de ambiente do .env
 load_dotenv()
@@ -54,40 +76,127 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Inicializa app Flask
 app = Flask(__name__, template_folder="templates", static_folder=None)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "chave_secreta_para_sessao")
+# teto do corpo da requisição (UPLOAD_MAX_MB); acima disso o Flask responde 413
+app.config["MAX_CONTENT_LENGTH"] = uploads.MAX_BYTES or None
 
 # Inicializa DB e cria usuário admin caso não exista
 init_db_and_seed_admin()
 
 # ===== Jobs (Blueprint) =====
+# Fila persistida na tabela jobs; o scheduler é quem dispara o RPA.
 bp = Blueprint("jobs", __name__)
-JOB_STATE = {"pending": False, "job_id": None, "created_at": None}
 
 
 @bp.post("/api/iniciar-incorporadora")
 def iniciar_incorporadora():
-    JOB_STATE["pending"] = True
-    JOB_STATE["job_id"] = str(uuid.uuid4())
-    JOB_STATE["created_at"] = time.time()
-    return jsonify({"ok": True, "job_id": JOB_STATE["job_id"]})
+    job, criado = scheduler.enfileirar("pull_zip", dedup_key="pull_zip")
+    return jsonify({"ok": True, "job_id": job["id"], "deduplicado": not criado})
 
 
 @bp.get("/api/pull-job")
 def pull_job():
-    if JOB_STATE["pending"]:
-        return jsonify({"do": True, "job_id": JOB_STATE["job_id"]})
+    job = scheduler.job_pendente("pull_zip")
+    if job:
+        return jsonify({"do": True, "job_id": job["id"]})
     return jsonify({"do": False})
 
 
+def _arquivo_enviado():
+    """(stream, nome) do .zip: campo multipart `file` ou corpo cru (application/zip)."""
+    f = request.files.get("file")
+    if f:
+        return f.stream, f.filename or ""
+    if request.mimetype in ("application/zip", "application/x-zip-compressed", "application/octet-stream"):
+        return request.stream, request.args.get("filename") or "arquivos.zip"
+    return None, ""
+
+
 @bp.post("/api/upload-zip")
 def upload_zip():
-    f = request.files.get("file")
-    job_id = request.form.get("job_id") or "unknown"
-    if not f:
+    stream, nome = _arquivo_enviado()
+    job_id = request.values.get("job_id") or "unknown"
+    if stream is None:
         return jsonify({"ok": False, "err": "no file"}), 400
     save_as = os.path.join(UPLOAD_DIR, "arquivos.zip")
-    f.save(save_as)
-    JOB_STATE["pending"] = False
-    return jsonify({"ok": True, "saved": save_as, "job_id": job_id})
+    try:
+        info = uploads.receber(stream, save_as, nome, "agente")
+    except uploads.UploadInvalido as e:
+        return jsonify({"ok": False, "err": str(e)}), 400
+    resultado = {"saved": save_as, "sha256": info["sha256"]}
+    if job_id != "unknown":
+        scheduler.concluir(job_id, resultado)
+    else:
+        # agente sem job_id: como antes, o upload encerra o pedido pendente
+        job_id = scheduler.concluir_ativo("pull_zip", resultado) or job_id
+    return jsonify({"ok": True, **info, "job_id": job_id})
+
+
+# Upload em partes (retomável) para o agente: cria a sessão, envia as partes
+# (PUT, em qualquer ordem/paralelo, com X-Chunk-SHA256), consulta as que faltam e
+# faz o commit. Retomar = GET da sessão e reenviar só o `missing`.
+@bp.post("/api/uploads")
+def upload_sessao_criar():
+    dados = request.get_json(silent=True) or {}
+    try:
+        sessao = uploads.criar_sessao(
+            filename=str(dados.get("filename") or "arquivos.zip"),
+            size=int(dados.get("size") or 0),
+            destino=os.path.join(UPLOAD_DIR, "arquivos.zip"),
+            chunk_size=int(dados["chunk_size"]) if dados.get("chunk_size") else None,
+            sha256=dados.get("sha256"),
+            job_id=dados.get("job_id"),
+            criado_por=session.get("user") or "agente",
+        )
+    except (uploads.UploadInvalido, ValueError) as e:
+        return jsonify({"ok": False, "err": str(e)}), 400
+    return jsonify({"ok": True, **sessao}), 201
+
+
+@bp.get("/api/uploads/<sessao_id>")
+def upload_sessao_status(sessao_id):
+    sessao = uploads.obter_sessao(sessao_id)
+    if sessao is None:
+        return jsonify({"ok": False, "err": "not found"}), 404
+    return jsonify({"ok": True, **sessao})
+
+
+@bp.put("/api/uploads/<sessao_id>/chunks/<int:n>")
+def upload_sessao_parte(sessao_id, n):
+    try:
+        info = uploads.gravar_parte(sessao_id, n, request.stream, request.headers.get("X-Chunk-SHA256", ""))
+    except uploads.SessaoFechada as e:
+        return jsonify({"ok": False, "err": str(e)}), 409
+    except uploads.UploadInvalido as e:
+        return jsonify({"ok": False, "err": str(e)}), 400
+    if info is None:
+        return jsonify({"ok": False, "err": "not found"}), 404
+    return jsonify({"ok": True, **info})
+
+
+@bp.post("/api/uploads/<sessao_id>/commit")
+def upload_sessao_commit(sessao_id):
+    try:
+        info = uploads.concluir_sessao(sessao_id, session.get("user") or "agente")
+    except uploads.SessaoFechada as e:
+        return jsonify({"ok": False, "err": str(e)}), 409
+    except uploads.UploadInvalido as e:
+        return jsonify({"ok": False, "err": str(e), **(uploads.obter_sessao(sessao_id) or {})}), 400
+    if info is None:
+        return jsonify({"ok": False, "err": "not found"}), 404
+    job_id = (uploads.obter_sessao(sessao_id) or {}).get("job_id")
+    resultado = {"saved": info["saved"], "sha256": info["sha256"]}
+    if job_id:
+        scheduler.concluir(job_id, resultado)
+    else:
+        job_id = scheduler.concluir_ativo("pull_zip", resultado)
+    return jsonify({"ok": True, **info, "job_id": job_id})
+
+
+@bp.delete("/api/uploads/<sessao_id>")
+def upload_sessao_abortar(sessao_id):
+    if not uploads.abortar_sessao(sessao_id):
+        return jsonify({"ok": False, "err": "Sessão inexistente ou já fechada."}), 409
+    return jsonify({"ok": True})
 
 
 # ===== Rotas auxiliares =====
@@ -99,7 +208,9 @@ def upload_zip_automatico():
     - Caminho retornado por _ensure_local_zip_from_drive (arquivo .zip ou diretório)
     - UPLOAD_DIR
     - Caminho padrão do Windows C:\\AUTOMACAO\\conciliacao\\arquivos
-    Seleciona o .zip mais recente e copia para UPLOAD_DIR/arquivos.zip.
+    O .zip mais recente entra pelo caminho do upload (acervo + UploadLog); se o mais
+    recente já é o arquivos.zip e ele não está no índice, é adotado como está. Sem
+    nenhum candidato, o atual é restaurado do índice do acervo.
     """
     log_dir = "/tmp"
     src = _ensure_local_zip_from_drive(log_dir)
@@ -123,6 +234,7 @@ def upload_zip_automatico():
             candidates.append(src)
         elif os.path.isdir(src):
             add_zip_candidates_from_dir(src)
+    do_drive = {os.path.abspath(c) for c in candidates}
 
     add_zip_candidates_from_dir(UPLOAD_DIR)
 
@@ -137,25 +249,37 @@ def upload_zip_automatico():
             seen.add(ap)
             unique_candidates.append(c)
 
-    if not unique_candidates:
-        return jsonify({"ok": False, "error": "Nenhum .zip encontrado nos diretórios verificados"}), 500
-
-    try:
-        src_zip = max(unique_candidates, key=os.path.getmtime)
-    except Exception:
-        src_zip = unique_candidates[0]
-
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     destino = os.path.join(UPLOAD_DIR, "arquivos.zip")
+    enviado_por = session.get("user") or "automatico"
+    src_zip = destino
+    info = {}
     try:
-        if os.path.abspath(src_zip) != os.path.abspath(destino):
-            shutil.copyfile(src_zip, destino)
+        if unique_candidates:
+            try:
+                src_zip = max(unique_candidates, key=os.path.getmtime)
+            except Exception:
+                src_zip = unique_candidates[0]
+            if os.path.abspath(src_zip) != os.path.abspath(destino):
+                fonte = "drive" if os.path.abspath(src_zip) in do_drive else "importado"
+                info = uploads.copiar_arquivo(src_zip, destino, enviado_por, fonte=fonte)
+            elif uploads.sha256_atual(destino) is None:
+                # colocado por fora dos endpoints: entra no índice sem ser sobrescrito
+                info = uploads.adotar(destino, enviado_por)
+            else:
+                os.utime(destino, None)
         else:
-            os.utime(destino, None)
+            atual = archives.STORE.atual()
+            if atual is None:
+                return jsonify({"ok": False, "error": "Nenhum .zip encontrado nos diretórios verificados"}), 500
+            src_zip = atual["path"]
+            info = uploads.copiar_arquivo(atual["path"], destino, enviado_por, fonte=atual["source"])
+    except uploads.UploadInvalido as e:
+        return jsonify({"ok": False, "error": f"{os.path.basename(src_zip)}: {e}"}), 500
     except Exception as e:
         return jsonify({"ok": False, "error": f"Falha ao salvar ZIP no destino: {e}"}), 500
 
-    return jsonify({"ok": True, "path": destino})
+    return jsonify({"ok": True, "path": destino, **info})
 
 
 @app.get("/api/arquivo-atual")
@@ -163,31 +287,37 @@ def arquivo_atual():
     destino = os.path.join(UPLOAD_DIR, "arquivos.zip")
     if os.path.isfile(destino):
         mtime = int(os.path.getmtime(destino))
-        return jsonify({"ok": True, "path": destino, "mtime": mtime})
+        return jsonify({"ok": True, "path": destino, "mtime": mtime, "archive": archives.STORE.atual()})
     else:
         return jsonify({"ok": False, "error": "Nenhum arquivo encontrado."})
 
 
 @app.post("/api/upload-zip-manual")
 def upload_zip_manual():
-    f = request.files.get("file")
-    if not f:
+    stream, nome = _arquivo_enviado()
+    if stream is None:
         return jsonify({"ok": False, "error": "Nenhum arquivo recebido."}), 400
 
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
     save_as = os.path.join(UPLOAD_DIR, "arquivos.zip")
 
-    name = (f.filename or "").lower()
-    if not name.endswith(".zip"):
+    if not nome.lower().endswith(".zip"):
         return jsonify({"ok": False, "error": "Envie um .zip válido."}), 400
 
     try:
-        f.save(save_as)
-        return jsonify({"ok": True, "saved": save_as})
+        info = uploads.receber(stream, save_as, nome, session.get("user") or "manual", fonte="manual")
+        return jsonify({"ok": True, **info})
+    except uploads.UploadInvalido as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
 
+@app.errorhandler(413)
+def upload_grande_demais(_e):
+    limite = f"{uploads.MAX_BYTES // (1024 * 1024)} MB"
+    return jsonify({"ok": False, "error": f"Arquivo acima do limite de {limite}.", "err": "too large"}), 413
+
+
 # ===== Auth helpers =====
 def is_logged_in():
     return session.get("user") is not None
@@ -233,6 +363,21 @@ def _last_upload_record(db, by_user):
     )
 
 
+def _enfileirar_rpa(extract_dir, target_folder):
+    """Single-flight: cliques repetidos devolvem o mesmo job enquanto ele estiver ativo."""
+    try:
+        priority = int(request.values.get("priority") or 0)
+    except ValueError:
+        priority = 0
+    return scheduler.enfileirar(
+        "rpa",
+        payload={"extract_dir": extract_dir, "target_folder": target_folder},
+        priority=priority,
+        requested_by=session.get("user"),
+        dedup_key="rpa",
+    )
+
+
 # ===== Views =====
 @app.route("/")
 @login_required
@@ -252,12 +397,9 @@ def start_rpa():
         os.makedirs(extract_dir, exist_ok=True)
     target_folder = os.path.join(extract_dir, "google.com")
     os.makedirs(target_folder, exist_ok=True)
-    t = threading.Thread(
-        target=run_rpa_enter_google_folder,
-        args=(extract_dir, target_folder, BASE_DIR),
-        daemon=True,
-    )
-    t.start()
+    job, criado = _enfileirar_rpa(extract_dir, target_folder)
+    if not criado:
+        flash("Já existe uma execução do RPA em andamento; acompanhando a mesma.")
     return redirect(url_for("report"))
 
 
@@ -276,51 +418,272 @@ def start_async():
     target_folder = os.path.join(extract_dir, "google.com")
     os.makedirs(target_folder, exist_ok=True)
 
-    t = threading.Thread(
-        target=run_rpa_enter_google_folder,
-        args=(extract_dir, target_folder, BASE_DIR),
-        daemon=True,
+    job, criado = _enfileirar_rpa(extract_dir, target_folder)
+    return jsonify({"ok": True, "job_id": job["id"], "status": job["status"],
+                    "deduplicado": not criado, "started_at": int(time.time())})
+
+
+@app.get("/api/jobs/<job_id>")
+@login_required
+def job_status(job_id):
+    job = scheduler.obter(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Job não encontrado."}), 404
+    return jsonify({"ok": True, "job": job})
+
+
+@app.post("/api/jobs/<job_id>/cancelar")
+@login_required
+def job_cancelar(job_id):
+    job = scheduler.cancelar(job_id)
+    if job is None:
+        return jsonify({"ok": False, "error": "Job não encontrado."}), 404
+    return jsonify({"ok": True, "job": job})
+
+
+@app.get("/api/worker")
+@login_required
+def worker_status():
+    """Estado do worker do RPA (navegador, tenants aquecidos, rodada atual)."""
+    if not WORKER_ATIVO:
+        return jsonify({"ok": False, "ativo": False})
+    resp = enviar_comando("status")
+    if resp is None:
+        return jsonify({"ok": False, "ativo": True, "error": "Worker fora do ar."}), 503
+    return jsonify({**resp, "ativo": True})
+
+
+@app.get("/api/runs/<run_id>/checkpoints")
+@login_required
+def run_checkpoints(run_id):
+    return jsonify({"ok": True, "run_id": run_id, "checkpoints": checkpoints.listar(run_id)})
+
+
+@app.get("/api/runs/<run_id>/timeline")
+@login_required
+def run_timeline(run_id):
+    return jsonify({"ok": True, "run_id": run_id, "spans": spans.timeline(run_id)})
+
+
+@app.get("/api/artifacts")
+@login_required
+def listar_artefatos():
+    """Traces/screenshots de falha indexados (?run_id=... filtra por execução)."""
+    return jsonify({"ok": True, "artifacts": artifacts.STORE.listar(request.args.get("run_id"))})
+
+
+@app.get("/api/artifacts/<int:artifact_id>")
+@login_required
+def baixar_artefato(artifact_id):
+    path = artifacts.STORE.abrir(artifact_id)
+    if path is None:
+        return jsonify({"ok": False, "error": "Artefato não encontrado (talvez já despejado)."}), 404
+    return send_file(path, as_attachment=True)
+
+
+@app.get("/api/archives")
+@login_required
+def listar_acervo():
+    """Índice do acervo de .zip (mais recente primeiro); o primeiro é o atual."""
+    return jsonify({"ok": True, "archives": archives.STORE.listar()})
+
+
+@app.get("/api/archives/<int:archive_id>")
+@login_required
+def detalhar_acervo(archive_id):
+    """Entrada do acervo com o manifesto (membros do diretório central); ?download=1 baixa o .zip."""
+    arq = archives.STORE.obter(archive_id)
+    if arq is None or (request.args.get("download") and not os.path.isfile(arq["path"])):
+        return jsonify({"ok": False, "error": "Arquivo não encontrado (talvez já despejado)."}), 404
+    if request.args.get("download"):
+        return send_file(arq["path"], as_attachment=True, download_name=arq["original_name"] or "arquivos.zip")
+    return jsonify({"ok": True, "archive": arq})
+
+
+@app.get("/api/metrics")
+def api_metrics():
+    """Texto Prometheus. Com RPA_METRICS_TOKEN, aceita Bearer/?token (scraper); senão exige login."""
+    token = os.getenv("RPA_METRICS_TOKEN", "").strip()
+    enviado = (request.headers.get("Authorization") or "").removeprefix("Bearer ").strip() or request.args.get("token")
+    if not ((token and enviado == token) or is_logged_in()):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(spans.prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.post("/api/runs/<run_id>/retomar")
+@login_required
+def run_retomar(run_id):
+    """Reenfileira a execução: pula unidades concluídas e etapas persistentes já feitas."""
+    if not checkpoints.listar(run_id):
+        return jsonify({"ok": False, "error": "Execução sem checkpoints."}), 404
+    extract_dir = os.path.join(EXTRACT_DIR, "temporario")
+    job, criado = scheduler.enfileirar(
+        "rpa",
+        payload={"extract_dir": extract_dir, "target_folder": os.path.join(extract_dir, "google.com"),
+                 "retomar": run_id},
+        requested_by=session.get("user"),
+        dedup_key="rpa",
     )
-    t.start()
+    if not criado:
+        # já existe rodada ativa: a retomada não foi enfileirada
+        return jsonify({"ok": False, "error": "Já existe uma execução do RPA na fila ou em andamento.",
+                        "job_id": job["id"], "deduplicado": True}), 409
+    return jsonify({"ok": True, "job_id": job["id"], "deduplicado": False})
 
-    return jsonify({"ok": True, "started_at": int(time.time())})
+
+@app.post("/api/sessoes/invalidar")
+@login_required
+def invalidar_sessoes():
+    """Descarta a sessão EVO em cache de um tenant (?tenant=...) ou de todos."""
+    tenant = (request.values.get("tenant") or "").strip() or None
+    removidos = invalidar_sessao(tenant)
+    return jsonify({"ok": True, "removidos": removidos})
+
+
+# ===== Respostas cacheadas (/api/report) =====
+# Várias abas fazem polling a cada 1,5 s: o corpo JSON (e suas versões comprimidas) é
+# montado uma vez por mudança do relatório e reaproveitado; ETag/Last-Modified deixam
+# o navegador revalidar com 304 sem corpo.
+COMPRIMIR_MIN_BYTES = int(os.getenv("COMPRIMIR_MIN_BYTES", "1024") or 1024)
+REPORT_CACHE_MAX = 64
+
+
+def _json_bytes(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _CorpoCacheado:
+    """Corpo JSON pronto + ETag; as variantes gzip/br são geradas sob demanda e guardadas."""
+
+    def __init__(self, dados: dict, last_modified=None) -> None:
+        self.corpo = _json_bytes(dados)
+        self.etag = '"' + hashlib.sha1(self.corpo).hexdigest()[:20] + '"'
+        self.last_modified = last_modified
+        self._variantes: dict = {}
+        self._lock = threading.Lock()
+
+    def codificado(self, accept_encoding: str):
+        if len(self.corpo) < COMPRIMIR_MIN_BYTES:
+            return self.corpo, None
+        aceitas = set()
+        for parte in (accept_encoding or "").lower().split(","):
+            nome, _, params = parte.strip().partition(";")
+            if nome and params.replace(" ", "") not in ("q=0", "q=0.0"):
+                aceitas.add(nome)
+        for enc in ("br", "gzip"):
+            if enc not in aceitas or (enc == "br" and brotli is None):
+                continue
+            with self._lock:
+                if enc not in self._variantes:
+                    self._variantes[enc] = (
+                        brotli.compress(self.corpo, quality=5) if enc == "br"
+                        else gzip.compress(self.corpo, compresslevel=6)
+                    )
+                return self._variantes[enc], enc
+        return self.corpo, None
+
+
+def _nao_modificado(entrada: _CorpoCacheado) -> bool:
+    inm = request.headers.get("If-None-Match")
+    if inm:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or entrada.etag in tags
+    ims = parse_date(request.headers.get("If-Modified-Since"))
+    if ims is not None and entrada.last_modified is not None:
+        return int(entrada.last_modified.timestamp()) <= int(ims.timestamp())
+    return False
+
+
+def _responder_cacheado(entrada: _CorpoCacheado) -> Response:
+    if _nao_modificado(entrada):
+        resp = Response(status=304)
+    else:
+        corpo, enc = entrada.codificado(request.headers.get("Accept-Encoding", ""))
+        resp = Response(corpo, mimetype="application/json")
+        if enc:
+            resp.headers["Content-Encoding"] = enc
+    resp.headers["ETag"] = entrada.etag
+    if entrada.last_modified is not None:
+        resp.headers["Last-Modified"] = http_date(entrada.last_modified.timestamp())
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.headers["Vary"] = "Accept-Encoding, Cookie"
+    return resp
+
+
+_REPORT_CACHE: "OrderedDict[tuple, _CorpoCacheado]" = OrderedDict()
+_REPORT_CACHE_LOCK = threading.Lock()
+
+
+def _report_cacheado(chave: tuple, montar) -> _CorpoCacheado:
+    """LRU pequeno: mesma chave (= mesmo estado do relatório) → mesmo corpo, sem reconsultar."""
+    with _REPORT_CACHE_LOCK:
+        entrada = _REPORT_CACHE.get(chave)
+        if entrada is not None:
+            _REPORT_CACHE.move_to_end(chave)
+            return entrada
+    entrada = montar()
+    with _REPORT_CACHE_LOCK:
+        _REPORT_CACHE[chave] = entrada
+        while len(_REPORT_CACHE) > REPORT_CACHE_MAX:
+            _REPORT_CACHE.popitem(last=False)
+    return entrada
 
 
 @app.get("/api/report")
 @login_required
 def api_report():
+    """
+    Eventos da execução (run_events) por cursor: ?since=<id> devolve só o que é novo
+    (use o `cursor` da resposta na próxima chamada); ?run_id= escolhe a execução
+    (padrão: a mais recente). Sem eventos no banco, cai no last_report.json antigo.
+    Responde com ETag/Last-Modified (304 se nada mudou) e gzip/br para corpos grandes.
+    """
+    run_id = request.args.get("run_id") or run_events.ultimo_run_id()
+    if run_id:
+        try:
+            since = max(0, int(request.args.get("since") or 0))
+        except ValueError:
+            since = 0
+        ultimo_id, ultimo_ts = run_events.estado(run_id)
+
+        def montar() -> _CorpoCacheado:
+            parte = run_events.consultar(run_id, since)
+            return _CorpoCacheado(
+                {
+                    "ready": True,
+                    "run_id": run_id,
+                    "headers": run_events.HEADERS,
+                    "rows": parte["rows"],
+                    "cursor": parte["cursor"],
+                    "mais": parte["mais"],
+                    "finished": parte["finished"],
+                    "incremental": since > 0,
+                    "meta": {},
+                    "updated_at": (ultimo_ts or datetime.now()).strftime("%d/%m/%Y %H:%M:%S"),
+                },
+                last_modified=ultimo_ts,
+            )
+
+        return _responder_cacheado(_report_cacheado(("run", run_id, since, ultimo_id), montar))
+    return _api_report_arquivo()
+
+
+def _api_report_arquivo():
     report_path = os.path.join(BASE_DIR, "last_report.json")
 
-    if not os.path.isfile(report_path):
+    try:
+        st = os.stat(report_path)
+    except OSError:
         return jsonify(
             {"ready": False, "headers": [], "rows": [], "meta": {}, "updated_at": None, "mtime": 0}
         )
 
+    # um parse por versão do arquivo (mtime + tamanho), não um por polling
+    chave = ("arquivo", report_path, st.st_mtime_ns, st.st_size)
     try:
-        with open(report_path, "r", encoding="utf-8") as f:
-            data = json.load(f) or {}
-
-        mtime = int(os.path.getmtime(report_path))
-
-        if isinstance(data, list):
-            headers = list(data[0].keys()) if data else []
-            data = {
-                "ready": True,
-                "updated_at": datetime.fromtimestamp(mtime).strftime("%d/%m/%Y %H:%M:%S"),
-                "headers": headers,
-                "rows": data,
-                "meta": {},
-            }
-
-        data.setdefault("ready", True)
-        data.setdefault("rows", [])
-        data.setdefault("headers", (list(data["rows"][0].keys()) if data["rows"] else []))
-        data.setdefault("meta", {})
-        data.setdefault("updated_at", datetime.fromtimestamp(mtime).strftime("%d/%m/%Y %H:%M:%S"))
-        data["mtime"] = mtime
-
-        return jsonify(data)
-
+        return _responder_cacheado(_report_cacheado(chave, lambda: _ler_report_arquivo(report_path, st.st_mtime)))
     except Exception as e:
         return jsonify(
             {
@@ -335,6 +698,102 @@ def api_report():
         )
 
 
+def _ler_report_arquivo(report_path: str, st_mtime: float) -> _CorpoCacheado:
+    with open(report_path, "r", encoding="utf-8") as f:
+        data = json.load(f) or {}
+
+    mtime = int(st_mtime)
+
+    if isinstance(data, list):
+        headers = list(data[0].keys()) if data else []
+        data = {
+            "ready": True,
+            "updated_at": datetime.fromtimestamp(mtime).strftime("%d/%m/%Y %H:%M:%S"),
+            "headers": headers,
+            "rows": data,
+            "meta": {},
+        }
+
+    data.setdefault("ready", True)
+    data.setdefault("rows", [])
+    data.setdefault("headers", (list(data["rows"][0].keys()) if data["rows"] else []))
+    data.setdefault("meta", {})
+    data.setdefault("updated_at", datetime.fromtimestamp(mtime).strftime("%d/%m/%Y %H:%M:%S"))
+    data["mtime"] = mtime
+
+    return _CorpoCacheado(data, last_modified=datetime.fromtimestamp(mtime))
+
+
+# ===== Stream de eventos (SSE) =====
+SSE_ESPERA_S = float(os.getenv("RPA_SSE_ESPERA_S", "1") or 1)
+SSE_KEEPALIVE_S = 15.0
+# a conexão fecha sozinha de tempos em tempos; o EventSource reconecta com Last-Event-ID
+SSE_MAX_S = float(os.getenv("RPA_SSE_MAX_S", "600") or 600)
+
+
+def _sse(dados, evento=None, event_id=None) -> str:
+    linhas = []
+    if evento:
+        linhas.append(f"event: {evento}")
+    if event_id is not None:
+        linhas.append(f"id: {event_id}")
+    linhas.append("data: " + _json_bytes(dados).decode("utf-8"))
+    return "\n".join(linhas) + "\n\n"
+
+
+@app.get("/api/report/stream")
+@login_required
+def api_report_stream():
+    """
+    Server-Sent Events da execução: cada linha nova de run_events vira uma mensagem
+    (id = id do evento, `kind` no JSON). Retoma de Last-Event-ID (ou ?since=).
+    Eventos de controle: `inicio` (run_id + headers), `fim` (run_fim gravado) e
+    `vazio` (nenhuma execução no banco; o cliente volta ao /api/report).
+    """
+    run_id = request.args.get("run_id") or run_events.ultimo_run_id()
+    try:
+        since = max(0, int(request.headers.get("Last-Event-ID") or request.args.get("since") or 0))
+    except ValueError:
+        since = 0
+
+    def gerar():
+        if not run_id:
+            yield _sse({}, "vazio")
+            return
+        yield "retry: 3000\n\n" + _sse({"run_id": run_id, "headers": run_events.HEADERS}, "inicio")
+        cursor = since
+        fim_conexao = time.monotonic() + SSE_MAX_S
+        ultimo_envio = time.monotonic()
+        marca = run_events.marca()
+        consultar = True
+        while time.monotonic() < fim_conexao:
+            if consultar:
+                parte = run_events.consultar(run_id, cursor)
+                if parte["rows"]:
+                    yield "".join(_sse(row, event_id=row["id"]) for row in parte["rows"])
+                    ultimo_envio = time.monotonic()
+                cursor = parte["cursor"]
+                if parte["mais"]:
+                    continue
+                if parte["finished"]:
+                    yield _sse({"run_id": run_id, "cursor": cursor}, "fim")
+                    return
+            keepalive = time.monotonic() - ultimo_envio >= SSE_KEEPALIVE_S
+            if keepalive:
+                # comentário SSE: mantém proxies abertos e detecta cliente desconectado
+                yield ": keepalive\n\n"
+                ultimo_envio = time.monotonic()
+            # o banco só é consultado quando a marca d'água muda (ou sem marca, a cada espera)
+            nova = run_events.aguardar_novos(SSE_ESPERA_S, marca)
+            consultar = nova is None or nova != marca or keepalive
+            marca = nova
+
+    resp = Response(stream_with_context(gerar()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
 @app.route("/uploads/<path:filename>")
 @login_required
 def uploaded_file(filename):
@@ -344,6 +803,14 @@ def uploaded_file(filename):
 # ===== Registra o Blueprint =====
 app.register_blueprint(bp)
 
+# ===== Scheduler =====
+# Com o reloader do Flask, só o processo filho (WERKZEUG_RUN_MAIN) despacha jobs.
+SCHEDULER = scheduler.Scheduler()
+if os.getenv("RPA_SCHEDULER", "1").strip() == "1" and (
+    os.environ.get("WERKZEUG_RUN_MAIN") == "true" or __name__ != "__main__"
+):
+    SCHEDULER.iniciar()
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "5000"))
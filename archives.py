@@ -0,0 +1,249 @@
+# archives.py
+# Acervo dos .zip recebidos, endereçado por conteúdo: cada SHA-256 é gravado uma vez
+# em <raiz>/<2 primeiros>/<sha>.zip e indexado na tabela archives com o manifesto
+# (lido do diretório central), a origem e as datas. O "arquivo atual" sai do índice
+# (maior last_seen_at). O arquivos.zip é um hard link para a entrada do acervo (uma
+# cópia só), com cópia comum quando o link não é possível. Retenção por quantidade,
+# idade e bytes.
+# Importar os .zip antigos de uma pasta:  python archives.py importar uploads [--mover]
+import os
+import json
+import platform
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from db import SessionLocal
+from models import Archive
+
+def _pasta_padrao() -> Path:
+    """Ao lado do arquivos.zip (mesmo volume: o arquivo atual vira hard link do acervo)."""
+    if platform.system() == "Windows":
+        base = os.getenv("CNAB_LOCAL_DIR_WINDOWS", r"C:\AUTOMACAO\conciliacao\arquivos")
+    else:
+        base = os.getenv("CNAB_LOCAL_DIR", "/home/felipe/Downloads/arquivos")
+    return Path(base) / ".acervo"
+
+
+ACERVO_DIR = Path(os.getenv("ARCHIVE_DIR") or _pasta_padrao())
+MAX_QTD = int(os.getenv("ARCHIVE_MAX_QTD", "50") or 50)
+MAX_DIAS = float(os.getenv("ARCHIVE_MAX_DIAS", "180") or 180)
+MAX_BYTES = int(float(os.getenv("ARCHIVE_MAX_MB", "2048") or 2048) * 1024 * 1024)
+
+_BLOCO = 1024 * 1024
+
+
+def manifesto(caminho) -> List[dict]:
+    """Membros do ZIP pelo diretório central (nada é descompactado)."""
+    with zipfile.ZipFile(caminho) as zf:
+        return [
+            {
+                "name": i.filename,
+                "size": i.file_size,
+                "compressed_size": i.compress_size,
+                "crc": f"{i.CRC:08x}",
+                "modified": "%04d-%02d-%02dT%02d:%02d:%02d" % i.date_time,
+            }
+            for i in zf.infolist()
+            if not i.is_dir()
+        ]
+
+
+def sha256_arquivo(caminho) -> str:
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(_BLOCO), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def vincular(origem: str, destino: str) -> bool:
+    """
+    Troca `destino` (atomicamente) por um hard link de `origem`. False quando o link
+    não é possível (volumes diferentes, FS sem suporte); aí o chamador copia.
+    """
+    pasta = os.path.dirname(destino) or "."
+    tmp = os.path.join(pasta, f".link-{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        os.link(origem, tmp)
+        os.replace(tmp, destino)
+        return True
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+
+
+def archive_dict(a: Archive, com_manifesto: bool = False) -> dict:
+    d = {
+        "id": a.id,
+        "sha256": a.sha256,
+        "size_bytes": a.size_bytes,
+        "path": a.path,
+        "original_name": a.original_name,
+        "source": a.source,
+        "membros": a.membros,
+        "created_at": a.created_at.isoformat() + "Z" if a.created_at else None,
+        "last_seen_at": a.last_seen_at.isoformat() + "Z" if a.last_seen_at else None,
+    }
+    if com_manifesto:
+        d["manifest"] = json.loads(a.manifest) if a.manifest else []
+    return d
+
+
+class ArchiveStore:
+    """Só apaga o que está indexado; o arquivo atual (maior last_seen_at) nunca é despejado."""
+
+    def __init__(self, raiz: Path, max_qtd: int = MAX_QTD, max_dias: float = MAX_DIAS,
+                 max_bytes: int = MAX_BYTES) -> None:
+        self.raiz = raiz
+        self.max_qtd = max_qtd
+        self.max_dias = max_dias
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def caminho(self, sha256: str) -> Path:
+        return self.raiz / sha256[:2] / f"{sha256}.zip"
+
+    def _gravar(self, origem: str, destino: Path) -> None:
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        if vincular(origem, str(destino)):
+            return
+        fd, tmp = tempfile.mkstemp(prefix=".acervo-", suffix=".part", dir=destino.parent)
+        try:
+            with os.fdopen(fd, "wb") as dst, open(origem, "rb") as src:
+                shutil.copyfileobj(src, dst, _BLOCO)
+            os.replace(tmp, destino)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def adicionar(self, origem: str, sha256: str, size_bytes: int, source: str,
+                  nome: Optional[str] = None, visto_em: Optional[datetime] = None) -> dict:
+        """
+        Indexa um .zip já validado. Conteúdo repetido só atualiza last_seen_at
+        (nada é copiado); conteúdo novo é copiado para o acervo e a retenção roda.
+        """
+        agora = visto_em or datetime.utcnow()
+        with self._lock:
+            with SessionLocal() as db:
+                a = db.query(Archive).filter_by(sha256=sha256).first()
+                if a is not None and os.path.isfile(a.path):
+                    if a.last_seen_at is None or agora > a.last_seen_at:
+                        a.last_seen_at = agora
+                    db.commit()
+                    return archive_dict(a)
+            destino = self.caminho(sha256)
+            self._gravar(origem, destino)
+            membros = manifesto(destino)
+            with SessionLocal() as db:
+                a = db.query(Archive).filter_by(sha256=sha256).first()
+                if a is None:
+                    a = Archive(sha256=sha256, created_at=agora)
+                    db.add(a)
+                a.size_bytes = size_bytes
+                a.path = str(destino)
+                a.original_name = (nome or os.path.basename(origem))[:255]
+                a.source = source
+                a.membros = len(membros)
+                a.manifest = json.dumps(membros, ensure_ascii=False)
+                a.last_seen_at = agora
+                db.commit()
+                dados = archive_dict(a)
+        self.podar()
+        return dados
+
+    def importar_arquivo(self, caminho: str, source: str = "importado", mover: bool = False) -> Optional[dict]:
+        """Indexa um .zip solto (data = mtime do arquivo). ZIP inválido → None."""
+        try:
+            manifesto(caminho)
+        except (zipfile.BadZipFile, OSError):
+            return None
+        visto_em = datetime.utcfromtimestamp(os.path.getmtime(caminho))
+        dados = self.adicionar(caminho, sha256_arquivo(caminho), os.path.getsize(caminho), source,
+                               visto_em=visto_em)
+        if mover and os.path.abspath(caminho) != os.path.abspath(dados["path"]):
+            os.remove(caminho)
+        return dados
+
+    def importar_pasta(self, pasta: str, mover: bool = False) -> List[dict]:
+        arquivos = sorted(Path(pasta).glob("*.zip"), key=lambda p: p.stat().st_mtime)
+        return [d for d in (self.importar_arquivo(str(p), mover=mover) for p in arquivos) if d]
+
+    def podar(self) -> List[str]:
+        """Do mais recente para o mais antigo: mantém até max_qtd / max_bytes e nada além de max_dias."""
+        removidos: List[str] = []
+        with self._lock, SessionLocal() as db:
+            todos = db.query(Archive).order_by(Archive.last_seen_at.desc(), Archive.id.desc()).all()
+            if not todos:
+                return removidos
+            limite = datetime.utcnow() - timedelta(days=self.max_dias)
+            mantidos = 1
+            total = todos[0].size_bytes or 0
+            vitimas = []
+            for a in todos[1:]:
+                tamanho = a.size_bytes or 0
+                if (
+                    (self.max_qtd and mantidos >= self.max_qtd)
+                    or (a.last_seen_at is not None and a.last_seen_at < limite)
+                    or (self.max_bytes and total + tamanho > self.max_bytes)
+                ):
+                    vitimas.append(a)
+                    continue
+                mantidos += 1
+                total += tamanho
+            for a in vitimas:
+                try:
+                    os.remove(a.path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                removidos.append(a.path)
+                db.delete(a)
+            db.commit()
+        return removidos
+
+    def atual(self) -> Optional[dict]:
+        with SessionLocal() as db:
+            a = db.query(Archive).order_by(Archive.last_seen_at.desc(), Archive.id.desc()).first()
+            return archive_dict(a) if a is not None and os.path.isfile(a.path) else None
+
+    def obter(self, archive_id: int) -> Optional[dict]:
+        with SessionLocal() as db:
+            a = db.get(Archive, archive_id)
+            return archive_dict(a, com_manifesto=True) if a is not None else None
+
+    def listar(self, limite: int = 200) -> List[dict]:
+        with SessionLocal() as db:
+            q = db.query(Archive).order_by(Archive.last_seen_at.desc(), Archive.id.desc()).limit(limite)
+            return [archive_dict(a) for a in q]
+
+
+STORE = ArchiveStore(ACERVO_DIR)
+
+
+if __name__ == "__main__":
+    from db import init_db_and_seed_admin
+    init_db_and_seed_admin()
+    ap = argparse.ArgumentParser(description="Acervo de .zip endereçado por conteúdo.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("importar", help="indexa os .zip de uma pasta no acervo")
+    imp.add_argument("pasta")
+    imp.add_argument("--mover", action="store_true", help="apaga os originais depois de indexar")
+    sub.add_parser("podar", help="aplica a retenção agora")
+    a = ap.parse_args()
+    if a.cmd == "importar":
+        for d in STORE.importar_pasta(a.pasta, mover=a.mover):
+            print(f"{d['sha256'][:12]}  {d['size_bytes']:>12}  {d['original_name']}")
+    else:
+        for p in STORE.podar():
+            print(f"removido: {p}")
@@ -0,0 +1,109 @@
+# artifacts.py
+# Pasta de artefatos de falha (traces do Playwright, screenshots) com teto de
+# tamanho e idade, despejo LRU e índice no banco (tabela artifacts).
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from db import SessionLocal
+from models import Artifact
+
+ARTEFATOS_DIR = Path(os.getenv("RPA_ARTEFATOS_DIR", str(Path.home() / "Downloads" / "faturamento_academia")))
+MAX_BYTES = int(float(os.getenv("RPA_ARTEFATOS_MAX_MB", "500") or 500) * 1024 * 1024)
+MAX_DIAS = float(os.getenv("RPA_ARTEFATOS_MAX_DIAS", "14") or 14)
+
+
+def artifact_dict(a: Artifact) -> dict:
+    return {
+        "id": a.id,
+        "run_id": a.run_id,
+        "tenant": a.tenant,
+        "unidade": a.unidade,
+        "tipo": a.tipo,
+        "nome": os.path.basename(a.path),
+        "size_bytes": a.size_bytes,
+        "created_at": a.created_at.isoformat() + "Z" if a.created_at else None,
+        "last_access_at": a.last_access_at.isoformat() + "Z" if a.last_access_at else None,
+    }
+
+
+class ArtifactStore:
+    """Só apaga o que está indexado: arquivos antigos da pasta ficam intocados."""
+
+    def __init__(self, raiz: Path, max_bytes: int = MAX_BYTES, max_dias: float = MAX_DIAS) -> None:
+        self.raiz = raiz
+        self.max_bytes = max_bytes
+        self.max_dias = max_dias
+        self._lock = threading.Lock()
+
+    def caminho(self, tenant: Optional[str], nome: str) -> Path:
+        pasta = self.raiz / (tenant or "geral")
+        pasta.mkdir(parents=True, exist_ok=True)
+        return pasta / nome
+
+    def adicionar(self, caminho: Path, tipo: str, run_id: Optional[str] = None,
+                  tenant: Optional[str] = None, unidade: Optional[str] = None) -> Optional[dict]:
+        """Indexa um arquivo já gravado em caminho(...) e aplica os tetos."""
+        if not caminho.is_file():
+            return None
+        agora = datetime.utcnow()
+        with SessionLocal() as db:
+            a = Artifact(run_id=run_id, tenant=tenant, unidade=unidade, tipo=tipo, path=str(caminho),
+                         size_bytes=caminho.stat().st_size, created_at=agora, last_access_at=agora)
+            db.add(a)
+            db.commit()
+            dados = artifact_dict(a)
+        self.podar()
+        return dados
+
+    def podar(self) -> List[str]:
+        """Remove os vencidos por idade e, acima do teto de bytes, os menos acessados (LRU)."""
+        removidos: List[str] = []
+        with self._lock, SessionLocal() as db:
+            limite = datetime.utcnow() - timedelta(days=self.max_dias)
+            vitimas = db.query(Artifact).filter(Artifact.created_at < limite).all()
+            vivos = (
+                db.query(Artifact)
+                .filter(Artifact.created_at >= limite)
+                .order_by(Artifact.last_access_at.asc(), Artifact.id.asc())
+                .all()
+            )
+            total = sum(a.size_bytes or 0 for a in vivos)
+            for a in vivos:
+                if total <= self.max_bytes:
+                    break
+                vitimas.append(a)
+                total -= a.size_bytes or 0
+            for a in vitimas:
+                try:
+                    os.remove(a.path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                removidos.append(a.path)
+                db.delete(a)
+            db.commit()
+        return removidos
+
+    def listar(self, run_id: Optional[str] = None, limite: int = 200) -> List[dict]:
+        with SessionLocal() as db:
+            q = db.query(Artifact)
+            if run_id:
+                q = q.filter(Artifact.run_id == run_id)
+            return [artifact_dict(a) for a in q.order_by(Artifact.created_at.desc()).limit(limite)]
+
+    def abrir(self, artifact_id: int) -> Optional[str]:
+        """Caminho para download; conta como acesso (LRU)."""
+        with SessionLocal() as db:
+            a = db.get(Artifact, artifact_id)
+            if a is None or not os.path.isfile(a.path):
+                return None
+            a.last_access_at = datetime.utcnow()
+            db.commit()
+            return a.path
+
+
+STORE = ArtifactStore(ARTEFATOS_DIR)
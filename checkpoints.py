@@ -0,0 +1,82 @@
+# checkpoints.py
+# Checkpoints por execução/tenant/unidade/etapa (tabela checkpoints), usados para
+# retomar uma execução que falhou no meio sem refazer o que já foi concluído.
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from db import SessionLocal
+from models import Checkpoint
+
+# Etapa sentinela: a unidade inteira terminou
+UNIDADE_CONCLUIDA = "unidade"
+
+Chave = Tuple[str, str, str]
+
+
+def registrar(run_id: str, tenant: str, unidade: str, etapa: str, status: str,
+              data=None, erro: Optional[str] = None) -> None:
+    """Upsert do checkpoint (uma linha por run/tenant/unidade/etapa)."""
+    registrar_lote([{"run_id": run_id, "tenant": tenant, "unidade": unidade, "etapa": etapa,
+                     "status": status, "data": data, "erro": erro}])
+
+
+def registrar_lote(lote: List[dict]) -> None:
+    """Vários upserts numa transação, na ordem do lote (o último de cada chave prevalece)."""
+    if not lote:
+        return
+    ultimos: Dict[Tuple[str, str, str, str], dict] = {}
+    for item in lote:
+        ultimos[(item["run_id"], item["tenant"], item["unidade"], item["etapa"])] = item
+    with SessionLocal() as db:
+        for item in ultimos.values():
+            cp = (
+                db.query(Checkpoint)
+                .filter_by(run_id=item["run_id"], tenant=item["tenant"], unidade=item["unidade"],
+                           etapa=item["etapa"])
+                .first()
+            )
+            if cp is None:
+                cp = Checkpoint(run_id=item["run_id"], tenant=item["tenant"], unidade=item["unidade"],
+                                etapa=item["etapa"])
+                db.add(cp)
+            data = item.get("data")
+            cp.status = item["status"]
+            cp.data = json.dumps(data, ensure_ascii=False, default=str) if data is not None else None
+            cp.error = item.get("erro")
+            cp.updated_at = datetime.utcnow()
+        db.commit()
+
+
+def carregar(run_id: str) -> Dict[Chave, dict]:
+    """{(tenant, unidade, etapa): {"status", "data", "error"}} da execução."""
+    out: Dict[Chave, dict] = {}
+    with SessionLocal() as db:
+        for cp in db.query(Checkpoint).filter_by(run_id=run_id):
+            try:
+                data = json.loads(cp.data) if cp.data else None
+            except ValueError:
+                data = None
+            out[(cp.tenant, cp.unidade, cp.etapa)] = {"status": cp.status, "data": data, "error": cp.error}
+    return out
+
+
+def listar(run_id: str) -> List[dict]:
+    with SessionLocal() as db:
+        rows = (
+            db.query(Checkpoint)
+            .filter_by(run_id=run_id)
+            .order_by(Checkpoint.updated_at.asc(), Checkpoint.id.asc())
+            .all()
+        )
+        return [
+            {
+                "tenant": cp.tenant,
+                "unidade": cp.unidade,
+                "etapa": cp.etapa,
+                "status": cp.status,
+                "error": cp.error,
+                "updated_at": cp.updated_at.isoformat() + "Z" if cp.updated_at else None,
+            }
+            for cp in rows
+        ]
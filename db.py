@@ -1,6 +1,6 @@
 # filename: db.py
 import os
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.engine.url import make_url, URL
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -142,9 +142,31 @@ else:
 
 SessionLocal = scoped_session(sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True))
 
+def _adicionar_colunas_novas(metadata):
+    """
+    create_all não altera tabelas existentes: colunas novas (anuláveis) dos modelos
+    entram aqui com ALTER TABLE ... ADD COLUMN, e os índices novos com CREATE INDEX.
+    """
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for tabela in metadata.sorted_tables:
+            if not insp.has_table(tabela.name):
+                continue
+            existentes = {c["name"] for c in insp.get_columns(tabela.name)}
+            for col in tabela.columns:
+                if col.name in existentes or not col.nullable:
+                    continue
+                tipo = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{tabela.name}" ADD COLUMN "{col.name}" {tipo}'))
+            indices = {i["name"] for i in insp.get_indexes(tabela.name)}
+            for indice in tabela.indexes:
+                if indice.name not in indices:
+                    indice.create(conn)
+
 def init_db_and_seed_admin():
     from models import Base as ModelsBase  # noqa
     ModelsBase.metadata.create_all(engine)
+    _adicionar_colunas_novas(ModelsBase.metadata)
     with SessionLocal() as db:
         admin = db.query(User).filter_by(username='admin').first()
         if not admin:
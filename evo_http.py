@@ -0,0 +1,206 @@
+# evo_http.py
+# Motor HTTP direto para as etapas de NFS do EVO (listar, status de cliente, enviar).
+# O Playwright só faz o login; aqui reaproveitamos cookies + token da sessão
+# (storage_state) num cliente httpx assíncrono com pool de conexões.
+import os
+import re
+import json
+import asyncio
+import argparse
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import httpx
+
+from rpa import _json_itens, _json_total
+
+# =========================
+# Endpoints (configuráveis pelo .env)
+# =========================
+EVO_API_BASE = os.getenv("EVO_API_BASE", "https://evo5.w12app.com.br").rstrip("/")
+ROTA_UNIDADES = os.getenv("EVO_API_UNIDADES", "/api/v1/unidades")
+ROTA_NFS_LISTAR = os.getenv("EVO_API_NFS_LISTAR", "/api/v1/financeiro/notas-fiscais-servico")
+ROTA_CLIENTE_STATUS = os.getenv("EVO_API_CLIENTE_STATUS", "/api/v1/clientes/{cliente_id}/status-cadastro")
+ROTA_NFS_ENVIAR = os.getenv("EVO_API_NFS_ENVIAR", "/api/v1/financeiro/notas-fiscais-servico/enviar")
+
+PAGE_SIZE = int(os.getenv("EVO_API_PAGE_SIZE", "100") or 100)
+MAX_CONEXOES = int(os.getenv("EVO_API_MAX_CONEXOES", "10") or 10)
+TIMEOUT_S = float(os.getenv("EVO_API_TIMEOUT_S", "30") or 30)
+
+def _token_do_storage(storage_state: dict) -> Optional[str]:
+    """Procura o token de acesso no localStorage salvo (chaves com 'token')."""
+    for origin in storage_state.get("origins") or []:
+        for item in origin.get("localStorage") or []:
+            nome = str(item.get("name") or "")
+            if re.search(r"token", nome, re.IGNORECASE) and item.get("value"):
+                valor = str(item["value"]).strip().strip('"')
+                if valor.startswith("{"):
+                    try:
+                        obj = json.loads(valor)
+                        valor = obj.get("access_token") or obj.get("token") or ""
+                    except ValueError:
+                        continue
+                if valor:
+                    return valor
+    return None
+
+
+class EvoHttpClient:
+    """
+    Cliente assíncrono dos endpoints de NFS do EVO.
+    Uso:
+        async with EvoHttpClient(storage_state, tenant) as api:
+            itens = await api.listar_nfs(unidade_id, inicio, fim)
+    """
+
+    def __init__(self, storage_state: dict, tenant: str, base_url: Optional[str] = None,
+                 max_conexoes: int = MAX_CONEXOES) -> None:
+        self.tenant = tenant
+        self.base_url = (base_url or EVO_API_BASE).rstrip("/")
+        cookies = httpx.Cookies()
+        for c in storage_state.get("cookies") or []:
+            cookies.set(c["name"], c["value"], domain=str(c.get("domain") or "").lstrip("."), path=c.get("path") or "/")
+        headers = {"Accept": "application/json", "X-Tenant": tenant}
+        token = _token_do_storage(storage_state)
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        self._sem = asyncio.Semaphore(max_conexoes)
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            cookies=cookies,
+            headers=headers,
+            timeout=httpx.Timeout(TIMEOUT_S),
+            limits=httpx.Limits(max_connections=max_conexoes, max_keepalive_connections=max_conexoes),
+        )
+
+    async def __aenter__(self) -> "EvoHttpClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def _json(self, method: str, rota: str, **kwargs):
+        async with self._sem:
+            resp = await self._http.request(method, rota, **kwargs)
+        if resp.status_code in (401, 403):
+            raise PermissionError(f"Sessão rejeitada pelo EVO ({resp.status_code}) em {rota}")
+        resp.raise_for_status()
+        return resp.json() if resp.content else None
+
+    async def listar_unidades(self) -> List[dict]:
+        return _json_itens(await self._json("GET", ROTA_UNIDADES)) or []
+
+    async def listar_nfs(self, unidade_id: str, inicio: date, fim: date) -> List[dict]:
+        """
+        Lista as NFS do período (data de lançamento), percorrendo as páginas.
+        Para na página curta, ao atingir o total informado ou quando uma página
+        repete a anterior (API que ignora o parâmetro de página).
+        """
+        itens: List[dict] = []
+        anterior = None
+        pagina = 1
+        while True:
+            payload = await self._json("GET", ROTA_NFS_LISTAR, params={
+                "idUnidade": unidade_id,
+                "dataInicio": inicio.isoformat(),
+                "dataFim": fim.isoformat(),
+                "tipoData": "lancamento",
+                "page": pagina,
+                "size": PAGE_SIZE,
+            })
+            lote = _json_itens(payload) or []
+            assinatura = json.dumps(lote, sort_keys=True, default=str)
+            if lote and assinatura == anterior:
+                return itens
+            anterior = assinatura
+            itens.extend(lote)
+            total = _json_total(payload)
+            if len(lote) < PAGE_SIZE or (total is not None and len(itens) >= total):
+                return itens
+            pagina += 1
+
+    async def status_clientes(self, cliente_ids: List[str]) -> dict:
+        """Status de cadastro por cliente (consultas concorrentes, limitadas pelo pool)."""
+        async def _um(cid: str):
+            try:
+                return cid, await self._json("GET", ROTA_CLIENTE_STATUS.format(cliente_id=cid))
+            except (httpx.HTTPError, PermissionError, ValueError):
+                # um cliente sem resposta utilizável cai no caminho do navegador
+                return cid, None
+        pares = await asyncio.gather(*(_um(c) for c in dict.fromkeys(cliente_ids)))
+        return {cid: payload for cid, payload in pares if payload is not None}
+
+    async def enviar_nfs(self, unidade_id: str, nf_ids: List[str], data_emissao: date):
+        return await self._json("POST", ROTA_NFS_ENVIAR, json={
+            "idUnidade": unidade_id,
+            "ids": list(nf_ids),
+            "dataEmissao": data_emissao.isoformat(),
+        })
+
+
+# =========================
+# Servidor substituto com respostas gravadas (testes locais)
+# =========================
+def _chave_gravacao(method: str, path: str, com_query: bool = True) -> str:
+    """'METHOD /path?query' com a query ordenada (páginas diferentes = gravações diferentes)."""
+    partes = urlsplit(path)
+    chave = f"{method.upper()} {partes.path.rstrip('/') or '/'}"
+    query = sorted(parse_qsl(partes.query, keep_blank_values=True))
+    return f"{chave}?{urlencode(query)}" if com_query and query else chave
+
+
+def carregar_gravacoes(pasta: str) -> dict:
+    """Lê os .json gravados (RPA_CAPTURE_DIR): {"method","path","status","body"} → índice por 'METHOD /path?query'."""
+    respostas: dict = {}
+    for arq in sorted(Path(pasta).glob("*.json")):
+        try:
+            with open(arq, "r", encoding="utf-8") as f:
+                g = json.load(f)
+            respostas[_chave_gravacao(g.get("method") or "GET", g["path"])] = g
+        except (OSError, ValueError, KeyError):
+            continue
+    return respostas
+
+
+def servidor_gravado(pasta: str, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """Sobe um servidor HTTP que responde com as gravações da pasta (use com EVO_API_BASE)."""
+    respostas = carregar_gravacoes(pasta)
+
+    class _Handler(BaseHTTPRequestHandler):
+        def _responder(self) -> None:
+            generico = re.sub(r"/\d+(?=/|$)", "/{id}", urlsplit(self.path).path)
+            # exata (com query) → mesma rota sem query → rota com id genérico (ex.: /clientes/{id}/status)
+            g = (respostas.get(_chave_gravacao(self.command, self.path))
+                 or respostas.get(_chave_gravacao(self.command, self.path, com_query=False))
+                 or respostas.get(_chave_gravacao(self.command, generico, com_query=False)))
+            corpo = json.dumps(g.get("body") if g else {"erro": "sem gravação"}, ensure_ascii=False).encode("utf-8")
+            self.send_response(int(g.get("status") or 200) if g else 404)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        do_GET = _responder
+        do_POST = _responder
+
+        def log_message(self, fmt, *args) -> None:
+            print(f"[evo-stub] {fmt % args}", flush=True)
+
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    print(f"[evo-stub] {len(respostas)} gravações de {pasta} em http://{host}:{port}", flush=True)
+    return srv
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Servidor substituto do EVO com respostas gravadas.")
+    ap.add_argument("pasta", help="pasta com as gravações (RPA_CAPTURE_DIR)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    a = ap.parse_args()
+    servidor_gravado(a.pasta, a.host, a.port).serve_forever()
@@ -0,0 +1,87 @@
+# lotes.py
+# Gravação em lote fora do event loop: enfileirar() só põe o item na fila; uma thread
+# em segundo plano junta os itens e chama a função de gravação (mesmo esquema da
+# thread escritora do rpa_logging). Usado pelos spans e checkpoints do RPA.
+import queue
+import atexit
+import threading
+from typing import Any, Callable, List, Optional
+
+import rpa_logging
+
+LOTE_MAX = 500
+INTERVALO_S = 0.5
+
+_FIM = object()
+
+
+class GravadorEmLote:
+    """Fila sem limite (nada é descartado) + thread que grava em lote, na ordem de chegada."""
+
+    def __init__(self, nome: str, gravar: Callable[[List[Any]], None], lote_max: int = LOTE_MAX) -> None:
+        self.nome = nome
+        self.gravar = gravar
+        self.lote_max = lote_max
+        self._fila: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _garantir_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+                self._thread.start()
+                atexit.register(self.fechar)
+
+    def enfileirar(self, item: Any) -> None:
+        self._garantir_thread()
+        self._fila.put_nowait(item)
+
+    def descarregar(self, timeout: float = 10.0) -> bool:
+        """Espera a thread gravar tudo o que já foi enfileirado (bloqueia: fora do event loop)."""
+        if self._thread is None:
+            return True
+        marco = threading.Event()
+        self._fila.put(marco)
+        return marco.wait(timeout)
+
+    def fechar(self, timeout: float = 5.0) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._fila.put(_FIM)
+        self._thread.join(timeout)
+
+    # --- thread gravadora ---
+    def _loop(self) -> None:
+        while True:
+            try:
+                item = self._fila.get(timeout=INTERVALO_S)
+            except queue.Empty:
+                continue
+            lote: List[Any] = []
+            marcos: List[threading.Event] = []
+            fim = item is _FIM
+            while True:
+                if isinstance(item, threading.Event):
+                    marcos.append(item)
+                elif item is not _FIM:
+                    lote.append(item)
+                if fim or len(lote) >= self.lote_max:
+                    break
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                fim = item is _FIM
+            if lote:
+                try:
+                    self.gravar(lote)
+                except Exception as e:
+                    rpa_logging.emitir(f"[{self.nome}] Falha ao gravar lote de {len(lote)} item(ns): {e!r}",
+                                       "WARNING")
+            for marco in marcos:
+                marco.set()
+            if fim:
+                return
@@ -2,7 +2,7 @@
 # Modelos do banco (comentários com algarismos árabe-índicos).
 from datetime import datetime
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, Float, Index, UniqueConstraint
 
 Base = declarative_base()
 
@@ -21,3 +21,138 @@ class UploadLog(Base):
     extracted_to = Column(Text, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     uploaded_by = Column(String(150), nullable=False)
+    sha256 = Column(String(64), nullable=True)  # igual ao do arquivo atual = não regrava (٢)
+    size_bytes = Column(Integer, nullable=True)
+
+class Job(Base):
+    __tablename__ = 'jobs'
+    id = Column(String(36), primary_key=True)  # uuid4 (١)
+    kind = Column(String(50), nullable=False)  # 'rpa' | 'pull_zip'
+    status = Column(String(20), nullable=False, default='queued')  # queued|running|done|failed|cancelled
+    priority = Column(Integer, nullable=False, default=0)  # maior sai primeiro (٢)
+    dedup_key = Column(String(255), nullable=True)  # single-flight: um job ativo por chave (٣)
+    payload = Column(Text, nullable=True)  # JSON
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    requested_by = Column(String(150), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    owner = Column(String(100), nullable=True)  # host:pid do processo que reivindicou (٤)
+    heartbeat_at = Column(DateTime, nullable=True)  # renovado pelo dono enquanto roda
+    dedup_ativo = Column(String(255), nullable=True)  # = dedup_key enquanto ativo; NULL ao finalizar (٥)
+    vaga = Column(Integer, nullable=True)  # vaga de concorrência ocupada enquanto roda (٦)
+
+    __table_args__ = (
+        Index('ix_jobs_status_priority', 'status', 'priority', 'created_at'),
+        Index('ix_jobs_dedup_key', 'dedup_key'),
+        # o banco garante entre processos: um job ativo por chave e uma rodada por vaga
+        Index('ix_jobs_dedup_ativo', 'dedup_ativo', unique=True),
+        Index('ix_jobs_vaga', 'vaga', unique=True),
+    )
+
+class Checkpoint(Base):
+    __tablename__ = 'checkpoints'
+    id = Column(Integer, primary_key=True)  # chave primária (١)
+    run_id = Column(String(36), nullable=False)  # execução (id do job ou uuid avulso)
+    tenant = Column(String(100), nullable=False)
+    unidade = Column(String(255), nullable=False)
+    etapa = Column(String(50), nullable=False)  # 'unidade' = unidade concluída (٢)
+    status = Column(String(20), nullable=False)  # ok|falha
+    data = Column(Text, nullable=True)  # JSON (só etapas persistentes)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint('run_id', 'tenant', 'unidade', 'etapa', name='uq_checkpoint_etapa'),
+    )
+
+class Span(Base):
+    __tablename__ = 'spans'
+    id = Column(Integer, primary_key=True)  # chave primária (١)
+    run_id = Column(String(36), nullable=True)  # nulo fora de execução (ex.: heartbeat do worker)
+    tenant = Column(String(100), nullable=True)
+    unidade = Column(String(255), nullable=True)
+    etapa = Column(String(50), nullable=False)
+    inicio = Column(DateTime, nullable=False)
+    duracao_ms = Column(Float, nullable=False)
+    resultado = Column(String(20), nullable=False)  # ok|erro|cancelado
+    retentativas = Column(Integer, nullable=False, default=0)
+    erro = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_spans_run_id', 'run_id', 'inicio'),
+        Index('ix_spans_etapa_inicio', 'etapa', 'inicio'),
+    )
+
+class Artifact(Base):
+    __tablename__ = 'artifacts'
+    id = Column(Integer, primary_key=True)  # chave primária (١)
+    run_id = Column(String(36), nullable=True)
+    tenant = Column(String(100), nullable=True)
+    unidade = Column(String(255), nullable=True)
+    tipo = Column(String(20), nullable=False)  # trace|screenshot
+    path = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_access_at = Column(DateTime, default=datetime.utcnow)  # LRU (٢)
+
+    __table_args__ = (
+        Index('ix_artifacts_last_access', 'last_access_at'),
+        Index('ix_artifacts_run_id', 'run_id'),
+    )
+
+class RunEvent(Base):
+    __tablename__ = 'run_events'
+    id = Column(Integer, primary_key=True)  # também é o cursor do /api/report?since= (١)
+    run_id = Column(String(36), nullable=True)
+    ts = Column(DateTime, nullable=False)
+    level = Column(String(10), nullable=False)
+    kind = Column(String(20), nullable=False, default='log')  # log|run_inicio|run_fim|unidade|etapa_inicio|etapa_fim|invalido|erro
+    tenant = Column(String(100), nullable=True)
+    unidade = Column(String(255), nullable=True)
+    etapa = Column(String(50), nullable=True)
+    message = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('ix_run_events_run_id', 'run_id', 'id'),
+        Index('ix_run_events_ts', 'ts'),
+    )
+
+class UploadSession(Base):
+    __tablename__ = 'upload_sessions'
+    id = Column(String(36), primary_key=True)  # uuid4 (١)
+    filename = Column(String(255), nullable=False)
+    destino = Column(Text, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    total_chunks = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=True)  # esperado do arquivo inteiro, conferido no commit (٢)
+    status = Column(String(20), nullable=False, default='open')  # open|committing|committed|aborted
+    job_id = Column(String(36), nullable=True)
+    created_by = Column(String(150), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    result = Column(Text, nullable=True)  # JSON do commit
+
+    __table_args__ = (
+        Index('ix_upload_sessions_status', 'status', 'updated_at'),
+    )
+
+class Archive(Base):
+    __tablename__ = 'archives'
+    id = Column(Integer, primary_key=True)  # chave primária (١)
+    sha256 = Column(String(64), unique=True, nullable=False)  # endereço do conteúdo: um arquivo por hash (٢)
+    size_bytes = Column(Integer, nullable=False)
+    path = Column(Text, nullable=False)
+    original_name = Column(String(255), nullable=True)
+    source = Column(String(20), nullable=False)  # agente|manual|drive|importado
+    membros = Column(Integer, nullable=False, default=0)
+    manifest = Column(Text, nullable=True)  # JSON [{name, size, compressed_size, crc, modified}]
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.utcnow)  # último envio com esse conteúdo; o maior é o atual (٣)
+
+    __table_args__ = (
+        Index('ix_archives_last_seen', 'last_seen_at'),
+    )
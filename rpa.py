@@ -2,15 +2,31 @@
 import os
 import re
 import json
+import hashlib
+import math
 import asyncio
+import contextlib
+import contextvars
+import functools
+import threading
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Pattern, List, Tuple, Optional
 import unicodedata
+import uuid
+import weakref
 
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
 
+import artifacts
+import checkpoints
+import lotes
+import rpa_logging
+import run_events
+import spans
+
 # =========================
 # Carrega .env e parâmetros
 # =========================
@@ -26,6 +42,39 @@ def ensure_env() -> tuple[str, str]:
         raise RuntimeError("Credenciais não configuradas no .env (W12_USER e W12_PASS).")
     return user, pwd
 
+def credenciais_tenant(tenant: str) -> tuple[str, str]:
+    """
+    Credenciais por tenant: W12_USER_<TENANT> / W12_PASS_<TENANT>
+    (ex.: W12_USER_FORMULA). Na ausência, usa W12_USER / W12_PASS.
+    """
+    suf = re.sub(r"\W+", "_", tenant).upper()
+    user = os.getenv(f"W12_USER_{suf}", "").strip()
+    pwd  = os.getenv(f"W12_PASS_{suf}", "").strip()
+    if user and pwd:
+        return user, pwd
+    return ensure_env()
+
+# Quantos tenants rodam ao mesmo tempo (cada um no seu browser.new_context()).
+# 1 = sequencial (bodytech → formula), comportamento clássico.
+TENANT_CONCURRENCY = max(1, int(os.getenv("RPA_TENANT_CONCURRENCY", "1") or 1))
+
+# Quantas unidades rodam ao mesmo tempo dentro de um tenant (uma aba por unidade).
+# 1 = sequencial na mesma aba.
+UNIT_CONCURRENCY = max(1, int(os.getenv("RPA_UNIT_CONCURRENCY", "1") or 1))
+
+# Motor das etapas de NFS: "browser" (Playwright em tudo) ou "http" (Playwright só no
+# login; listagem/status/envio direto na API — ver evo_http.py).
+RPA_ENGINE = os.getenv("RPA_ENGINE", "browser").strip().lower()
+# No motor HTTP, o envio real só acontece com RPA_HTTP_ENVIAR=1 (o fluxo do navegador
+# também cancela o modal de envio).
+HTTP_ENVIAR = os.getenv("RPA_HTTP_ENVIAR", "0").strip() == "1"
+# Perfil "lean": bloqueia recursos desnecessários (imagens, fontes, analytics, chat),
+# viewport menor, reduced motion e flags do Chromium para poupar CPU/memória.
+LEAN_PROFILE = os.getenv("RPA_LEAN", "0").strip() == "1"
+
+# Pasta para gravar as respostas /api/ do portal (alimenta o servidor substituto de evo_http.py)
+CAPTURE_DIR = os.getenv("RPA_CAPTURE_DIR", "").strip()
+
 # ====== URLs (ordem: bodytech → formula) ======
 def _env_urls_in_order() -> List[str]:
     """
@@ -83,8 +132,19 @@ def _extract_tenant_from_url(url: str) -> str:
 # =========================
 # Constantes e diretórios
 # =========================
-SCREENSHOT_DIR = Path.home() / "Downloads" / "faturamento_academia"
+# Screenshots e traces de falha vão para o ArtifactStore (teto de tamanho/idade, LRU)
+SCREENSHOT_DIR = artifacts.ARTEFATOS_DIR
 SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
+# Trace do Playwright (DOM + rede) por unidade, gravado só quando a unidade falha
+TRACE_FALHAS = os.getenv("RPA_TRACE_FALHAS", "1").strip() == "1"
+
+# Cache local (sessões logadas por tenant etc.)
+CACHE_DIR = Path(os.getenv("RPA_CACHE_DIR", str(Path(__file__).resolve().parent / ".rpa_cache")))
+SESSION_DIR = CACHE_DIR / "sessoes"
+SESSION_TTL_HOURS = float(os.getenv("RPA_SESSION_TTL_HOURS", "8") or 8)
+UNIT_INDEX_DIR = CACHE_DIR / "unidades"
+# Navega direto para /app/<tenant>/<id>/ quando o índice souber o id interno da unidade
+UNIT_DEEP_LINK = os.getenv("RPA_UNIDADE_DEEP_LINK", "0").strip() == "1"
 
 DEFAULT_TIMEOUT = 6000
 SHORT_TIMEOUT   = 3000
@@ -116,12 +176,115 @@ NAO_USAR_ANY = re.compile(r"^\s*Não\s*usar\s*(?:-\s*\d+(?:\.\d+)*)?\s*$", re.IG
 # =========================
 # Utilidades
 # =========================
-def log(msg: str) -> None:
-    print(f"[rpa] {msg}", flush=True)
+# Tag do tenant corrente nas linhas de log (isolada por task asyncio)
+_LOG_TAG: contextvars.ContextVar[str] = contextvars.ContextVar("rpa_log_tag", default="")
+
+def log(msg: str, nivel: str = "INFO", kind: str = "log") -> None:
+    """Enfileira no logger JSON (rpa_logging) com o contexto atual: run, tenant, unidade, etapa."""
+    sp = _SPAN_ATUAL.get() or {}
+    rpa_logging.emitir(
+        msg,
+        nivel,
+        run_id=_run_id_atual(),
+        tenant=_LOG_TAG.get() or None,
+        unidade=sp.get("unidade"),
+        etapa=sp.get("etapa"),
+        kind=kind,
+    )
+
+def evento(kind: str, msg: str, nivel: str = "INFO") -> None:
+    """
+    Marco da execução — vai para run_events com esse kind (e para o /api/report/stream):
+    run_inicio, run_fim, unidade, etapa_inicio, etapa_fim, invalido, erro.
+    """
+    log(msg, nivel, kind=kind)
+
+# Logs do RPA também vão para a tabela run_events (lote na thread do logger)
+run_events.instalar()
+
+def _run_id_atual() -> Optional[str]:
+    execucao = _EXECUCAO.get()
+    return execucao.run_id if execucao else None
+
+async def _screenshot_erro(page, tenant: str, nome: str) -> None:
+    """Salva screenshot de erro em SCREENSHOT_DIR/<tenant>/ (uma pasta por tenant), indexado no store."""
+    ts = int(datetime.now().timestamp())
+    tag = re.sub(r'\W+', '_', nome)
+    img = artifacts.STORE.caminho(tenant, f"screenshot_erro_{tag}_{ts}.png")
+    try:
+        await page.screenshot(path=str(img), full_page=True)
+        log(f"Erro no fluxo ({nome}). Screenshot: {img}", "ERROR")
+    except Exception as se:
+        log(f"Falha ao salvar screenshot ({nome}): {se}", "WARNING")
+        return
+    try:
+        artifacts.STORE.adicionar(img, "screenshot", _run_id_atual(), tenant, nome)
+    except Exception as e:
+        log(f"Falha ao indexar screenshot ({nome}): {e!r}", "WARNING")
+
+# Contextos com um chunk de trace aberto (um chunk por contexto de cada vez)
+_TRACE_OCUPADO: "weakref.WeakSet" = weakref.WeakSet()
+
+async def _iniciar_tracing(context) -> None:
+    """Liga o tracing do contexto sem gravar nada até a primeira unidade abrir um chunk."""
+    if not TRACE_FALHAS:
+        return
+    try:
+        await context.tracing.start(snapshots=True, screenshots=False, sources=False)
+        await context.tracing.stop_chunk()
+    except Exception as e:
+        log(f"Tracing indisponível: {e}")
+
+@contextlib.asynccontextmanager
+async def _trace_unidade(page, nome_log: str):
+    """
+    Chunk de trace por unidade: descartado no sucesso, salvo no ArtifactStore na falha.
+    Com abas paralelas no mesmo contexto, só uma unidade por vez tem trace.
+    """
+    context = page.context
+    iniciou = False
+    if TRACE_FALHAS and context not in _TRACE_OCUPADO:
+        try:
+            await context.tracing.start_chunk(title=nome_log)
+            _TRACE_OCUPADO.add(context)
+            iniciou = True
+        except Exception:
+            pass
+    if not iniciou:
+        yield
+        return
+    falhou = True
+    try:
+        yield
+        falhou = False
+    except RodadaCancelada:
+        falhou = False
+        raise
+    finally:
+        _TRACE_OCUPADO.discard(context)
+        tenant = _LOG_TAG.get()
+        try:
+            if falhou:
+                tag = re.sub(r'\W+', '_', nome_log)
+                destino = artifacts.STORE.caminho(tenant, f"trace_{tag}_{int(datetime.now().timestamp())}.zip")
+                await context.tracing.stop_chunk(path=str(destino))
+                artifacts.STORE.adicionar(destino, "trace", _run_id_atual(), tenant, nome_log)
+                log(f"Trace da falha ({nome_log}): {destino} (abrir com: playwright show-trace)")
+            else:
+                await context.tracing.stop_chunk()
+        except Exception as e:
+            log(f"Falha ao fechar trace ({nome_log}): {e!r}", "WARNING")
 
 def fmt_date_br(d: datetime) -> str:
     return d.strftime("%d/%m/%Y")
 
+def _periodo_filtro(ref: datetime | None = None) -> tuple[datetime, datetime]:
+    """Período do filtro de NFS (data de lançamento): dia 7, dez meses antes do mês atual."""
+    ref = ref or datetime.now()
+    total = ref.year * 12 + (ref.month - 1) - 10
+    d = datetime(total // 12, total % 12 + 1, 7)
+    return d, d
+
 def previous_business_day(ref: datetime | None = None) -> datetime:
     if ref is None:
         ref = datetime.now()
@@ -141,26 +304,349 @@ def _normalize_str(s: str) -> str:
     """Remove acentos e deixa minúsculo."""
     return ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c)).lower().strip()
 
-async def wait_loading_quiet(page, fast: bool = False) -> None:
-    try:
-        await page.wait_for_load_state("networkidle", timeout=(1500 if fast else DEFAULT_TIMEOUT))
-    except PlaywrightTimeout:
-        pass
-    for sel in [
-        "evo-loading", ".mat-progress-bar", ".cdk-overlay-backdrop",
-        ".cdk-global-overlay-wrapper .mat-progress-spinner",
-    ]:
+# =========================
+# Settle: espera orientada a eventos (XHR/fetch + spinners + backdrops)
+# =========================
+SETTLE_QUIET_MS = int(os.getenv("RPA_SETTLE_QUIET_MS", "150") or 150)
+SETTLE_LOG = os.getenv("RPA_SETTLE_LOG", "0").strip() == "1"
+
+# Métricas do tenant corrente (um dict por tenant; abas/tasks do mesmo tenant somam juntas)
+_METRICAS: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("rpa_metricas", default=None)
+
+def _contar(chave: str, valor: float = 1) -> None:
+    m = _METRICAS.get()
+    if m is not None:
+        m[chave] = m.get(chave, 0) + valor
+
+# Métricas da rodada que está usando cada contexto do navegador. O worker reaproveita o
+# contexto entre rodadas: _executar_tenant vincula o dict da rodada ao entrar e solta ao sair
+_METRICAS_DO_CONTEXTO: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+def _vincular_metricas(context, metricas: Optional[dict]) -> None:
+    _METRICAS_DO_CONTEXTO[context] = metricas
+
+def _contador(context):
+    """_contar nas métricas vinculadas ao contexto no momento do evento (callbacks do Playwright rodam fora do contexto)."""
+    def _c(chave: str, valor: float = 1) -> None:
+        m = _METRICAS_DO_CONTEXTO.get(context)
+        if m is not None:
+            m[chave] = m.get(chave, 0) + valor
+    return _c
+
+# Observador único instalado em cada página (init script do contexto).
+# Conta XHR/fetch pendentes, observa spinners/progress/backdrops via MutationObserver
+# e expõe window.__rpaSettle.wait(quietMs, timeoutMs) → {waited, timedOut}.
+# Backdrops só contam enquanto estão saindo (sem .cdk-overlay-backdrop-showing):
+# um backdrop "showing" é de menu/modal aberto de propósito, não de carregamento.
+_SETTLE_INSTALL_JS = """
+() => {
+  if (window.__rpaSettle) return;
+  const BUSY = "evo-loading, .mat-progress-bar, .cdk-global-overlay-wrapper .mat-progress-spinner, "
+             + ".cdk-overlay-backdrop:not(.cdk-overlay-backdrop-showing)";
+  const st = window.__rpaSettle = { pending: 0, last: performance.now(), waiters: new Set() };
+  const notify = () => { st.waiters.forEach(fn => fn()); };
+  const bump = () => { st.last = performance.now(); notify(); };
+  const visible = el => !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+  st.busy = () => {
+    if (st.pending > 0) return true;
+    if (!document.documentElement) return true;
+    return Array.prototype.some.call(document.querySelectorAll(BUSY), visible);
+  };
+
+  const XS = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function () {
+    st.pending++; bump();
+    let done = false;
+    const fin = () => { if (!done) { done = true; st.pending = Math.max(0, st.pending - 1); bump(); } };
+    this.addEventListener('loadend', fin);
+    try { return XS.apply(this, arguments); } catch (e) { fin(); throw e; }
+  };
+  if (window.fetch) {
+    const F = window.fetch;
+    window.fetch = function () {
+      st.pending++; bump();
+      let done = false;
+      const fin = () => { if (!done) { done = true; st.pending = Math.max(0, st.pending - 1); bump(); } };
+      try { const p = F.apply(this, arguments); p.then(fin, fin); return p; } catch (e) { fin(); throw e; }
+    };
+  }
+
+  const observe = () => {
+    new MutationObserver(() => { if (st.waiters.size) notify(); }).observe(document.documentElement, {
+      childList: true, subtree: true, attributes: true, attributeFilter: ['class', 'style']
+    });
+  };
+  if (document.documentElement) observe();
+  else document.addEventListener('readystatechange', observe, { once: true });
+
+  st.wait = (quietMs, timeoutMs) => new Promise(resolve => {
+    const t0 = performance.now();
+    let timer = null;
+    const finish = (timedOut) => {
+      st.waiters.delete(check);
+      clearTimeout(timer); clearTimeout(limit);
+      resolve({ waited: performance.now() - t0, timedOut });
+    };
+    const check = () => {
+      clearTimeout(timer);
+      if (st.busy()) { st.last = performance.now(); return; }
+      const quiet = performance.now() - st.last;
+      if (quiet >= quietMs) finish(false);
+      else timer = setTimeout(check, quietMs - quiet);
+    };
+    const limit = setTimeout(() => finish(true), timeoutMs);
+    st.waiters.add(check);
+    check();
+  });
+}
+"""
+
+_SETTLE_WAIT_JS = "([q, t]) => { (" + _SETTLE_INSTALL_JS + ")(); return window.__rpaSettle.wait(q, t); }"
+
+async def wait_settled(page, fast: bool = False, quiet_ms: Optional[int] = None,
+                       timeout: Optional[int] = None) -> float:
+    """
+    Aguarda a página assentar: nenhum XHR/fetch pendente, nenhum spinner/progress
+    visível e quiet_ms sem atividade. Resolve assim que tudo fica quieto (sem
+    esperas fixas). Retorna o tempo efetivamente esperado, em ms.
+    """
+    limite = timeout or (SHORT_TIMEOUT if fast else DEFAULT_TIMEOUT)
+    quiet = SETTLE_QUIET_MS if quiet_ms is None else quiet_ms
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    timed_out = False
+    for _ in range(2):
         try:
-            await page.wait_for_selector(sel, state="detached", timeout=(FAST_TIMEOUT if fast else SHORT_TIMEOUT))
-        except PlaywrightTimeout:
+            res = await page.evaluate(_SETTLE_WAIT_JS, [quiet, limite])
+            timed_out = bool((res or {}).get("timedOut"))
+            break
+        except Exception:
+            # navegação no meio da espera destrói o contexto JS: espera o DOM novo e repete
             try:
-                await page.wait_for_selector(sel, state="hidden", timeout=VERY_SHORT_TIMEOUT)
-            except PlaywrightTimeout:
-                pass
+                await page.wait_for_load_state("domcontentloaded", timeout=limite)
+            except Exception:
+                break
+    waited = (loop.time() - t0) * 1000.0
+    _contar("settle_chamadas")
+    _contar("settle_ms", waited)
+    if timed_out:
+        _contar("settle_timeouts")
+    if SETTLE_LOG:
+        log(f"settle: {waited:.0f} ms{' (timeout)' if timed_out else ''}")
+    return waited
+
+def _resumo_metricas() -> Optional[str]:
+    m = _METRICAS.get() or {}
+    partes = []
+    n = int(m.get("settle_chamadas", 0))
+    if n:
+        total = m.get("settle_ms", 0.0)
+        partes.append(f"Settle: {n} esperas, total {total / 1000:.1f} s, média {total / n:.0f} ms, "
+                      f"{int(m.get('settle_timeouts', 0))} timeout(s)")
+        partes.append(f"Grade: {int(m.get('grade_rede', 0))} página(s) via resposta do backend, "
+                      f"{int(m.get('grade_evaluate', 0))} via evaluate, "
+                      f"{int(m.get('grade_celula', 0))} célula a célula")
+    cargas = int(m.get("cargas", 0))
+    if cargas or m.get("req_total"):
+        media = (m.get("carga_ms", 0.0) / cargas) if cargas else 0.0
+        partes.append(
+            f"Perfil {'lean' if LEAN_PROFILE else 'normal'}: {int(m.get('req_total', 0))} requisições, "
+            f"{int(m.get('req_bloqueadas', 0))} bloqueadas (~{m.get('bytes_bloqueados', 0) / 1024:.0f} KB), "
+            f"{m.get('bytes_recebidos', 0) / 1024:.0f} KB recebidos, carga média {media:.0f} ms em {cargas} página(s)"
+        )
+    return " | ".join(partes) or None
+
+# === Spans: tempo por etapa (tenant, unidade, etapa, duração, resultado, retentativas)
+_SPAN_ATUAL: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("rpa_span", default=None)
+
+def _gravar_no_banco(lote: List[Tuple[str, dict]]) -> None:
+    """Thread do gravador: spans num INSERT em lote, checkpoints em upserts na ordem."""
+    spans.gravar([item for tipo, item in lote if tipo == "span"])
+    checkpoints.registrar_lote([item for tipo, item in lote if tipo == "checkpoint"])
+
+# Spans e checkpoints vão para o banco fora do event loop, em lote
+_GRAVADOR = lotes.GravadorEmLote("rpa-banco", _gravar_no_banco)
+
+@contextlib.asynccontextmanager
+async def span(etapa: str, unidade: Optional[str] = None):
+    """Mede o bloco; spans aninhados herdam a unidade do span pai."""
+    pai = _SPAN_ATUAL.get()
+    execucao = _EXECUCAO.get()
+    sp = {
+        "run_id": execucao.run_id if execucao else None,
+        "tenant": _LOG_TAG.get(),
+        "unidade": unidade or (pai or {}).get("unidade"),
+        "etapa": etapa,
+        "inicio": datetime.utcnow(),
+        "resultado": "ok",
+        "retentativas": 0,
+        "erro": None,
+    }
+    token = _SPAN_ATUAL.set(sp)
+    t0 = time.perf_counter()
+    try:
+        yield sp
+    except (RodadaCancelada, asyncio.CancelledError):
+        sp["resultado"] = "cancelado"
+        raise
+    except Exception as e:
+        sp["resultado"] = "erro"
+        sp["erro"] = repr(e)[:500]
+        raise
+    finally:
+        sp["duracao_ms"] = (time.perf_counter() - t0) * 1000
+        _SPAN_ATUAL.reset(token)
+        _GRAVADOR.enfileirar(("span", sp))
+
+def medido(etapa: str):
+    """Decorator: a corrotina inteira vira um span `etapa`."""
+    def _decorar(fn):
+        @functools.wraps(fn)
+        async def _medida(*args, **kwargs):
+            async with span(etapa):
+                return await fn(*args, **kwargs)
+        return _medida
+    return _decorar
+
+def _retentativa() -> None:
+    sp = _SPAN_ATUAL.get()
+    if sp is not None:
+        sp["retentativas"] += 1
+
+async def descarregar_gravacoes(timeout: float = 10.0) -> None:
+    """Espera (sem travar o loop) spans e checkpoints enfileirados chegarem ao banco."""
+    if not await asyncio.to_thread(_GRAVADOR.descarregar, timeout):
+        log("Spans/checkpoints ainda pendentes de gravação após o fim da rodada.", "WARNING")
+
+# === Timeouts adaptativos
+# Histórico (por etapa do span atual + rótulo fixo do seletor) das esperas bem-sucedidas
+# e dos timeouts. Os valores fixos (DEFAULT_TIMEOUT etc.) são o mínimo: o histórico só
+# estica o limite (p99 dos sucessos × margem, e mais depois de timeouts, até o teto) —
+# no horário de pico a página demora mais, não menos. Só sondas marcadas `opcional`
+# (o normal é o elemento não existir) ganham o atalho de esperar menos que o padrão.
+TIMEOUTS_PATH = CACHE_DIR / "timeouts.json"
+TIMEOUTS_ADAPTATIVOS = os.getenv("RPA_TIMEOUTS_ADAPTATIVOS", "1").strip() != "0"
+# Congela: usa o histórico salvo mas não aprende nem grava (runs reproduzíveis)
+TIMEOUTS_FROZEN = os.getenv("RPA_TIMEOUTS_FROZEN", "0").strip() == "1"
+
+class TimeoutPolicy:
+    def __init__(self, path: Path, margem: float = 1.5, piso_ms: int = 500, teto_ms: int = 30000,
+                 janela: int = 200, min_amostras: int = 20, congelado: bool = False) -> None:
+        self.path = path
+        self.margem = margem
+        self.piso_ms = piso_ms
+        self.teto_ms = teto_ms
+        self.janela = janela
+        self.min_amostras = min_amostras
+        self.congelado = congelado
+        self._hist: Optional[dict] = None
+        self._sujo = False
+        self._lock = threading.Lock()
+
+    def _historico(self) -> dict:
+        if self._hist is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._hist = json.load(f) or {}
+            except (OSError, ValueError):
+                self._hist = {}
+        return self._hist
+
+    @staticmethod
+    def _chave(etapa: str, seletor: str) -> str:
+        return f"{etapa}|{seletor}"
+
+    def timeout(self, etapa: str, seletor: str, padrao: int, opcional: bool = False) -> int:
+        """
+        Nunca abaixo do padrão nem do p99 dos sucessos × margem; cada timeout seguido
+        no fim do histórico dobra o limite (até o teto). Só esperas `opcional` (sondas
+        cujo normal é o elemento não existir) podem cair abaixo do padrão.
+        """
+        with self._lock:
+            amostras = list(self._historico().get(self._chave(etapa, seletor)) or [])
+        if len(amostras) < self.min_amostras:
+            return padrao
+        sucessos = sorted(ms for ms, ok in amostras if ok)
+        observado = sucessos[max(0, math.ceil(0.99 * len(sucessos)) - 1)] * self.margem if sucessos else 0
+        if opcional and len(sucessos) < len(amostras) - len(sucessos):
+            # o normal aqui é o fallback: espera só o que os sucessos já levaram
+            return int(min(padrao, max(self.piso_ms, observado)))
+        estouros_seguidos = 0
+        for _ms, ok in reversed(amostras):
+            if ok:
+                break
+            estouros_seguidos += 1
+        base = max(padrao, observado)
+        return int(min(max(self.teto_ms, padrao), base * (2 ** min(estouros_seguidos, 8))))
+
+    def registrar(self, etapa: str, seletor: str, ms: float, ok: bool) -> None:
+        if self.congelado:
+            return
+        with self._lock:
+            lista = self._historico().setdefault(self._chave(etapa, seletor), [])
+            lista.append([round(ms), bool(ok)])
+            del lista[:-self.janela]
+            self._sujo = True
+
+    def salvar(self) -> None:
+        with self._lock:
+            if self.congelado or not self._sujo:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._hist, f)
+                os.replace(tmp, self.path)
+                self._sujo = False
+            except OSError as e:
+                log(f"Falha ao salvar histórico de timeouts: {e}", "WARNING")
+
+TIMEOUTS = TimeoutPolicy(
+    TIMEOUTS_PATH,
+    margem=float(os.getenv("RPA_TIMEOUT_MARGEM", "1.5") or 1.5),
+    piso_ms=int(os.getenv("RPA_TIMEOUT_PISO_MS", "500") or 500),
+    teto_ms=int(os.getenv("RPA_TIMEOUT_TETO_MS", "30000") or 30000),
+    janela=int(os.getenv("RPA_TIMEOUT_JANELA", "200") or 200),
+    min_amostras=int(os.getenv("RPA_TIMEOUT_MIN_AMOSTRAS", "20") or 20),
+    congelado=TIMEOUTS_FROZEN,
+)
+
+@contextlib.asynccontextmanager
+async def limite_adaptativo(seletor: str, padrao: int, opcional: bool = False):
+    """
+    Entrega o timeout (ms) para (etapa atual, seletor) e registra quanto a espera levou.
+    `seletor` é um rótulo fixo (nada de texto dinâmico: vira chave do timeouts.json).
+    """
+    if not TIMEOUTS_ADAPTATIVOS:
+        yield padrao
+        return
+    etapa = (_SPAN_ATUAL.get() or {}).get("etapa") or "geral"
+    limite = TIMEOUTS.timeout(etapa, seletor, padrao, opcional=opcional)
+    t0 = time.perf_counter()
+    try:
+        yield limite
+    except PlaywrightTimeout:
+        TIMEOUTS.registrar(etapa, seletor, limite, ok=False)
+        raise
+    TIMEOUTS.registrar(etapa, seletor, (time.perf_counter() - t0) * 1000, ok=True)
+
+async def aguardar(loc, seletor: str, padrao: int, state: str = "visible", opcional: bool = False) -> None:
+    """
+    loc.wait_for com timeout adaptativo; `seletor` é o rótulo estável do histórico.
+    Cada espera tem o seu rótulo: dois locators com o mesmo rótulo misturam as amostras.
+    """
+    async with limite_adaptativo(seletor, padrao, opcional=opcional) as limite:
+        await loc.wait_for(state=state, timeout=limite)
 
-async def safe_click(loc, desc: str, force: bool = False, timeout: int = SHORT_TIMEOUT) -> bool:
+def _rotulo_fixo(desc: str) -> str:
+    """'Unidade alvo (scan: 'X')' → 'Unidade alvo': o parêntese final costuma ser dinâmico."""
+    return re.sub(r"\s*\(.*\)\s*$", "", desc).strip() or desc
+
+async def safe_click(loc, desc: str, force: bool = False, timeout: int = SHORT_TIMEOUT,
+                     rotulo: Optional[str] = None, opcional: bool = False) -> bool:
     try:
-        await loc.wait_for(state="visible", timeout=timeout)
+        await aguardar(loc, rotulo or _rotulo_fixo(desc), timeout, opcional=opcional)
         await loc.click(force=force, timeout=timeout)
         log(f"{desc}: clique executado")
         return True
@@ -171,14 +657,19 @@ async def safe_click(loc, desc: str, force: bool = False, timeout: int = SHORT_T
         log(f"{desc}: erro ao clicar: {e}")
         return False
 
-async def click_with_retries(loc, desc: str, attempts: int = 3, force_last: bool = True, timeout: int = SHORT_TIMEOUT) -> bool:
+async def click_with_retries(loc, desc: str, attempts: int = 3, force_last: bool = True, timeout: int = SHORT_TIMEOUT,
+                             rotulo: Optional[str] = None) -> bool:
+    rotulo = rotulo or _rotulo_fixo(desc)
     for i in range(1, attempts + 1):
-        ok = await safe_click(loc, f"{desc} (tentativa {i}/{attempts})", force=False, timeout=timeout)
+        if i > 1:
+            _retentativa()
+        ok = await safe_click(loc, f"{desc} (tentativa {i}/{attempts})", force=False, timeout=timeout,
+                              rotulo=rotulo)
         if ok:
             return True
     if force_last:
         try:
-            await loc.wait_for(state="visible", timeout=timeout)
+            await aguardar(loc, rotulo, timeout)
             await loc.click(force=True, timeout=timeout)
             log(f"{desc}: clique com force=True executado")
             return True
@@ -186,6 +677,9 @@ async def click_with_retries(loc, desc: str, attempts: int = 3, force_last: bool
             log(f"{desc}: clique com force=True falhou: {e}")
     return False
 
+def _app_home_url(tenant: str) -> str:
+    return f"https://evo5.w12app.com.br/#/app/{tenant}/-2/inicio/geral"
+
 def _corrigir_url_tenant(url: str, tenant: str) -> str:
     if "/acesso//" in url:
         return url.replace("/acesso//", f"/acesso/{tenant}/")
@@ -245,7 +739,8 @@ async def find_first_visible(page, selectors: list[str], timeout_each: int = 300
     for css in selectors:
         loc = page.locator(css).first
         try:
-            await loc.wait_for(state="visible", timeout=timeout_each)
+            # sonda: vários seletores candidatos, o normal é a maioria não existir
+            await aguardar(loc, css, timeout_each, opcional=True)
             return loc
         except Exception:
             continue
@@ -282,9 +777,11 @@ async def wait_for_login_fields(page, tenant: str, base_login_url: str, max_wait
 # =========================
 # Etapas do fluxo
 # =========================
+@medido("login")
 async def do_login(page, tenant: str, base_login_url: str, user: str, pwd: str) -> None:
     log(f"Abrindo página de login (tenant={tenant})")
-    await page.goto(base_login_url, wait_until="domcontentloaded", timeout=20000)
+    async with limite_adaptativo("goto_login", 20000) as limite:
+        await page.goto(base_login_url, wait_until="domcontentloaded", timeout=limite)
 
     stop_wd = asyncio.Event()
     wd_task = asyncio.create_task(tenant_watchdog(page, stop_wd, tenant))
@@ -295,7 +792,7 @@ async def do_login(page, tenant: str, base_login_url: str, user: str, pwd: str)
 
         entrar_btn = page.get_by_role("button", name=re.compile(r"^\s*Entrar\s*$", re.IGNORECASE)).first
         try:
-            await entrar_btn.wait_for(state="visible", timeout=3000)
+            await aguardar(entrar_btn, "login_botao_entrar", 3000)
         except PlaywrightTimeout:
             entrar_btn = page.locator("button", has_text=re.compile(r"^\s*Entrar\s*$", re.IGNORECASE)).first
 
@@ -309,19 +806,18 @@ async def do_login(page, tenant: str, base_login_url: str, user: str, pwd: str)
         if not await click_with_retries(entrar_btn, "Entrar", attempts=2, timeout=DEFAULT_TIMEOUT):
             raise RuntimeError("Falha ao clicar em Entrar")
 
-        await asyncio.sleep(0.4)
+        await wait_settled(page, fast=True)
 
         # /autenticacao → Prosseguir (se aparecer)
         try:
             if "/autenticacao" in page.url:
                 prosseguir_btn = page.get_by_role("button", name=re.compile(r"^\s*Prosseguir\s*$", re.IGNORECASE)).first
-                await safe_click(prosseguir_btn, "Prosseguir", force=False, timeout=FAST_TIMEOUT)
+                await safe_click(prosseguir_btn, "Prosseguir", force=False, timeout=FAST_TIMEOUT, opcional=True)
         except Exception:
             pass
 
-        app_home_url = f"https://evo5.w12app.com.br/#/app/{tenant}/-2/inicio/geral"
-        await page.goto(app_home_url, wait_until="domcontentloaded")
-        await wait_loading_quiet(page, fast=True)
+        await page.goto(_app_home_url(tenant), wait_until="domcontentloaded")
+        await wait_settled(page, fast=True)
         log(f"Pós-login. URL atual: {page.url}")
     finally:
         stop_wd.set()
@@ -330,6 +826,97 @@ async def do_login(page, tenant: str, base_login_url: str, user: str, pwd: str)
         except Exception:
             pass
 
+# =========================
+# Cache de sessão por tenant (Playwright storage_state)
+# =========================
+def _sessao_path(tenant: str) -> Path:
+    return SESSION_DIR / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', tenant)}.json"
+
+def carregar_sessao(tenant: str, user: Optional[str] = None) -> Optional[dict]:
+    """
+    Retorna o storage_state salvo para o tenant (cookies + localStorage, incluindo
+    as chaves 'tenant'/'dominio'), ou None se não existir, expirou ou é de outro usuário.
+    """
+    path = _sessao_path(tenant)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f) or {}
+    except (OSError, ValueError):
+        return None
+    if float(data.get("expires_at") or 0) <= datetime.now().timestamp():
+        log(f"Sessão em cache expirada (tenant={tenant}); descartando.")
+        invalidar_sessao(tenant)
+        return None
+    if user is not None and data.get("user") not in (None, user):
+        return None
+    return data.get("storage_state") or None
+
+async def salvar_sessao(context, tenant: str, user: str, expires_at: Optional[float] = None) -> None:
+    """Grava o storage_state do contexto com timestamp de expiração (escrita atômica)."""
+    try:
+        state = await context.storage_state()
+    except Exception as e:
+        log(f"Falha ao obter storage_state (tenant={tenant}): {e}", "WARNING")
+        return
+    now = datetime.now().timestamp()
+    data = {
+        "tenant": tenant,
+        "user": user,
+        "saved_at": now,
+        "expires_at": expires_at or (now + SESSION_TTL_HOURS * 3600),
+        "storage_state": state,
+    }
+    path = _sessao_path(tenant)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    log(f"Sessão salva em cache (tenant={tenant}, expira em {datetime.fromtimestamp(data['expires_at']):%d/%m/%Y %H:%M})")
+
+def invalidar_sessao(tenant: Optional[str] = None) -> List[str]:
+    """Remove a sessão em cache do tenant (ou de todos, se tenant=None). Retorna os tenants removidos."""
+    alvos = [_sessao_path(tenant)] if tenant else sorted(SESSION_DIR.glob("*.json"))
+    removidos: List[str] = []
+    for path in alvos:
+        try:
+            path.unlink()
+            removidos.append(path.stem)
+        except FileNotFoundError:
+            pass
+    return removidos
+
+def _sessao_expires_at(tenant: str) -> Optional[float]:
+    try:
+        with open(_sessao_path(tenant), "r", encoding="utf-8") as f:
+            return float((json.load(f) or {}).get("expires_at") or 0) or None
+    except (OSError, ValueError):
+        return None
+
+@medido("sessao_sonda")
+async def sessao_valida(page, tenant: str) -> bool:
+    """Sonda barata: abre a home do app e confere se continua em /app/<tenant>/ com o menu do usuário."""
+    try:
+        await page.goto(_app_home_url(tenant), wait_until="domcontentloaded", timeout=DEFAULT_TIMEOUT)
+        menu = page.locator("div.novo-user-data, i.icone-seta-novo-user-data").first
+        await aguardar(menu, "sessao_menu_usuario", DEFAULT_TIMEOUT)
+    except Exception:
+        return False
+    return f"/app/{tenant}/" in page.url and "/acesso/" not in page.url
+
+async def garantir_login(page, tenant: str, base_login_url: str, user: str, pwd: str) -> None:
+    """Reaproveita a sessão em cache quando a sonda aceita; senão faz do_login completo e salva."""
+    if carregar_sessao(tenant, user) is not None:
+        if await sessao_valida(page, tenant):
+            log(f"Sessão em cache reaproveitada (tenant={tenant}). URL atual: {page.url}")
+            await salvar_sessao(page.context, tenant, user, expires_at=_sessao_expires_at(tenant))
+            return
+        log(f"Sessão em cache rejeitada pelo portal (tenant={tenant}); refazendo login.")
+        invalidar_sessao(tenant)
+        await page.context.clear_cookies()
+    await do_login(page, tenant, base_login_url, user, pwd)
+    await salvar_sessao(page.context, tenant, user)
+
 # --- menu do usuário (canto superior direito) ---
 async def abrir_menu_usuario(page):
     log("Abrindo menu do usuário (canto superior direito)")
@@ -339,15 +926,160 @@ async def abrir_menu_usuario(page):
         if not await trigger.is_visible():
             trigger = page.locator("div.novo-user-data").first
 
-    await trigger.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(trigger, "unidade_menu_usuario", DEFAULT_TIMEOUT)
     await trigger.click()
 
     pane = page.locator("div.cdk-overlay-pane .mat-menu-panel, div.cdk-overlay-pane").last
-    await pane.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(pane, "unidade_menu_painel", DEFAULT_TIMEOUT)
     return pane
 
+# === Índice persistente de unidades (por tenant) ===
+_OPCAO_UNIDADE_CSS = "div.p-x-xs.p-y-sm"
+
+# Despeja todas as opções do mat-select num único evaluate (rolando a lista
+# dentro da página, caso ela seja virtualizada): texto, posição e id interno.
+_UNIDADES_DUMP_JS = """
+async (root, css) => {
+  const norm = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const out = [];
+  const vistos = new Set();
+  const idDe = el => {
+    for (let e = el; e && e !== root; e = e.parentElement) {
+      for (const a of ['data-id', 'ng-reflect-value', 'value', 'id']) {
+        const v = e.getAttribute && e.getAttribute(a);
+        if (v && /^-?\\d+$/.test(v)) return v;
+      }
+    }
+    return null;
+  };
+  const coletar = () => root.querySelectorAll(css).forEach(el => {
+    const texto = norm(el.innerText);
+    if (!texto || vistos.has(texto)) return;
+    vistos.add(texto);
+    out.push({ texto, pos: out.length, id: idDe(el) });
+  });
+  let box = root.querySelector(css);
+  while (box && box !== root && !(box.scrollHeight > box.clientHeight)) box = box.parentElement;
+  coletar();
+  if (box) {
+    for (let i = 0; i < 200 && box.scrollTop + box.clientHeight < box.scrollHeight - 1; i++) {
+      box.scrollTop += Math.max(box.clientHeight, 40);
+      await new Promise(r => requestAnimationFrame(() => r()));
+      coletar();
+    }
+    box.scrollTop = 0;
+  }
+  return out;
+}
+"""
+
+# Clica na opção pelo texto exato, rolando até a posição indexada se ela não estiver renderizada.
+_UNIDADE_CLICAR_JS = """
+async (root, [css, texto, pos]) => {
+  const norm = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const achar = () => Array.from(root.querySelectorAll(css)).find(el => norm(el.innerText) === texto);
+  let el = achar();
+  if (!el) {
+    let box = root.querySelector(css);
+    while (box && box !== root && !(box.scrollHeight > box.clientHeight)) box = box.parentElement;
+    const primeira = root.querySelector(css);
+    if (box && primeira) {
+      box.scrollTop = Math.max(0, pos * primeira.offsetHeight - box.clientHeight / 2);
+      for (let i = 0; i < 10 && !el; i++) {
+        await new Promise(r => requestAnimationFrame(() => r()));
+        el = achar();
+      }
+    }
+  }
+  if (!el) return false;
+  el.scrollIntoView({ block: 'center' });
+  el.click();
+  return true;
+}
+"""
+
+def _tenant_da_url(url: str) -> Optional[str]:
+    m = re.search(r"/(?:app|acesso)/([^/]+)/", url or "")
+    return m.group(1) if m else None
+
+def _indice_path(tenant: str) -> Path:
+    return UNIT_INDEX_DIR / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', tenant)}.json"
+
+def carregar_indice_unidades(tenant: str) -> List[dict]:
+    try:
+        with open(_indice_path(tenant), "r", encoding="utf-8") as f:
+            return (json.load(f) or {}).get("opcoes") or []
+    except (OSError, ValueError):
+        return []
+
+async def reconstruir_indice_unidades(overlay, tenant: str) -> List[dict]:
+    opcoes = await overlay.evaluate(_UNIDADES_DUMP_JS, _OPCAO_UNIDADE_CSS) or []
+    for o in opcoes:
+        o["chave"] = _normalize_str(o["texto"])
+    path = _indice_path(tenant)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"tenant": tenant, "gerado_em": datetime.now().isoformat(timespec="seconds"),
+                   "opcoes": opcoes}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+    log(f"Índice de unidades reconstruído (tenant={tenant}): {len(opcoes)} opções")
+    return opcoes
+
+def _buscar_no_indice(opcoes: List[dict], target_regex: Pattern, needles: List[str]) -> Optional[dict]:
+    for o in opcoes:
+        if target_regex.search(o["texto"]):
+            return o
+    for o in opcoes:
+        if any(n in o["chave"] for n in needles):
+            return o
+    return None
+
+async def _selecionar_via_indice(page, overlay, tenant: str, target_regex: Pattern,
+                                 needles: List[str]) -> bool:
+    """Vai direto à opção usando o índice; reconstrói o índice só quando a busca erra."""
+    opcoes = carregar_indice_unidades(tenant)
+    for tentativa in range(2):
+        alvo = _buscar_no_indice(opcoes, target_regex, needles)
+        if alvo is not None:
+            try:
+                ok = await overlay.evaluate(_UNIDADE_CLICAR_JS, [_OPCAO_UNIDADE_CSS, alvo["texto"], alvo["pos"]])
+            except Exception:
+                ok = False
+            if ok:
+                await wait_settled(page, fast=True)
+                log(f"Unidade selecionada (índice): {alvo['texto']}")
+                return True
+        if tentativa == 0:
+            _retentativa()
+            try:
+                opcoes = await reconstruir_indice_unidades(overlay, tenant)
+            except Exception as e:
+                log(f"Falha ao reconstruir índice de unidades: {e}", "WARNING")
+                return False
+    return False
+
+async def _selecionar_via_deep_link(page, tenant: str, target_regex: Pattern, needles: List[str]) -> bool:
+    alvo = _buscar_no_indice(carregar_indice_unidades(tenant), target_regex, needles)
+    if not alvo or not alvo.get("id"):
+        return False
+    await page.goto(f"https://evo5.w12app.com.br/#/app/{tenant}/{alvo['id']}/inicio/geral",
+                    wait_until="domcontentloaded")
+    await wait_settled(page, fast=True)
+    if _unidade_na_url(page.url) == str(alvo["id"]):
+        log(f"Unidade selecionada (deep link): {alvo['texto']}")
+        return True
+    return False
+
 # === Seleção de unidade (robusta; inclui varredura com scroll) ===
 async def selecionar_unidade_por_nome(page, search_terms: List[str], target_regex: Pattern) -> None:
+    # Normaliza "agulhas" (termos) para comparação sem acento
+    needles = [_strip_accents_lower(t) for t in (search_terms or [])]
+    tenant = _tenant_da_url(page.url)
+
+    if tenant and UNIT_DEEP_LINK and await _selecionar_via_deep_link(page, tenant, target_regex, needles):
+        return
+
     pane = await abrir_menu_usuario(page)
     log("Localizando seletor 'Selecionar unidade' dentro do menu do usuário")
 
@@ -359,16 +1091,17 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
         if not await select_trigger.is_visible():
             select_trigger = pane.get_by_role("combobox").first
 
-    await select_trigger.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(select_trigger, "unidade_select", DEFAULT_TIMEOUT)
     await select_trigger.click()
 
     overlay = page.locator("div.cdk-overlay-pane").filter(
         has_not=page.locator(".cdk-overlay-pane[aria-hidden='true']")
     ).last
-    await overlay.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(overlay, "unidade_select_opcoes", DEFAULT_TIMEOUT)
 
-    # Normaliza "agulhas" (termos) para comparação sem acento
-    needles = [_strip_accents_lower(t) for t in (search_terms or [])]
+    # 0) Índice persistente de unidades
+    if tenant and await _selecionar_via_indice(page, overlay, tenant, target_regex, needles):
+        return
 
     # 1) Tentar com campo de busca (se existir)
     search_input = overlay.locator("input.pesquisar-dropdrown[placeholder='Pesquisar'], input[placeholder='Pesquisar']").first
@@ -380,9 +1113,10 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
             # tentar por texto exato/regex
             try:
                 item = overlay.get_by_text(target_regex).first
-                await item.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-                if await click_with_retries(item, f"Unidade alvo ({term})", attempts=3, timeout=DEFAULT_TIMEOUT):
-                    await wait_loading_quiet(page, fast=True)
+                await aguardar(item, "unidade_opcao_texto", DEFAULT_TIMEOUT)
+                if await click_with_retries(item, f"Unidade alvo ({term})", attempts=3, timeout=DEFAULT_TIMEOUT,
+                                            rotulo="unidade_clique_texto"):
+                    await wait_settled(page, fast=True)
                     log("Unidade selecionada com sucesso (via busca)")
                     return
             except Exception:
@@ -393,7 +1127,7 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
                 await search_input.press("ArrowDown")
                 await asyncio.sleep(0.1)
                 await search_input.press("Enter")
-                await wait_loading_quiet(page, fast=True)
+                await wait_settled(page, fast=True)
                 log("Unidade selecionada (via setas/Enter)")
                 return
             except Exception:
@@ -402,9 +1136,10 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
     # 2) Tentar clicar direto no bloco <div> com texto — primeiro via regex
     try:
         item_bloco = overlay.locator("div.p-x-xs.p-y-sm", has_text=target_regex).first
-        await item_bloco.wait_for(state="visible", timeout=FAST_TIMEOUT)
-        if await click_with_retries(item_bloco, "Unidade alvo (div bloco - regex)", attempts=3, timeout=DEFAULT_TIMEOUT):
-            await wait_loading_quiet(page, fast=True)
+        await aguardar(item_bloco, "unidade_opcao_bloco", FAST_TIMEOUT, opcional=True)
+        if await click_with_retries(item_bloco, "Unidade alvo (div bloco - regex)", attempts=3, timeout=DEFAULT_TIMEOUT,
+                                    rotulo="unidade_clique_bloco"):
+            await wait_settled(page, fast=True)
             log("Unidade selecionada (div bloco - regex)")
             return
     except Exception:
@@ -431,15 +1166,16 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
                         await opt.scroll_into_view_if_needed(timeout=SHORT_TIMEOUT)
                     except Exception:
                         pass
-                    if await click_with_retries(opt, f"Unidade alvo (scan: '{txt}')", attempts=3, timeout=DEFAULT_TIMEOUT):
-                        await wait_loading_quiet(page, fast=True)
+                    if await click_with_retries(opt, f"Unidade alvo (scan: '{txt}')", attempts=3, timeout=DEFAULT_TIMEOUT,
+                                                rotulo="unidade_clique_varredura"):
+                        await wait_settled(page, fast=True)
                         log(f"Unidade selecionada (scan): {txt}")
                         return
             # rolar mais um "pedaço" da lista
             try:
                 await overlay.hover()
                 await page.keyboard.press("PageDown")
-                await asyncio.sleep(0.25)
+                await wait_settled(page, fast=True, quiet_ms=50)
             except Exception:
                 break
     except Exception:
@@ -447,8 +1183,9 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
 
     # 4) Último fallback: texto cru
     item = overlay.get_by_text(target_regex).first
-    if await click_with_retries(item, "Unidade alvo (fallback final)", attempts=3, timeout=DEFAULT_TIMEOUT):
-        await wait_loading_quiet(page, fast=True)
+    if await click_with_retries(item, "Unidade alvo (fallback final)", attempts=3, timeout=DEFAULT_TIMEOUT,
+                                rotulo="unidade_clique_fallback"):
+        await wait_settled(page, fast=True)
         return
 
     raise RuntimeError("Não foi possível selecionar a unidade alvo dentro do menu do usuário")
@@ -456,28 +1193,139 @@ async def selecionar_unidade_por_nome(page, search_terms: List[str], target_rege
 async def abrir_menu_financeiro_e_ir_para_nfs(page) -> None:
     log("Abrindo menu Financeiro e acessando Notas Fiscais de Serviço")
     financeiro_span = page.locator("span.nav-text", has_text=re.compile(r"^\s*Financeiro\s*$", re.IGNORECASE)).first
-    await financeiro_span.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(financeiro_span, "menu_financeiro", DEFAULT_TIMEOUT)
     li_fin = financeiro_span.locator("xpath=ancestor::li[1]")
     chevron = li_fin.locator("i.material-icons").filter(has_text=re.compile(r"keyboard_arrow_(down|right)")).first
     try:
-        await chevron.wait_for(state="visible", timeout=FAST_TIMEOUT)
+        await aguardar(chevron, "menu_financeiro_seta", FAST_TIMEOUT, opcional=True)
         await chevron.click()
     except Exception:
         await financeiro_span.click()
-    await asyncio.sleep(0.25)
+    await wait_settled(page, fast=True)
 
     # Preferir data-cy quando disponível
     nfs = page.locator('span.nav-text[data-cy="Notas Fiscais de Serviço"]').first
+    rotulo = "menu_nfs_data_cy"
     try:
-        await nfs.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        await aguardar(nfs, rotulo, DEFAULT_TIMEOUT)
     except PlaywrightTimeout:
         nfs = page.get_by_text(re.compile(r"^\s*Notas Fiscais de Serviço\s*$", re.IGNORECASE)).first
-        await nfs.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        rotulo = "menu_nfs_texto"
+        await aguardar(nfs, rotulo, DEFAULT_TIMEOUT)
 
-    if not await click_with_retries(nfs, "Notas Fiscais de Serviço", attempts=2, timeout=DEFAULT_TIMEOUT):
+    if not await click_with_retries(nfs, "Notas Fiscais de Serviço", attempts=2, timeout=DEFAULT_TIMEOUT,
+                                    rotulo=f"{rotulo}_clique"):
         await nfs.click(force=True, timeout=DEFAULT_TIMEOUT)
 
-    await wait_loading_quiet(page, fast=True)
+    await wait_settled(page, fast=True)
+
+# =========================
+# Calendário (mat-datepicker): seleção direta de data ou intervalo
+# =========================
+_MESES_ABREV = {
+    "jan": 1, "fev": 2, "feb": 2, "mar": 3, "abr": 4, "apr": 4, "mai": 5, "may": 5,
+    "jun": 6, "jul": 7, "ago": 8, "aug": 8, "set": 9, "sep": 9, "out": 10, "oct": 10,
+    "nov": 11, "dez": 12, "dec": 12,
+}
+
+# Ação em lote dentro da página: lê o cabeçalho do calendário, pula direto ao
+# mês alvo (período → ano → mês; setas só como alternativa, na quantidade
+# calculada pelo cabeçalho) e clica nos dias pedidos.
+_CALENDARIO_JS = """
+async ({ano, mes, dias, meses}) => {
+  const quadro = () => new Promise(r => requestAnimationFrame(() => r()));
+  const norm = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const visivel = el => !!(el && (el.offsetWidth || el.offsetHeight));
+  const cal = () => Array.from(document.querySelectorAll('mat-calendar')).filter(visivel).pop();
+  const cabecalho = () => {
+    const b = cal() && cal().querySelector('.mat-calendar-period-button');
+    return b ? norm(b.innerText) : '';
+  };
+  const mesAtual = () => {
+    const t = cabecalho().toLowerCase().normalize('NFD').replace(/[\\u0300-\\u036f]/g, '');
+    const a = t.match(/(\\d{4})/);
+    const m = t.match(/[a-z]{3}/);
+    if (!a || !m || !(m[0] in meses)) return null;
+    return [parseInt(a[1], 10), meses[m[0]]];
+  };
+  const celulas = () => cal() ? Array.from(cal().querySelectorAll('.mat-calendar-body-cell')) : [];
+  const celula = txt => celulas().find(el =>
+    !el.classList.contains('mat-calendar-body-disabled') && norm(el.innerText) === String(txt));
+  const clicar = async el => { el.click(); await quadro(); };
+  const noAlvo = () => { const a = mesAtual(); return !!a && a[0] === ano && a[1] === mes; };
+
+  if (!cal()) return { ok: false, erro: 'calendário não está aberto' };
+  if (!noAlvo()) {
+    const periodo = cal().querySelector('.mat-calendar-period-button');
+    if (periodo) {
+      await clicar(periodo);
+      const y = celula(ano);
+      if (y) {
+        await clicar(y);
+        const meses12 = celulas();
+        if (meses12.length >= 12) await clicar(meses12[mes - 1]);
+      }
+    }
+  }
+  if (!noAlvo()) {
+    const atual = mesAtual();
+    if (!atual) return { ok: false, erro: 'cabeçalho ilegível: ' + cabecalho() };
+    const delta = (ano - atual[0]) * 12 + (mes - atual[1]);
+    const css = delta < 0 ? '.mat-calendar-previous-button' : '.mat-calendar-next-button';
+    for (let i = 0; i < Math.abs(delta); i++) await clicar(cal().querySelector(css));
+    if (!noAlvo()) return { ok: false, erro: 'mês alvo não alcançado: ' + cabecalho() };
+  }
+  for (const d of dias) {
+    const el = celula(d);
+    if (!el) return { ok: false, erro: 'dia ' + d + ' não encontrado em ' + cabecalho() };
+    await clicar(el);
+  }
+  return { ok: true, cabecalho: cabecalho() };
+}
+"""
+
+def _digitos(txt: str) -> str:
+    return re.sub(r"\D", "", txt or "")
+
+async def _valor_dos_campos(campo) -> str:
+    try:
+        return await campo.evaluate_all("els => els.map(e => e.value || e.innerText || '').join(' ')")
+    except Exception:
+        return ""
+
+async def _data_confirmada(campo, datas: List[datetime]) -> bool:
+    valor = _digitos(await _valor_dos_campos(campo))
+    return all(_digitos(fmt_date_br(d)) in valor for d in datas)
+
+async def _clicar_no_calendario(page, alvo: datetime, dias: List[int]) -> None:
+    res = await page.evaluate(_CALENDARIO_JS, {
+        "ano": alvo.year, "mes": alvo.month, "dias": dias, "meses": _MESES_ABREV,
+    }) or {}
+    if not res.get("ok"):
+        raise RuntimeError(f"Calendário: {res.get('erro') or 'falha desconhecida'}")
+
+async def selecionar_data(page, inicio: datetime, fim: Optional[datetime] = None, campo=None) -> None:
+    """
+    Seleciona uma data (ou o intervalo inicio→fim) no calendário já aberto com custo
+    constante, seja ontem ou onze meses atrás: pula direto ao mês alvo e clica o(s)
+    dia(s) em lote. Com `campo`, confirma que o valor aplicado contém as datas pedidas.
+    """
+    datas = [inicio] if fim is None else [inicio, fim]
+    if fim is None:
+        await _clicar_no_calendario(page, inicio, [inicio.day])
+    elif (inicio.year, inicio.month) == (fim.year, fim.month):
+        await _clicar_no_calendario(page, inicio, [inicio.day, fim.day])
+    else:
+        await _clicar_no_calendario(page, inicio, [inicio.day])
+        await _clicar_no_calendario(page, fim, [fim.day])
+    await wait_settled(page, fast=True, quiet_ms=50)
+
+    if campo is not None and not await _data_confirmada(campo, datas):
+        raise RuntimeError(
+            f"Data não aplicada: esperado {' a '.join(fmt_date_br(d) for d in datas)}, "
+            f"campo contém '{await _valor_dos_campos(campo)}'"
+        )
+    log(f"Data selecionada no calendário: {' a '.join(fmt_date_br(d) for d in datas)}")
 
 # async def aplicar_data_ontem(page) -> None:
 #     log("Aplicando filtro de data (modo de teste manual corrigido)")
@@ -518,54 +1366,44 @@ async def abrir_menu_financeiro_e_ir_para_nfs(page) -> None:
 #     await wait_loading_quiet(page, fast=True)
 
 
-async def aplicar_data_ontem(page) -> None:
-    log("Aplicando filtro de data personalizada (voltar até janeiro e selecionar dia 7)")
+async def aplicar_data_ontem(page, inicio: Optional[datetime] = None, fim: Optional[datetime] = None) -> None:
+    if inicio is None:
+        inicio, fim = _periodo_filtro()
+    fim = fim or inicio
+    log(f"Aplicando filtro de data personalizada: {fmt_date_br(inicio)} a {fmt_date_br(fim)}")
 
     # 1️⃣ Abre o seletor de data
     btn_data = page.locator("button[data-cy='EFD-DatePickerBTN']").first
-    await btn_data.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(btn_data, "filtro_data_botao", DEFAULT_TIMEOUT)
     await btn_data.click()
-    await asyncio.sleep(0.8)
+    await wait_settled(page, fast=True)
 
     # 2️⃣ Clica em “Período personalizado”
     periodo_personalizado = page.get_by_text(re.compile(r"^\s*Período personalizado\s*$", re.IGNORECASE)).first
-    await periodo_personalizado.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(periodo_personalizado, "filtro_data_periodo_personalizado", DEFAULT_TIMEOUT)
     await periodo_personalizado.click()
     log("Selecionado: Período personalizado")
 
     # 3️⃣ Clica no campo “Selecionar data” — seletor dinâmico (id pode variar)
     campo_data = page.locator("input[placeholder='Selecionar data'], input[matinput][placeholder*='Selecionar']")
-    await campo_data.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(campo_data, "filtro_data_campo", DEFAULT_TIMEOUT)
     await campo_data.click(force=True)
     log("Campo 'Selecionar data' clicado com sucesso")
 
-    # 4️⃣ Clica 10 vezes na seta de mês anterior (Previous month) para chegar até janeiro
-    btn_prev_mes = page.locator("button.mat-calendar-previous-button[aria-label*='Previous month']").first
-    await btn_prev_mes.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-    for i in range(10):
-        await btn_prev_mes.click()
-        log(f"Seta de mês anterior clicada ({i+1}/10)")
-        await asyncio.sleep(0.3)
-
-    # 5️⃣ Clica duas vezes no dia 7
-    dia_7 = page.locator("div.mat-calendar-body-cell-content", has_text="7").first
-    await dia_7.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-    await dia_7.click()
-    await asyncio.sleep(0.3)
-    await dia_7.click()
-    log("Dia 7 clicado duas vezes")
-
-    # 6️⃣ Clica no botão “Aplicar”
+    # 4️⃣ Intervalo direto no calendário (sem passo a passo de mês em mês)
+    await selecionar_data(page, inicio, fim, campo=campo_data)
+
+    # 5️⃣ Clica no botão “Aplicar”
     aplicar = page.locator(
         "button[data-cy='EFD-ApplyButton'], button",
         has_text=re.compile(r"Aplicar", re.IGNORECASE)
     ).first
-    await aplicar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(aplicar, "filtro_data_aplicar", DEFAULT_TIMEOUT)
     await aplicar.click()
     log("Botão 'Aplicar' clicado")
 
-    # 7️⃣ Aguarda atualização
-    await wait_loading_quiet(page, fast=True)
+    # 6️⃣ Aguarda atualização
+    await wait_settled(page, fast=True)
 
 
 
@@ -574,7 +1412,7 @@ async def aplicar_data_ontem(page) -> None:
 async def exibir_por_data_lancamento(page) -> None:
     log("Configurando 'Exibir por' → 'Data de Lançamento'")
     abrir = page.locator("button[data-cy='abrirFiltro']").first
-    await abrir.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(abrir, "exibir_por_abrir_filtro", DEFAULT_TIMEOUT)
 
     patt = re.compile(r"^\s*Data\s*(de\s*)?lan[çc]amento\s*$", re.IGNORECASE)
 
@@ -588,23 +1426,23 @@ async def exibir_por_data_lancamento(page) -> None:
                 has_not=page.locator(".cdk-overlay-pane[aria-hidden='true']")
             ).last
             try:
-                await overlay.wait_for(state="visible", timeout=1500)
+                await aguardar(overlay, "exibir_por_painel", 1500)
                 return overlay
             except PlaywrightTimeout:
-                await asyncio.sleep(0.2)
+                await wait_settled(page, fast=True)
                 continue
         return None
 
     overlay = await open_overlay_or_retry()
     if overlay is None:
         await page.keyboard.press("Escape")
-        await asyncio.sleep(0.2)
+        await wait_settled(page, fast=True)
         overlay = await open_overlay_or_retry()
         if overlay is None:
             try:
                 aplicar_global = page.locator("button[data-cy='AplicarFiltro']").first
                 await aplicar_global.click(timeout=FAST_TIMEOUT)
-                await wait_loading_quiet(page, fast=True)
+                await wait_settled(page, fast=True)
                 return
             except Exception:
                 raise RuntimeError("Não foi possível abrir o overlay de 'Exibir por'.")
@@ -621,7 +1459,7 @@ async def exibir_por_data_lancamento(page) -> None:
     except Exception:
         try:
             opt = overlay.get_by_text(patt).first
-            await opt.wait_for(state="visible", timeout=FAST_TIMEOUT)
+            await aguardar(opt, "exibir_por_opcao_lancamento", FAST_TIMEOUT)
             try:
                 await opt.click(timeout=FAST_TIMEOUT)
             except Exception:
@@ -631,21 +1469,20 @@ async def exibir_por_data_lancamento(page) -> None:
 
     try:
         aplicar = overlay.locator("button[data-cy='AplicarFiltro']").first
-        await aplicar.wait_for(state="visible", timeout=FAST_TIMEOUT)
+        await aguardar(aplicar, "exibir_por_aplicar_painel", FAST_TIMEOUT)
         await aplicar.click(timeout=FAST_TIMEOUT)
     except Exception:
         aplicar2 = page.locator("button[data-cy='AplicarFiltro']").first
-        await aplicar2.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        await aguardar(aplicar2, "exibir_por_aplicar_pagina", DEFAULT_TIMEOUT)
         await aplicar2.click(timeout=FAST_TIMEOUT)
 
-    await asyncio.sleep(0.3)
-    await wait_loading_quiet(page, fast=True)
+    await wait_settled(page, fast=True)
 
 # === Tributação — marcar TODOS e DESMARCAR QUALQUER “Não usar - …” ===
 async def aplicar_filtro_tributacao(page) -> None:
     log("Abrindo + FILTROS")
     btn_mais_filtros = page.get_by_role("button", name=re.compile(r"\+\s*FILTROS", re.IGNORECASE)).first
-    await btn_mais_filtros.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(btn_mais_filtros, "tributacao_mais_filtros", DEFAULT_TIMEOUT)
     try:
         await btn_mais_filtros.click()
     except Exception:
@@ -653,18 +1490,18 @@ async def aplicar_filtro_tributacao(page) -> None:
 
     log("Abrindo Tributação")
     btn_tributacao = page.locator("button.simula-mat-menu", has_text=re.compile(r"^\s*Tributação\s*$", re.IGNORECASE)).first
-    await btn_tributacao.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(btn_tributacao, "tributacao_botao", DEFAULT_TIMEOUT)
     await btn_tributacao.click()
 
     pane = page.locator("div.cdk-overlay-pane").filter(
         has_not=page.locator(".cdk-overlay-pane[aria-hidden='true']")
     ).last
-    await pane.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(pane, "tributacao_painel", DEFAULT_TIMEOUT)
 
     # 1) 'Todos'
     try:
         todos = pane.get_by_text(re.compile(r"^\s*Todos\s*$", re.IGNORECASE)).first
-        await todos.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        await aguardar(todos, "tributacao_todos", DEFAULT_TIMEOUT)
         await todos.click()
     except Exception:
         pass
@@ -690,16 +1527,15 @@ async def aplicar_filtro_tributacao(page) -> None:
 
     # 3) aplicar
     aplicar = page.locator("button[data-cy='AplicarFiltro'], button#btn", has_text=re.compile(r"Aplicar", re.IGNORECASE)).first
-    await aplicar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(aplicar, "tributacao_aplicar", DEFAULT_TIMEOUT)
     await aplicar.click()
 
-    await asyncio.sleep(0.4)
-    await wait_loading_quiet(page, fast=True)
+    await wait_settled(page, fast=True)
 
 
 # === Validação universal: existe "Selecionar todos"? ===
 async def has_select_all_checkbox(page) -> bool:
-    await asyncio.sleep(2.0)  # janela para a tabela renderizar
+    await wait_settled(page, fast=True)  # tabela renderizada (sem XHR/spinner pendente)
     sel = page.locator(
         "mat-checkbox[data-cy='SelecionarTodosCheck'], "
         "mat-header-row mat-checkbox, "
@@ -707,83 +1543,52 @@ async def has_select_all_checkbox(page) -> bool:
         "mat-checkbox .mat-checkbox-inner-container"
     ).first
     try:
-        await sel.wait_for(state="visible", timeout=1500)
+        await aguardar(sel, "lista_checkbox_selecionar_todos", 1500)
         return True
     except PlaywrightTimeout:
         return False
 
+@medido("enviar_selecionar")
 async def selecionar_todos_e_enviar(page) -> None:
     log("Selecionando todos os registros")
     sel_todos = page.locator("mat-checkbox[data-cy='SelecionarTodosCheck']").first
-    await sel_todos.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(sel_todos, "lista_selecionar_todos", DEFAULT_TIMEOUT)
     await sel_todos.click()
 
     log("Clicando ENVIAR (abre modal)")
     enviar = page.get_by_role("button", name=re.compile(r"^\s*ENVIAR\s*$", re.IGNORECASE)).first
-    await enviar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(enviar, "lista_botao_enviar", DEFAULT_TIMEOUT)
     await enviar.click()
 
-    await asyncio.sleep(0.4)
-    await wait_loading_quiet(page, fast=True)
-
-async def digitar_data_util_anterior_no_input(page) -> None:
-    alvo = previous_business_day()
-    data_txt = fmt_date_br(alvo)
-    log(f"Preenchendo campo de data com dia útil anterior no modal: {data_txt}")
+    await wait_settled(page, fast=True)
 
-    campo = page.locator("mat-dialog-container input#evoDatepicker[placeholder='Selecione a data']").first
-    if not await campo.is_visible():
-        campo = page.locator("input#evoDatepicker[placeholder='Selecione a data']").first
-
-    await campo.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-    await campo.click()
-    await page.keyboard.press("Control+A")
-    await page.keyboard.press("Backspace")
-    await campo.type(data_txt, delay=24)
-    await asyncio.sleep(0.2)
+def _campo_data_modal(page):
+    return page.locator(
+        "mat-dialog-container input#evoDatepicker[placeholder='Selecione a data'], "
+        "input#evoDatepicker[placeholder='Selecione a data']"
+    ).first
 
+@medido("enviar_data_modal")
 async def selecionar_data_ontem_modal(page) -> None:
     """
     Dentro do modal de envio:
     - Abre o calendário
-    - Seleciona o dia anterior ao atual
-    - Se hoje for dia 1, volta um mês e seleciona o último dia
+    - Seleciona o dia anterior ao atual (inclusive virada de mês/ano)
     """
-    hoje = datetime.now()
-    ontem = hoje - timedelta(days=1)
-    log(f"Abrindo calendário e selecionando a data de ontem: {ontem.strftime('%d/%m/%Y')}")
+    ontem = datetime.now() - timedelta(days=1)
+    log(f"Abrindo calendário e selecionando a data de ontem: {fmt_date_br(ontem)}")
 
     # Abre o calendário (ícone do datepicker)
     btn_calendar = page.locator("svg.mat-datepicker-toggle-default-icon").first
-    await btn_calendar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(btn_calendar, "modal_envio_calendario", DEFAULT_TIMEOUT)
     await btn_calendar.click()
-    await asyncio.sleep(0.4)
-
-    # Caso o dia atual seja 1 → voltar um mês
-    if hoje.day == 1:
-        log("Hoje é dia 1 — voltando um mês e selecionando o último dia do mês anterior")
-        btn_prev = page.locator("button.mat-calendar-previous-button").first
-        await btn_prev.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-        await btn_prev.click()
-        await asyncio.sleep(0.4)
-
-        # Seleciona o último dia do mês (31, 30, 29 ou 28)
-        for dia in ["31", "30", "29", "28"]:
-            dia_loc = page.locator("div.mat-calendar-body-cell-content", has_text=dia).first
-            if await dia_loc.count():
-                await dia_loc.click()
-                log(f"Selecionado último dia do mês anterior: {dia}")
-                break
-    else:
-        # Seleciona o dia de ontem
-        dia_ontem = str(ontem.day)
-        dia_loc = page.locator("div.mat-calendar-body-cell-content", has_text=dia_ontem).first
-        await dia_loc.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-        await dia_loc.click()
-        log(f"Dia {dia_ontem} selecionado com sucesso")
+    await wait_settled(page, fast=True, quiet_ms=50)
 
-    await asyncio.sleep(0.5)
+    campo = _campo_data_modal(page)
+    await selecionar_data(page, ontem, campo=campo if await campo.count() else None)
+    await wait_settled(page, fast=True)
 
+@medido("enviar_fechar_modal")
 async def cancelar_modal_enviar_nf(page) -> None:
     log("Cancelando modal 'Enviar NF'")
     dialog = page.get_by_role("dialog", name=re.compile(r"^\s*Enviar\s*NF\s*$", re.IGNORECASE)).first
@@ -792,14 +1597,13 @@ async def cancelar_modal_enviar_nf(page) -> None:
     cancelar = dialog.get_by_role("button", name=re.compile(r"^\s*Cancelar\s*$", re.IGNORECASE)).first
     if not await cancelar.count():
         cancelar = dialog.locator("button", has_text=re.compile(r"^\s*Cancelar\s*$", re.IGNORECASE)).first
-    await cancelar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(cancelar, "modal_envio_cancelar", DEFAULT_TIMEOUT)
     await cancelar.click()
     try:
-        await dialog.wait_for(state="detached", timeout=DEFAULT_TIMEOUT)
+        await aguardar(dialog, "modal_envio_fechado", DEFAULT_TIMEOUT, state="detached")
     except Exception:
         await page.keyboard.press("Escape")
-        await asyncio.sleep(0.2)
-    await wait_loading_quiet(page, fast=True)
+    await wait_settled(page, fast=True)
     log("Modal 'Enviar NF' cancelado com sucesso")
 
 # =========================================================
@@ -821,7 +1625,7 @@ async def _require_count_gt0(locator, err_msg: str):
 async def _scroll_table_step(page) -> None:
     """Rola um passo para baixo para forçar render de novas linhas."""
     await page.keyboard.press("PageDown")
-    await asyncio.sleep(0.25)
+    await wait_settled(page, fast=True, quiet_ms=50)
 
 async def _coletar_invalidos_novos(page, vistos: set) -> tuple[list[dict], int]:
     """
@@ -833,7 +1637,8 @@ async def _coletar_invalidos_novos(page, vistos: set) -> tuple[list[dict], int]:
     """
     # espera até existir pelo menos 1 célula de cliente (2.5s)
     try:
-        await page.wait_for_selector("[data-cy='cliente']", state="attached", timeout=2500)
+        async with limite_adaptativo("[data-cy='cliente']", 2500) as limite:
+            await page.wait_for_selector("[data-cy='cliente']", state="attached", timeout=limite)
     except Exception:
         # não há linhas visíveis
         log("Validação: não há [data-cy='cliente'] visível (tabela vazia?).")
@@ -894,15 +1699,8 @@ async def _coletar_invalidos_novos(page, vistos: set) -> tuple[list[dict], int]:
 
     return invalidos, novos
 
-async def validar_antes_de_enviar(page) -> Optional[List[dict]]:
-    """
-    Varre a grade SEM paginação:
-    - Rola com PageDown até não surgirem clientes novos por 3 passos seguidos.
-    - Exige na mesma linha: [data-cy='cliente'], .label.very-tiny, span[data-cy='informacoes'].full
-    - Se houver inválidos, mostra alert e retorna a lista.
-    """
-    log("Validação (sem paginação): iniciando…")
-
+async def _varrer_invalidos_por_scroll(page) -> tuple[list[dict], int]:
+    """Rola com PageDown até não surgirem clientes novos por 3 passos seguidos."""
     vistos: set[str] = set()
     invalidos_total: list[dict] = []
     estagnado = 0
@@ -928,7 +1726,154 @@ async def validar_antes_de_enviar(page) -> Optional[List[dict]]:
 
         await _scroll_table_step(page)
 
-    log(f"Validação: {len(vistos)} clientes varridos; {len(invalidos_total)} inválidos.")
+    return invalidos_total, len(vistos)
+
+# === Colheita em passada única (scroll dentro da página + MutationObserver) ===
+# Rola o contêiner da grade pelo próprio JS, observa as linhas que o virtual scroll
+# renderiza e devolve [cliente, status, motivo] em lotes via expose_binding.
+# Para quando o scrollHeight deixa de crescer com o scroll já no fim.
+_COLHER_JS = """
+async ({lote, maxMs}) => {
+  const norm = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const CEL = "[data-cy='cliente']";
+  const first = document.querySelector(CEL);
+  if (!first) return { total: 0, vazio: true };
+
+  let box = first.parentElement;
+  while (box && box !== document.body) {
+    const oy = getComputedStyle(box).overflowY;
+    if ((oy === 'auto' || oy === 'scroll') && box.scrollHeight > box.clientHeight) break;
+    box = box.parentElement;
+  }
+  const raiz = (!box || box === document.body) ? document.body : box;
+  if (!box || box === document.body) box = document.scrollingElement || document.documentElement;
+
+  const linhaDe = cel => {
+    for (let el = cel.parentElement; el; el = el.parentElement) {
+      if (el.querySelector('.label.very-tiny') && el.querySelector("span[data-cy='informacoes'].full")) return el;
+    }
+    return null;
+  };
+  const vistos = new Set();
+  let buffer = [];
+  let erro = null;
+  const ler = cel => {
+    const cliente = norm(cel.innerText);
+    if (!cliente || vistos.has(cliente)) return;
+    const linha = linhaDe(cel);
+    if (!linha) {
+      erro = erro || ("Não achei ancestral da linha para o cliente '" + cliente + "' que contenha status "
+                      + "(.label.very-tiny) e motivo (span[data-cy='informacoes'].full).");
+      return;
+    }
+    const st = linha.querySelector("span.label.very-tiny.vermelho") || linha.querySelector("span.label.very-tiny");
+    const mot = linha.querySelector("span[data-cy='informacoes'].full");
+    vistos.add(cliente);
+    buffer.push([cliente, norm(st && st.innerText), norm(mot && mot.innerText)]);
+  };
+  const varrer = no => {
+    if (no.matches && no.matches(CEL)) ler(no);
+    if (no.querySelectorAll) no.querySelectorAll(CEL).forEach(ler);
+  };
+  const flush = async () => {
+    if (!buffer.length) return;
+    const b = buffer; buffer = [];
+    await window.__rpaColheitaLote(b);
+  };
+
+  const obs = new MutationObserver(muts => {
+    for (const m of muts) m.addedNodes.forEach(n => { if (n.nodeType === 1) varrer(n); });
+  });
+  obs.observe(raiz, { childList: true, subtree: true });
+  const quadro = () => new Promise(r => requestAnimationFrame(() => r()));
+  const t0 = performance.now();
+  let altura = -1, parado = 0;
+  try {
+    varrer(raiz);
+    while (performance.now() - t0 < maxMs && !erro) {
+      if (buffer.length >= lote) await flush();
+      const noFim = box.scrollTop + box.clientHeight >= box.scrollHeight - 2;
+      if (noFim) {
+        if (box.scrollHeight === altura) { if (++parado >= 3) break; } else { parado = 0; }
+        altura = box.scrollHeight;
+        await new Promise(r => setTimeout(r, 120));
+      } else {
+        box.scrollTop = Math.min(box.scrollTop + Math.max(box.clientHeight * 0.9, 50), box.scrollHeight);
+        await quadro(); await quadro();
+      }
+    }
+    varrer(raiz);
+    await flush();
+  } finally {
+    obs.disconnect();
+  }
+  return { total: vistos.size, erro };
+}
+"""
+
+# Lote corrente de cada página com a binding registrada (binding é única por página)
+_COLHEITAS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+async def _preparar_colheita(page) -> list:
+    if page not in _COLHEITAS:
+        def _receber(source, lote) -> None:
+            alvo = _COLHEITAS.get(source["page"])
+            if alvo is not None:
+                alvo.extend(lote)
+        await page.expose_binding("__rpaColheitaLote", _receber)
+    linhas: list = []
+    _COLHEITAS[page] = linhas
+    return linhas
+
+async def _colher_invalidos(page) -> tuple[list[dict], int]:
+    """Uma varredura de scroll dentro da página; retorna (inválidos, qtd_clientes)."""
+    linhas = await _preparar_colheita(page)
+    res = await page.evaluate(_COLHER_JS, {"lote": 25, "maxMs": 120000}) or {}
+    if res.get("vazio"):
+        log("Validação: não há [data-cy='cliente'] visível (tabela vazia?).")
+        return [], 0
+    if res.get("erro"):
+        raise RuntimeError(res["erro"])
+    invalidos: list[dict] = []
+    clientes: set[str] = set()
+    for cliente, status, motivo in linhas:
+        if cliente in clientes:
+            continue
+        clientes.add(cliente)
+        if not _is_valido(status):
+            invalidos.append({
+                "cliente": cliente,
+                "status": status or "(sem status)",
+                "motivo": motivo or "(sem detalhes)",
+            })
+    return invalidos, len(clientes)
+
+async def validar_antes_de_enviar(page, captura: Optional["CapturaGrade"] = None) -> Optional[List[dict]]:
+    """
+    Varre a grade SEM paginação:
+    - Se a captura de rede tiver a lista completa, usa o status vindo do backend.
+    - Senão faz uma passada de scroll dentro da página (_colher_invalidos);
+      se ela falhar, rola com PageDown até não surgirem clientes novos por 3 passos.
+    - Exige na mesma linha: [data-cy='cliente'], .label.very-tiny, span[data-cy='informacoes'].full
+    - Se houver inválidos, mostra alert e retorna a lista.
+    """
+    log("Validação (sem paginação): iniciando…")
+
+    capturados = await captura.invalidos() if captura is not None else None
+    if capturados is not None:
+        invalidos_total, varridos = capturados
+        log(f"Validação: {varridos} clientes lidos da resposta do backend; {len(invalidos_total)} inválidos.")
+    else:
+        try:
+            invalidos_total, varridos = await _colher_invalidos(page)
+        except Exception as e:
+            log(f"Validação: colheita em passada única falhou ({e}); usando PageDown.")
+            invalidos_total, varridos = await _varrer_invalidos_por_scroll(page)
+        log(f"Validação: {varridos} clientes varridos; {len(invalidos_total)} inválidos.")
+
+    for i in invalidos_total:
+        evento("invalido", f"Cadastro inválido: {i['cliente']} | status: {i['status']} | motivo: {i['motivo']}", "WARNING")
+
     if invalidos_total:
         linhas = [f"- {i['cliente']} | status: {i['status']} | motivo: {i['motivo']}" for i in invalidos_total[:20]]
         extra = "" if len(invalidos_total) <= 20 else f"\n(+ {len(invalidos_total)-20} outros)"
@@ -937,63 +1882,65 @@ async def validar_antes_de_enviar(page) -> Optional[List[dict]]:
 
     return invalidos_total
 
-# === Abrir perfil do cliente inválido ===
-# === Abrir perfil do cliente inválido e verificar país ===
-async def abrir_perfil_cliente_invalido(page, cliente_id: str) -> None:
+# === Tratamento de clientes inválidos (pool de abas) ===
+# Quantas abas de correção trabalham ao mesmo tempo
+REMEDIACAO_ABAS = max(1, int(os.getenv("RPA_REMEDIACAO_ABAS", "3") or 3))
+
+# IDs já tratados com sucesso no run corrente do tenant (evita abrir o mesmo perfil duas
+# vezes) e IDs em tratamento agora (outra aba/unidade não pega o mesmo cliente junto)
+_CLIENTES_TRATADOS: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar("rpa_clientes_tratados", default=None)
+_CLIENTES_EM_TRATAMENTO: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar(
+    "rpa_clientes_em_tratamento", default=None)
+
+async def _analisar_cliente_invalido(aba, url_lista: str, cliente_id: str) -> dict:
     """
-    Duplica a aba atual, abre o perfil do cliente inválido e:
-      - Se País != Brasil: considera estrangeiro, fecha a aba e retorna.
-      - Se País == Brasil e CPF vazio: considera criança, ajusta Responsáveis e salva, fecha a aba e retorna.
-      - Se País == Brasil e CPF preenchido: fecha a aba e segue normalmente.
+    Abre o perfil do cliente na aba de correção e decide:
+      - País != Brasil: "estrangeiro" (nada a fazer).
+      - Brasil e CPF vazio: criança → ajusta Responsáveis e salva ("crianca_corrigida").
+      - Brasil e CPF preenchido: "ok".
+    Retorna {"cliente_id", "decisao", "pais", "cpf"}.
     """
     log(f"Abrindo perfil do cliente inválido: {cliente_id}")
 
-    # 1️⃣ Nova aba preservando filtros/URL da lista
-    new_page = await page.context.new_page()
-    await new_page.goto(page.url, wait_until="domcontentloaded")
-    await wait_loading_quiet(new_page, fast=True)
+    # 1️⃣ Aba de correção na lista (preserva filtros/URL)
+    await aba.goto(url_lista, wait_until="domcontentloaded")
+    await wait_settled(aba, fast=True)
 
     # 2️⃣ Buscar cliente pelo código no campo global
-    campo_busca = new_page.locator(
+    campo_busca = aba.locator(
         "input#evoAutocomplete[placeholder*='Pesquise por nome'], input.pesquisar-dropdown"
     )
-    await campo_busca.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
-    await campo_busca.fill("")
-    await campo_busca.type(str(cliente_id), delay=40)
-
-    resultado = new_page.locator("div.buscas").first
-    await resultado.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(campo_busca, "cliente_campo_busca", DEFAULT_TIMEOUT)
+    resultado = aba.locator("div.buscas").first
+    await campo_busca.fill(str(cliente_id))
+    try:
+        await aguardar(resultado, "cliente_resultado_busca", SHORT_TIMEOUT)
+    except PlaywrightTimeout:
+        # autocomplete que só reage a teclas: digita de novo
+        await campo_busca.fill("")
+        await campo_busca.type(str(cliente_id), delay=40)
+        await aguardar(resultado, "cliente_resultado_busca_digitada", DEFAULT_TIMEOUT)
     await resultado.click()
-    await wait_loading_quiet(new_page, fast=False)
+    await wait_settled(aba, fast=False)
 
     # 3️⃣ Ir para "Cadastro"
-    aba_cadastro = new_page.locator("a[aria-label='Cadastro'], a[ui-sref*='dadosPessoais']").first
-    await aba_cadastro.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    aba_cadastro = aba.locator("a[aria-label='Cadastro'], a[ui-sref*='dadosPessoais']").first
+    await aguardar(aba_cadastro, "cliente_aba_cadastro", DEFAULT_TIMEOUT)
     await aba_cadastro.click()
-    await wait_loading_quiet(new_page, fast=True)
-    await asyncio.sleep(0.5)
+    await wait_settled(aba, fast=True)
 
-    # 4️⃣ Ler valor do País — agora buscando especificamente um <span> com texto de país
+    # 4️⃣ Ler valor do País — buscando especificamente um <span> com texto de país
     try:
-        # Busca todos os <span> dentro de mat-select-value-text
-        spans_pais = new_page.locator("span.mat-select-value-text span")
-        qtd_spans = await spans_pais.count()
-        valor_pais = ""
-
-        for i in range(qtd_spans):
-            txt = (await spans_pais.nth(i).inner_text()).strip()
-            if re.search(r"brasil", _normalize_str(txt)):
-                valor_pais = txt
-                break
-        if not valor_pais and qtd_spans > 0:
+        spans_pais = aba.locator("span.mat-select-value-text span")
+        textos = [t.strip() for t in await spans_pais.all_inner_texts()]
+        valor_pais = next((t for t in textos if re.search(r"brasil", _normalize_str(t))), "")
+        if not valor_pais and textos:
             # fallback: pega o último valor encontrado (geralmente País vem depois do DDI)
-            valor_pais = (await spans_pais.nth(qtd_spans - 1).inner_text()).strip()
-
+            valor_pais = textos[-1]
         if not valor_pais:
             raise RuntimeError("Campo 'País' não encontrado entre spans.")
-
     except Exception as e:
-        log(f"Falha ao localizar campo País: {e}")
+        log(f"Falha ao localizar campo País: {e}", "WARNING")
         valor_pais = ""
 
     eh_brasil = "brasil" in _normalize_str(valor_pais)
@@ -1001,36 +1948,94 @@ async def abrir_perfil_cliente_invalido(page, cliente_id: str) -> None:
 
     # 5️⃣ Ler valor do CPF
     try:
-        campo_cpf = new_page.locator("input#cpf").first
+        campo_cpf = aba.locator("input#cpf").first
         valor_cpf = ""
         if await campo_cpf.count():
-            await campo_cpf.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+            await aguardar(campo_cpf, "cliente_campo_cpf", DEFAULT_TIMEOUT)
             valor_cpf = (await campo_cpf.input_value()).strip()
     except Exception as e:
-        log(f"Falha ao ler CPF: {e}")
+        log(f"Falha ao ler CPF: {e}", "WARNING")
         valor_cpf = ""
 
     log(f"Valor do CPF detectado: '{valor_cpf or '(vazio)'}'")
+    resultado_cliente = {"cliente_id": cliente_id, "pais": valor_pais, "cpf": valor_cpf}
 
     # 6️⃣ Decisões de validação
     if not eh_brasil:
-        print("\n⚠️ Usuário estrangeiro detectado\n")
-        log("Usuário estrangeiro — fechando a aba e retornando ao fluxo.")
-        await new_page.close()
-        return
+        log(f"⚠️ Cliente {cliente_id}: usuário estrangeiro — nada a corrigir.", "WARNING")
+        return {**resultado_cliente, "decisao": "estrangeiro"}
 
-    if eh_brasil and not valor_cpf:
-        print("\n👶 Usuário identificado como CRIANÇA (Brasil, sem CPF)\n")
-        log("Usuário brasileiro sem CPF — tratando como criança.")
-        await tratar_crianca_responsavel(new_page)
-        await new_page.close()
-        log("Aba do cliente (criança) fechada. Retomando o processo na aba principal.")
-        return
+    if not valor_cpf:
+        log(f"👶 Cliente {cliente_id}: brasileiro sem CPF — tratando como criança.")
+        await tratar_crianca_responsavel(aba)
+        return {**resultado_cliente, "decisao": "crianca_corrigida"}
+
+    log(f"Cliente {cliente_id}: brasileiro com CPF — nenhum tratamento adicional necessário.")
+    return {**resultado_cliente, "decisao": "ok"}
 
-    # Se chegou aqui: é brasileiro e tem CPF → seguir normalmente
-    log("Usuário brasileiro com CPF — nenhum tratamento adicional necessário.")
-    await new_page.close()
-    return
+@medido("tratar_invalidos")
+async def tratar_clientes_invalidos(page, cliente_ids: List[str], abas: int = REMEDIACAO_ABAS) -> List[dict]:
+    """
+    Pool de até `abas` abas de correção consumindo uma fila de IDs (sem repetir
+    IDs já tratados neste run). Retorna um resultado por cliente tratado, com
+    decisao = estrangeiro | crianca_corrigida | ok | falha. Só quem não falhou
+    conta como tratado: uma falha pode ser tentada de novo na próxima passada.
+    """
+    tratados = _CLIENTES_TRATADOS.get()
+    if tratados is None:
+        tratados = set()
+        _CLIENTES_TRATADOS.set(tratados)
+    em_tratamento = _CLIENTES_EM_TRATAMENTO.get()
+    if em_tratamento is None:
+        em_tratamento = set()
+        _CLIENTES_EM_TRATAMENTO.set(em_tratamento)
+    fila: asyncio.Queue = asyncio.Queue()
+    for cid in dict.fromkeys(str(c) for c in cliente_ids):
+        if cid in tratados or cid in em_tratamento:
+            log(f"Cliente {cid} já tratado (ou em tratamento) neste run — ignorando.")
+            continue
+        em_tratamento.add(cid)
+        fila.put_nowait(cid)
+    if fila.empty():
+        return []
+
+    url_lista = page.url
+    resultados: dict[str, dict] = {}
+    total = fila.qsize()
+
+    async def _trabalhador(n: int) -> None:
+        aba = await _nova_aba(page.context)
+        try:
+            while True:
+                try:
+                    cid = fila.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    resultados[cid] = await _analisar_cliente_invalido(aba, url_lista, cid)
+                except Exception as e:
+                    log(f"Falha ao tratar cliente {cid} (aba {n}): {e}", "WARNING")
+                    resultados[cid] = {"cliente_id": cid, "decisao": "falha", "erro": str(e)}
+                finally:
+                    em_tratamento.discard(cid)
+                if resultados.get(cid, {}).get("decisao") not in (None, "falha"):
+                    tratados.add(cid)
+        finally:
+            try:
+                await aba.close()
+            except Exception:
+                pass
+
+    n_abas = min(max(1, abas), total)
+    log(f"Tratando {total} cliente(s) inválido(s) com {n_abas} aba(s) de correção")
+    await asyncio.gather(*(_trabalhador(n) for n in range(1, n_abas + 1)))
+    ordem = [c for c in dict.fromkeys(str(c) for c in cliente_ids) if c in resultados]
+    return [resultados[c] for c in ordem]
+
+async def abrir_perfil_cliente_invalido(page, cliente_id: str) -> Optional[dict]:
+    """Trata um único cliente inválido (numa aba de correção) e retorna a decisão."""
+    resultados = await tratar_clientes_invalidos(page, [cliente_id], abas=1)
+    return resultados[0] if resultados else None
 
 
 
@@ -1078,24 +2083,22 @@ async def tratar_crianca_responsavel(page) -> None:
         aba_resp = page.locator("md-tab-item, .md-tab, [role='tab']").filter(
             has_text=re.compile(r"Respons[aá]veis", re.IGNORECASE)
         ).first
-    await aba_resp.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(aba_resp, "responsavel_aba", DEFAULT_TIMEOUT)
     await aba_resp.click()
-    await wait_loading_quiet(page, fast=True)
-    await asyncio.sleep(0.4)
+    await wait_settled(page, fast=True)
 
     # 2) Editar o primeiro registro (ícone 'edit')
     botao_editar = page.locator("mat-icon", has_text=re.compile(r"^\s*edit\s*$", re.IGNORECASE)).first
     # Caso o mat-icon esteja dentro de um botão:
     if await botao_editar.count() == 0:
         botao_editar = page.locator("button mat-icon", has_text=re.compile(r"^\s*edit\s*$", re.IGNORECASE)).first
-    await botao_editar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(botao_editar, "responsavel_editar", DEFAULT_TIMEOUT)
     # clicar no container do botão se necessário
     try:
         await botao_editar.click()
     except Exception:
         await botao_editar.locator("xpath=ancestor::button[1]").click()
-    await wait_loading_quiet(page, fast=True)
-    await asyncio.sleep(0.3)
+    await wait_settled(page, fast=True)
 
     # 3) Marcar as duas checkboxes (as das imagens 3 e 4)
     # Usamos os dois primeiros ".mat-checkbox-inner-container" do formulário de edição.
@@ -1122,19 +2125,313 @@ async def tratar_crianca_responsavel(page) -> None:
         salvar = page.locator("button.evo-button.primary, button.evo-button.success, button.mat-button").filter(
             has_text=re.compile(r"^\s*Salvar\s*$", re.IGNORECASE)
         ).first
-    await salvar.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+    await aguardar(salvar, "responsavel_salvar", DEFAULT_TIMEOUT)
     try:
         await salvar.click()
     except Exception:
         await salvar.click(force=True)
-    await wait_loading_quiet(page, fast=True)
-    await asyncio.sleep(0.3)
+    await wait_settled(page, fast=True)
 
     log("Edição do responsável salva com sucesso (criança tratada).")
 
 
 
-async def coletar_registros_tabela(page, limite_por_pagina: int = 100):
+# Colunas da grade de NFS, na ordem (a coluna 0 é o checkbox)
+_GRADE_CAMPOS = [
+    "cliente", "cpf", "descricao", "recebimento", "lancamento",
+    "vencimento", "valor", "valor_emissao", "cadastro", "detalhes",
+]
+
+# Lê a página visível inteira num único page.evaluate: normaliza espaços e já
+# devolve os registros mapeados para _GRADE_CAMPOS.
+_GRADE_EXTRAIR_JS = """
+(campos) => {
+  const norm = s => (s || '').replace(/\\s+/g, ' ').trim();
+  const out = [];
+  document.querySelectorAll('mat-table mat-row, table tbody tr').forEach(row => {
+    const cells = row.querySelectorAll('mat-cell, td');
+    if (!cells.length) return;
+    const reg = {};
+    campos.forEach((c, i) => { const cell = cells[i + 1]; reg[c] = cell ? norm(cell.innerText) : ''; });
+    out.push(reg);
+  });
+  return out;
+}
+"""
+
+# =========================
+# Captura das respostas JSON do backend da grade
+# =========================
+# Padrões de URL das chamadas XHR que alimentam a grade/paginador e o status de cadastro.
+GRID_API_REGEX = re.compile(
+    os.getenv("RPA_GRID_API_REGEX", r"/api/.*(nota|nfs|fiscal)"), re.IGNORECASE
+)
+CLIENTE_STATUS_API_REGEX = re.compile(
+    os.getenv("RPA_CLIENTE_STATUS_API_REGEX", r"/api/.*(cliente|cadastro).*(status|valid)"), re.IGNORECASE
+)
+
+# Nomes de chave aceitos (sem diferenciar maiúsculas) para cada campo do registro
+_JSON_CHAVES = {
+    "cliente_id": ("idcliente", "clienteid", "codigocliente", "idmembro", "idaluno"),
+    "cliente": ("nomecliente", "cliente", "nome", "nomemembro", "nomealuno"),
+    "cpf": ("cpf", "cpfcnpj", "documento"),
+    "descricao": ("descricao", "descricaoservico", "servico"),
+    "recebimento": ("datarecebimento", "recebimento", "dtrecebimento"),
+    "lancamento": ("datalancamento", "lancamento", "dtlancamento"),
+    "vencimento": ("datavencimento", "vencimento", "dtvencimento"),
+    "valor": ("valor", "valorrecebido", "valortotal"),
+    "valor_emissao": ("valoremissao", "valornota", "valornf"),
+    "cadastro": ("statuscadastro", "situacaocadastro", "cadastrovalido", "cadastro", "valido"),
+    "detalhes": ("detalhes", "informacoes", "motivo", "mensagem"),
+}
+_JSON_LISTAS = ("itens", "items", "lista", "registros", "content", "data", "result", "resultado")
+_JSON_TOTAIS = ("total", "totalitens", "totalelements", "totalregistros", "quantidadetotal", "count")
+
+def _json_get(obj: dict, chaves: Tuple[str, ...]):
+    """Procura a primeira chave aceita no objeto (e um nível abaixo, ex.: cliente.nome)."""
+    low = {str(k).lower(): v for k, v in obj.items()}
+    for k in chaves:
+        v = low.get(k)
+        if v is not None and not isinstance(v, (dict, list)):
+            return v
+    for v in obj.values():
+        if isinstance(v, dict):
+            sub = _json_get(v, chaves)
+            if sub is not None:
+                return sub
+    return None
+
+def _json_itens(payload) -> Optional[List[dict]]:
+    if isinstance(payload, list):
+        return [i for i in payload if isinstance(i, dict)] if payload else []
+    if isinstance(payload, dict):
+        low = {str(k).lower(): v for k, v in payload.items()}
+        for k in _JSON_LISTAS:
+            v = low.get(k)
+            if isinstance(v, list):
+                return [i for i in v if isinstance(i, dict)]
+            if isinstance(v, dict):
+                sub = _json_itens(v)
+                if sub is not None:
+                    return sub
+    return None
+
+def _json_total(payload) -> Optional[int]:
+    if not isinstance(payload, dict):
+        return None
+    low = {str(k).lower(): v for k, v in payload.items()}
+    for k in _JSON_TOTAIS:
+        v = low.get(k)
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return int(v)
+    for v in payload.values():
+        if isinstance(v, dict):
+            sub = _json_total(v)
+            if sub is not None:
+                return sub
+    return None
+
+def _como_float(v) -> Optional[float]:
+    if v is None or isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    txt = re.sub(r"[^\d,.-]", "", str(v))
+    if "," in txt:
+        txt = txt.replace(".", "").replace(",", ".")
+    try:
+        return float(txt)
+    except ValueError:
+        return None
+
+def _registro_de_json(item: dict) -> dict:
+    """Converte um item do backend no mesmo formato de registro da grade (valores tipados)."""
+    reg = {c: _json_get(item, _JSON_CHAVES[c]) for c in _GRADE_CAMPOS}
+    cid = _json_get(item, _JSON_CHAVES["cliente_id"])
+    nome = "" if reg["cliente"] is None else str(reg["cliente"]).strip()
+    reg["cliente"] = f"{cid} - {nome}" if cid is not None and str(cid) not in nome else nome
+    reg["valor"] = _como_float(reg["valor"])
+    reg["valor_emissao"] = _como_float(reg["valor_emissao"])
+    cad = reg["cadastro"]
+    if isinstance(cad, bool):
+        reg["cadastro"] = "Válido" if cad else "Inválido"
+    for c in ("cpf", "descricao", "recebimento", "lancamento", "vencimento", "cadastro", "detalhes"):
+        reg[c] = "" if reg[c] is None else str(reg[c])
+    return reg
+
+class CapturaGrade:
+    """
+    Escuta page.on("response") e guarda os payloads JSON por trás da grade de NFS
+    (lista + paginador) e do status de cadastro dos clientes. A coleta usa esses
+    dados quando houver; o DOM fica como alternativa quando nenhuma resposta casar.
+    """
+    def __init__(self, page) -> None:
+        self.page = page
+        self.seq = 0
+        self.grade: List[Tuple[int, object]] = []
+        self.status_clientes: dict[str, str] = {}
+        self._tarefas: set = set()
+        page.on("response", self._on_response)
+
+    def desligar(self) -> None:
+        try:
+            self.page.remove_listener("response", self._on_response)
+        except Exception:
+            pass
+
+    def _on_response(self, response) -> None:
+        url = response.url
+        if GRID_API_REGEX.search(url):
+            tipo = "grade"
+        elif CLIENTE_STATUS_API_REGEX.search(url):
+            tipo = "status"
+        else:
+            return
+        if "json" not in (response.headers.get("content-type") or "").lower():
+            return
+        tarefa = asyncio.ensure_future(self._ler(response, tipo))
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _ler(self, response, tipo: str) -> None:
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        self.seq += 1
+        if tipo == "grade":
+            if _json_itens(payload) is not None:
+                self.grade.append((self.seq, payload))
+                _contar("captura_respostas")
+            return
+        for item in (_json_itens(payload) or ([payload] if isinstance(payload, dict) else [])):
+            cid = _json_get(item, _JSON_CHAVES["cliente_id"])
+            status = _json_get(item, _JSON_CHAVES["cadastro"])
+            if cid is not None and status is not None:
+                if isinstance(status, bool):
+                    status = "Válido" if status else "Inválido"
+                self.status_clientes[str(cid)] = str(status)
+
+    async def _drenar(self) -> None:
+        if self._tarefas:
+            await asyncio.gather(*list(self._tarefas), return_exceptions=True)
+
+    def marcador(self) -> int:
+        return self.seq
+
+    async def registros(self, desde: int = 0) -> Optional[List[dict]]:
+        """Registros da resposta de grade mais recente após `desde`, ou None se não houve."""
+        await self._drenar()
+        for seq, payload in reversed(self.grade):
+            if seq <= desde:
+                break
+            return [self._com_status(i) for i in (_json_itens(payload) or [])]
+        return None
+
+    def _com_status(self, item) -> dict:
+        """Registro do item; sem status na grade, usa o da chamada de status do cliente."""
+        r = _registro_de_json(item)
+        if not r["cadastro"]:
+            cid = _json_get(item, _JSON_CHAVES["cliente_id"])
+            if cid is None:
+                m = re.search(r"\b(\d{4,})\b", r["cliente"])
+                cid = m.group(1) if m else None
+            if cid is not None and str(cid) in self.status_clientes:
+                r["cadastro"] = self.status_clientes[str(cid)]
+        return r
+
+    async def invalidos(self) -> Optional[tuple[list[dict], int]]:
+        """
+        Inválidos a partir da última resposta de grade, só se ela trouxer a lista
+        inteira (total do paginador <= itens recebidos) e o status de todos os
+        clientes for conhecido; senão None (a validação lê o DOM).
+        Retorna (inválidos, qtd_clientes).
+        """
+        await self._drenar()
+        if not self.grade:
+            return None
+        payload = self.grade[-1][1]
+        itens = _json_itens(payload) or []
+        total = _json_total(payload)
+        if total is not None and total > len(itens):
+            return None
+        invalidos: list[dict] = []
+        vistos: set[str] = set()
+        for item in itens:
+            r = self._com_status(item)
+            if not r["cliente"] or r["cliente"] in vistos:
+                continue
+            vistos.add(r["cliente"])
+            status = r["cadastro"]
+            if not status:
+                # status vem de outra chamada; sem ele não dá para julgar pela rede
+                return None
+            if not _is_valido(status):
+                invalidos.append({
+                    "cliente": r["cliente"],
+                    "status": status,
+                    "motivo": r["detalhes"] or "(sem detalhes)",
+                })
+        return invalidos, len(vistos)
+
+def _registro_de_textos(textos: List[str]) -> dict:
+    return {c: (textos[i + 1] if len(textos) > i + 1 else "") for i, c in enumerate(_GRADE_CAMPOS)}
+
+async def _extrair_pagina_grade(page, captura: Optional[CapturaGrade] = None, desde: int = 0) -> List[dict]:
+    """
+    Extrai a página visível da grade. Preferência: respostas JSON capturadas
+    (conferindo a quantidade de linhas renderizadas); depois 1 evaluate; por
+    último, célula a célula.
+    """
+    if captura is not None:
+        regs = await captura.registros(desde)
+        if regs is not None:
+            try:
+                renderizadas = await page.locator("mat-table mat-row, table tbody tr").count()
+            except Exception:
+                renderizadas = -1
+            if renderizadas == len(regs):
+                _contar("grade_rede")
+                log(f"Total de linhas detectadas nesta página: {len(regs)} (extração: resposta do backend)")
+                return regs
+            log(f"Captura de rede com {len(regs)} itens, grade com {renderizadas} linhas; lendo o DOM.")
+    try:
+        registros = await page.evaluate(_GRADE_EXTRAIR_JS, _GRADE_CAMPOS)
+        _contar("grade_evaluate")
+        log(f"Total de linhas detectadas nesta página: {len(registros)} (extração: evaluate)")
+        return registros
+    except Exception as e:
+        log(f"Extração em lote da grade falhou ({e}); usando leitura célula a célula.")
+    _contar("grade_celula")
+    return await _extrair_pagina_grade_por_celula(page)
+
+async def _extrair_pagina_grade_por_celula(page) -> List[dict]:
+    linhas = page.locator("mat-table mat-row, table tbody tr")
+    total = await linhas.count()
+    log(f"Total de linhas detectadas nesta página: {total} (extração: célula a célula)")
+
+    registros = []
+    for i in range(total):
+        linha = linhas.nth(i)
+        celulas = linha.locator("mat-cell, td")
+        qtd_celulas = await celulas.count()
+        if qtd_celulas == 0:
+            continue
+
+        textos = []
+        for j in range(qtd_celulas):
+            try:
+                raw = (await celulas.nth(j).inner_text()).strip()
+                clean = ' '.join(raw.split())
+                textos.append(clean)
+            except Exception:
+                textos.append("")
+
+        registros.append(_registro_de_textos(textos))
+    return registros
+
+async def coletar_registros_tabela(page, limite_por_pagina: int = 100,
+                                   captura: Optional[CapturaGrade] = None):
     """
     Coleta todos os registros de todas as páginas da tabela.
     Se encontrar cadastros inválidos (ex: CPF Inválido),
@@ -1144,46 +2441,14 @@ async def coletar_registros_tabela(page, limite_por_pagina: int = 100):
     try:
         todos_registros = []
         pagina = 1
+        desde_captura = 0
 
         while True:
             log(f"📄 Coletando página {pagina}…")
             await page.evaluate("window.scrollTo(0, 0)")
-            await asyncio.sleep(1)
-
-            linhas = page.locator("mat-table mat-row, table tbody tr")
-            total = await linhas.count()
-            log(f"Total de linhas detectadas nesta página: {total}")
-
-            registros = []
-            for i in range(total):
-                linha = linhas.nth(i)
-                celulas = linha.locator("mat-cell, td")
-                qtd_celulas = await celulas.count()
-                if qtd_celulas == 0:
-                    continue
+            await wait_settled(page, fast=True)
 
-                textos = []
-                for j in range(qtd_celulas):
-                    try:
-                        raw = (await celulas.nth(j).inner_text()).strip()
-                        clean = ' '.join(raw.split())
-                        textos.append(clean)
-                    except Exception:
-                        textos.append("")
-
-                registro = {
-                    "cliente": textos[1] if len(textos) > 1 else "",
-                    "cpf": textos[2] if len(textos) > 2 else "",
-                    "descricao": textos[3] if len(textos) > 3 else "",
-                    "recebimento": textos[4] if len(textos) > 4 else "",
-                    "lancamento": textos[5] if len(textos) > 5 else "",
-                    "vencimento": textos[6] if len(textos) > 6 else "",
-                    "valor": textos[7] if len(textos) > 7 else "",
-                    "valor_emissao": textos[8] if len(textos) > 8 else "",
-                    "cadastro": textos[9] if len(textos) > 9 else "",
-                    "detalhes": textos[10] if len(textos) > 10 else "",
-                }
-                registros.append(registro)
+            registros = await _extrair_pagina_grade(page, captura, desde_captura)
 
             todos_registros.extend(registros)
             log(f"✅ Página {pagina}: {len(registros)} registros coletados (total: {len(todos_registros)})")
@@ -1196,27 +2461,27 @@ async def coletar_registros_tabela(page, limite_por_pagina: int = 100):
             ]
 
             if invalidos:
-                print("\n🚨 === CADASTROS INVÁLIDOS DETECTADOS === 🚨\n")
-                print(json.dumps(invalidos, ensure_ascii=False, indent=2))
-                print(f"\nTotal de inválidos nesta página: {len(invalidos)}\n")
+                log(f"🚨 {len(invalidos)} cadastro(s) inválido(s) na página {pagina}: "
+                    f"{json.dumps(invalidos, ensure_ascii=False)}", "WARNING")
 
-                # 👉 Processa todos os inválidos sequencialmente
+                # 👉 Processa todos os inválidos no pool de abas de correção
+                ids = []
                 for idx, cliente in enumerate(invalidos, 1):
                     match = re.search(r"\b(\d{4,})\b", cliente.get("cliente", ""))
                     if not match:
-                        log(f"⚠️ ({idx}/{len(invalidos)}) Não foi possível extrair ID de cliente: {cliente.get('cliente')}")
+                        log(f"⚠️ ({idx}/{len(invalidos)}) Não foi possível extrair ID de cliente: {cliente.get('cliente')}", "WARNING")
                         continue
+                    ids.append(match.group(1))
 
-                    cliente_id = match.group(1)
-                    log(f"[{idx}/{len(invalidos)}] Abrindo perfil do cliente inválido: {cliente_id}")
-                    await abrir_perfil_cliente_invalido(page, cliente_id)
-                    await asyncio.sleep(0.8)
-
-                log(f"✅ Todos os {len(invalidos)} clientes inválidos foram tratados. Recarregando a tela e aplicando filtros novamente…")
+                resultados = await tratar_clientes_invalidos(page, ids)
+                decisoes: dict[str, int] = {}
+                for r in resultados:
+                    decisoes[r["decisao"]] = decisoes.get(r["decisao"], 0) + 1
+                log(f"✅ {len(resultados)} cliente(s) inválido(s) tratados {decisoes}. Recarregando a tela e aplicando filtros novamente…")
 
                 # 🔁 Atualiza e refaz os filtros
                 await page.reload(wait_until="domcontentloaded")
-                await wait_loading_quiet(page, fast=True)
+                await wait_settled(page, fast=True)
                 await aplicar_data_ontem(page)
                 await exibir_por_data_lancamento(page)
                 await aplicar_filtro_tributacao(page)
@@ -1239,16 +2504,17 @@ async def coletar_registros_tabela(page, limite_por_pagina: int = 100):
                 log("🚫 Botão 'Próximo' desabilitado — última página alcançada.")
                 break
 
+            if captura is not None:
+                desde_captura = captura.marcador()
             await btn_proximo.click()
-            await wait_loading_quiet(page, fast=True)
+            await wait_settled(page, fast=True)
             pagina += 1
-            await asyncio.sleep(1.2)
 
-        print("\n✅ Nenhum cadastro inválido encontrado!\n")
+        log("✅ Nenhum cadastro inválido encontrado!")
         return todos_registros
 
     except Exception as e:
-        log(f"Erro ao coletar registros da tabela: {e}")
+        log(f"Erro ao coletar registros da tabela: {e}", "ERROR")
         return []
 
 
@@ -1256,57 +2522,414 @@ async def coletar_registros_tabela(page, limite_por_pagina: int = 100):
 
 
 
+# === Unidades em paralelo no mesmo contexto logado ===
+class RodadaCancelada(RuntimeError):
+    """A rodada foi cancelada pelo agendador (checado antes de cada tenant/unidade)."""
+
+# Hook do agendador: callable sem argumentos que devolve True quando o job foi cancelado
+_DEVE_CANCELAR: contextvars.ContextVar = contextvars.ContextVar("rpa_deve_cancelar", default=None)
+
+def _checar_cancelamento() -> None:
+    fn = _DEVE_CANCELAR.get()
+    if fn is not None and fn():
+        raise RodadaCancelada("Rodada cancelada")
+
+class UnidadeVazouErro(RuntimeError):
+    """A unidade escolhida em outra aba sobrescreveu a unidade desta aba."""
+
+def _unidade_na_url(url: str) -> Optional[str]:
+    m = re.search(r"/app/[^/]+/(-?\d+)/", url or "")
+    return m.group(1) if m else None
+
+# Rótulo da unidade selecionada no cabeçalho (bloco do usuário, canto superior direito)
+_ROTULO_UNIDADE_CSS = "div.novo-user-data"
+# Parâmetros de unidade nas chamadas /api/ que a própria aba faz
+_UNIDADE_API_REGEX = re.compile(r"[?&](?:idunidade|idfilial|unidadeid|filialid)=(-?\d+)", re.IGNORECASE)
+
+async def _rotulo_unidade(page) -> str:
+    try:
+        return re.sub(r"\s+", " ", await page.locator(_ROTULO_UNIDADE_CSS).first.inner_text(timeout=FAST_TIMEOUT)).strip()
+    except Exception:
+        return ""
+
+class _GuardaUnidade:
+    """
+    Protege a seleção de unidade quando várias abas dividem o mesmo contexto:
+    - serializa selecionar_unidade_por_nome + navegação até NFS (o portal grava
+      a unidade escolhida no storage da sessão, compartilhado entre as abas);
+    - fixa a unidade de cada aba e confere antes de cada etapa pelo que o app
+      mostra e usa, não só pela URL: id em /app/<tenant>/<id>/, rótulo do
+      cabeçalho e id de unidade das chamadas /api/ da aba. Se mudou, levanta
+      UnidadeVazouErro.
+    """
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self._fixadas: dict[int, dict] = {}
+        self._api: dict[int, str] = {}
+
+    def _ouvir_api(self, page) -> None:
+        chave = id(page)
+
+        def _on_request(request) -> None:
+            if "/api/" not in request.url:
+                return
+            m = _UNIDADE_API_REGEX.search(request.url)
+            if m and chave in self._fixadas:
+                self._api[chave] = m.group(1)
+
+        page.on("request", _on_request)
+
+    async def fixar(self, page, nome_log: str, regex: Pattern, search_terms: List[str]) -> None:
+        unidade = _unidade_na_url(page.url)
+        if unidade is None or unidade == "-2":
+            raise UnidadeVazouErro(f"Unidade '{nome_log}' não aparece na URL ({page.url}); sessão não compartilhável.")
+        rotulo = await _rotulo_unidade(page)
+        needles = [_strip_accents_lower(t) for t in search_terms or []]
+        if rotulo and not (regex.search(rotulo) or _matches_any(rotulo, needles)):
+            raise UnidadeVazouErro(f"Cabeçalho mostra '{rotulo}', não a unidade '{nome_log}'.")
+        if not rotulo:
+            log(f"Rótulo da unidade não encontrado no cabeçalho ({nome_log}); conferindo por URL e API.", "WARNING")
+        if id(page) not in self._fixadas:
+            self._ouvir_api(page)
+        self._fixadas[id(page)] = {"id": unidade, "rotulo": rotulo}
+        self._api.pop(id(page), None)
+
+    def soltar(self, page) -> None:
+        self._fixadas.pop(id(page), None)
+        self._api.pop(id(page), None)
+
+    async def conferir(self, page) -> None:
+        fixada = self._fixadas.get(id(page))
+        if fixada is None:
+            return
+        atual = _unidade_na_url(page.url)
+        if atual != fixada["id"]:
+            raise UnidadeVazouErro(f"Unidade da aba mudou de {fixada['id']} para {atual}.")
+        api = self._api.get(id(page))
+        if api is not None and api != fixada["id"]:
+            raise UnidadeVazouErro(f"A aba consultou a API com a unidade {api}; esperado {fixada['id']}.")
+        if fixada["rotulo"]:
+            rotulo = await _rotulo_unidade(page)
+            if rotulo != fixada["rotulo"]:
+                raise UnidadeVazouErro(f"Cabeçalho mudou de '{fixada['rotulo']}' para '{rotulo or '?'}'.")
+
+async def _conferir_unidade(guarda: Optional[_GuardaUnidade], page) -> None:
+    if guarda is not None:
+        await guarda.conferir(page)
+
+# === Checkpoints (retomada de execuções)
+# Etapas cujo efeito fica no portal, não na aba (cadastros corrigidos, notas enviadas):
+# numa retomada não são refeitas. As demais (unidade, menu, filtros) só montam a tela
+# e são sempre refeitas numa aba nova.
+ETAPAS_PERSISTENTES = ("validar", "enviar")
+
+class _Execucao:
+    """Execução corrente: run_id e, se for retomada, os checkpoints da tentativa anterior."""
+
+    def __init__(self, run_id: str, retomada: bool = False) -> None:
+        self.run_id = run_id
+        self.anteriores = checkpoints.carregar(run_id) if retomada else {}
+
+    def anterior(self, tenant: str, unidade: str, etapa: str) -> Optional[dict]:
+        cp = self.anteriores.get((tenant, unidade, etapa))
+        return cp if cp and cp.get("status") == "ok" else None
+
+    def registrar(self, tenant: str, unidade: str, etapa: str, status: str, data=None, erro=None) -> None:
+        """Enfileira no gravador em lote (o banco é tocado fora do event loop)."""
+        _GRAVADOR.enfileirar(("checkpoint", {
+            "run_id": self.run_id, "tenant": tenant, "unidade": unidade, "etapa": etapa,
+            "status": status, "data": data, "erro": erro,
+        }))
+
+_EXECUCAO: contextvars.ContextVar[Optional[_Execucao]] = contextvars.ContextVar("rpa_execucao", default=None)
+
+def _unidade_concluida(nome_log: str) -> bool:
+    ex = _EXECUCAO.get()
+    if ex is not None and ex.anterior(_LOG_TAG.get(), nome_log, checkpoints.UNIDADE_CONCLUIDA):
+        log(f"Retomada: unidade {nome_log} já concluída nesta execução; pulando.")
+        return True
+    return False
+
+def _marcar_unidade_concluida(nome_log: str) -> None:
+    ex = _EXECUCAO.get()
+    if ex is not None:
+        ex.registrar(_LOG_TAG.get(), nome_log, checkpoints.UNIDADE_CONCLUIDA, "ok")
+    evento("unidade", f"Unidade {nome_log} concluída.")
+
+async def _etapa(nome_log: str, etapa: str, fn, *args, **kwargs):
+    """Roda uma etapa da unidade gravando o checkpoint (ok/falha); pula etapas persistentes já feitas."""
+    ex = _EXECUCAO.get()
+    tenant = _LOG_TAG.get()
+    if ex is not None and etapa in ETAPAS_PERSISTENTES:
+        anterior = ex.anterior(tenant, nome_log, etapa)
+        if anterior is not None:
+            log(f"Retomada: etapa '{etapa}' de {nome_log} já concluída; pulando.")
+            return anterior.get("data")
+    evento("etapa_inicio", f"{nome_log}: etapa '{etapa}' iniciada.")
+    try:
+        async with span(etapa, nome_log):
+            resultado = await fn(*args, **kwargs)
+    except Exception as e:
+        if ex is not None:
+            ex.registrar(tenant, nome_log, etapa, "falha", erro=repr(e))
+        if not isinstance(e, RodadaCancelada):
+            evento("erro", f"{nome_log}: etapa '{etapa}' falhou: {e!r}", "ERROR")
+        raise
+    if ex is not None:
+        ex.registrar(tenant, nome_log, etapa, "ok", data=resultado if etapa in ETAPAS_PERSISTENTES else None)
+    evento("etapa_fim", f"{nome_log}: etapa '{etapa}' concluída.")
+    return resultado
+
 # === Pipeline por unidade
-async def processar_unidade(page, nome_log: str, search_terms: List[str], regex: Pattern) -> None:
-    log(f"---- Iniciando unidade: {nome_log} ----")
-    await selecionar_unidade_por_nome(page, search_terms, regex)
-    await abrir_menu_financeiro_e_ir_para_nfs(page)
-    await aplicar_data_ontem(page)
-    await exibir_por_data_lancamento(page)
-    await aplicar_filtro_tributacao(page)
-    await definir_itens_por_pagina(page, 100)
-    await coletar_registros_tabela(page)
+async def processar_unidade(page, nome_log: str, search_terms: List[str], regex: Pattern,
+                            guarda: Optional[_GuardaUnidade] = None) -> None:
+    _checar_cancelamento()
+    if _unidade_concluida(nome_log):
+        return
+    async with _trace_unidade(page, nome_log), span("unidade", nome_log):
+        await _processar_unidade_etapas(page, nome_log, search_terms, regex, guarda)
+    _marcar_unidade_concluida(nome_log)
 
+async def _processar_unidade_etapas(page, nome_log: str, search_terms: List[str], regex: Pattern,
+                                    guarda: Optional[_GuardaUnidade]) -> None:
+    log(f"---- Iniciando unidade: {nome_log} ----")
+    if guarda is None:
+        await _etapa(nome_log, "selecionar_unidade", selecionar_unidade_por_nome, page, search_terms, regex)
+        await _etapa(nome_log, "menu_nfs", abrir_menu_financeiro_e_ir_para_nfs, page)
+    else:
+        async with guarda.lock:
+            await _etapa(nome_log, "selecionar_unidade", selecionar_unidade_por_nome, page, search_terms, regex)
+            await _etapa(nome_log, "menu_nfs", abrir_menu_financeiro_e_ir_para_nfs, page)
+            await guarda.fixar(page, nome_log, regex, search_terms)
+    captura = CapturaGrade(page)
+    try:
+        await _processar_unidade_nfs(page, nome_log, guarda, captura)
+    finally:
+        captura.desligar()
+
+async def _processar_unidade_nfs(page, nome_log: str, guarda: Optional[_GuardaUnidade],
+                                 captura: CapturaGrade) -> None:
+    await _etapa(nome_log, "filtro_data", aplicar_data_ontem, page)
+    await _conferir_unidade(guarda, page)
+    await _etapa(nome_log, "exibir_por", exibir_por_data_lancamento, page)
+    await _conferir_unidade(guarda, page)
+    await _etapa(nome_log, "tributacao", aplicar_filtro_tributacao, page)
+    await _conferir_unidade(guarda, page)
+    await _etapa(nome_log, "itens_por_pagina", definir_itens_por_pagina, page, 100)
+    await _conferir_unidade(guarda, page)
+    await _etapa(nome_log, "coletar", coletar_registros_tabela, page, captura=captura)
+    await _conferir_unidade(guarda, page)
 
-    # >>> Validação estrita (sem paginação). Aborta se houver inválidos.
     # >>> Validação estrita (sem paginação). Se houver inválidos, abre o primeiro.
-    invalidos = await validar_antes_de_enviar(page)
-    tem_invalidos = invalidos and len(invalidos) > 0
-
-    if tem_invalidos:
-        log(f"Unidade {nome_log}: inválidos detectados. Abrindo primeiro cliente inválido para análise...")
-        primeiro = invalidos[0]
-        match = re.search(r"\b(\d{4,})\b", primeiro["cliente"])
-        if match:
-            cliente_id = match.group(1)
-            await abrir_perfil_cliente_invalido(page, cliente_id)
+    async def _validar():
+        invalidos = await validar_antes_de_enviar(page, captura)
+        tem_invalidos = invalidos and len(invalidos) > 0
+
+        if tem_invalidos:
+            log(f"Unidade {nome_log}: inválidos detectados. Abrindo primeiro cliente inválido para análise...")
+            primeiro = invalidos[0]
+            match = re.search(r"\b(\d{4,})\b", primeiro["cliente"])
+            if match:
+                cliente_id = match.group(1)
+                await abrir_perfil_cliente_invalido(page, cliente_id)
+            else:
+                log("⚠️ Não foi possível extrair o número do cliente inválido.", "WARNING")
         else:
-            log("⚠️ Não foi possível extrair o número do cliente inválido.")
-    else:
-        log(f"Unidade {nome_log}: nenhum inválido detectado (todos válidos).")
-
+            log(f"Unidade {nome_log}: nenhum inválido detectado (todos válidos).")
+        return invalidos
 
-      
+    await _etapa(nome_log, "validar", _validar)
 
-    # Fluxo normal, somente se todos válidos
     # Envia cadastros válidos (sempre roda — com ou sem inválidos)
-    if await has_select_all_checkbox(page):
-        log("Checkbox 'Selecionar todos' presente — iniciando envio de notas fiscais")
+    async def _enviar():
+        await _conferir_unidade(guarda, page)
+        if await has_select_all_checkbox(page):
+            log("Checkbox 'Selecionar todos' presente — iniciando envio de notas fiscais")
 
-        await selecionar_todos_e_enviar(page)
-        await selecionar_data_ontem_modal(page)
-        await cancelar_modal_enviar_nf(page)
+            await selecionar_todos_e_enviar(page)
+            await selecionar_data_ontem_modal(page)
+            await cancelar_modal_enviar_nf(page)
 
-        log(f"Unidade {nome_log}: processo de envio finalizado com sucesso.")
-    else:
+            log(f"Unidade {nome_log}: processo de envio finalizado com sucesso.")
+            return {"enviado": True}
         log(f"Unidade {nome_log}: sem checkbox 'Selecionar todos' (sem registros). Pulando para a próxima.")
+        return {"enviado": False}
+
+    await _etapa(nome_log, "enviar", _enviar)
+
+
+# === Motor HTTP (evo_http.py) ===
+_TRIBUTACAO_CHAVES = ("tributacao", "descricaotributacao", "nometributacao", "tipotributacao")
+
+async def _resolver_unidade_http(api, search_terms: List[str], regex: Pattern) -> str:
+    needles = [_strip_accents_lower(t) for t in (search_terms or [])]
+    candidatas = []
+    for u in await api.listar_unidades():
+        nome = str(_json_get(u, ("nome", "descricao", "nomeunidade", "razaosocial")) or "")
+        uid = _json_get(u, ("id", "idunidade", "codigo"))
+        if uid is None or not nome:
+            continue
+        if regex.search(nome):
+            return str(uid)
+        if _matches_any(nome, needles):
+            candidatas.append(str(uid))
+    if candidatas:
+        return candidatas[0]
+    raise RuntimeError("Unidade alvo não encontrada na API de unidades")
+
+async def processar_unidade_http(page, tenant: str, nome_log: str, search_terms: List[str],
+                                 regex: Pattern) -> None:
+    """
+    Mesmo fluxo de processar_unidade, falando direto com a API do EVO:
+    lista NFS do período, descarta tributações "Não usar", confere o status
+    dos clientes e envia. Inválidos ainda são tratados pelo navegador (perfil).
+    """
+    _checar_cancelamento()
+    from evo_http import EvoHttpClient  # dependência opcional (httpx)
+
+    log(f"---- Iniciando unidade (HTTP): {nome_log} ----")
+    storage = await page.context.storage_state()
+    async with EvoHttpClient(storage, tenant) as api:
+        unidade_id = await _resolver_unidade_http(api, search_terms, regex)
+        inicio, fim = _periodo_filtro()
+        itens = await api.listar_nfs(unidade_id, inicio.date(), fim.date())
+        itens = [
+            i for i in itens
+            if not NAO_USAR_ANY.search(str(_json_get(i, _TRIBUTACAO_CHAVES) or ""))
+        ]
+        registros = [_registro_de_json(i) for i in itens]
+        log(f"HTTP: {len(registros)} NFS no período {fmt_date_br(inicio)}–{fmt_date_br(fim)} (unidade {unidade_id})")
+
+        sem_status = []
+        for r in registros:
+            m = re.search(r"\b(\d{4,})\b", r["cliente"])
+            if m and not r["cadastro"]:
+                sem_status.append(m.group(1))
+        if sem_status:
+            for cid, payload in (await api.status_clientes(sem_status)).items():
+                status = _json_get(payload, _JSON_CHAVES["cadastro"]) if isinstance(payload, dict) else payload
+                if isinstance(status, bool):
+                    status = "Válido" if status else "Inválido"
+                for r in registros:
+                    if cid in r["cliente"] and not r["cadastro"]:
+                        r["cadastro"] = str(status or "")
+
+        invalidos = [r for r in registros if r["cadastro"] and not _is_valido(r["cadastro"])]
+        validos = [i for i, r in zip(itens, registros) if not r["cadastro"] or _is_valido(r["cadastro"])]
+        if invalidos:
+            log(f"Unidade {nome_log}: {len(invalidos)} cadastro(s) inválido(s).")
+            primeiro = re.search(r"\b(\d{4,})\b", invalidos[0]["cliente"])
+            if primeiro:
+                await abrir_perfil_cliente_invalido(page, primeiro.group(1))
+
+        nf_ids = [str(v) for v in (_json_get(i, ("id", "idnota", "idnfs", "idnotafiscal")) for i in validos) if v is not None]
+        if not nf_ids:
+            log(f"Unidade {nome_log}: sem notas para enviar.")
+            return
+        if not HTTP_ENVIAR:
+            log(f"Unidade {nome_log}: simulação — {len(nf_ids)} nota(s) seriam enviadas (RPA_HTTP_ENVIAR=0).")
+            return
+        await api.enviar_nfs(unidade_id, nf_ids, previous_business_day().date())
+        log(f"Unidade {nome_log}: {len(nf_ids)} nota(s) enviadas via API.")
+
+async def _processar_unidades_http(page, tenant: str, unidades: List[Tuple[str, List[str], Pattern]]) -> None:
+    sem = asyncio.Semaphore(UNIT_CONCURRENCY)
+
+    async def _uma(nome: str, termos: List[str], rx: Pattern) -> None:
+        async with sem:
+            if _unidade_concluida(nome):
+                return
+            try:
+                async with span("unidade_http", nome):
+                    await processar_unidade_http(page, tenant, nome, termos, rx)
+                _marcar_unidade_concluida(nome)
+            except RodadaCancelada:
+                raise
+            except Exception as e:
+                log(f"Erro no fluxo HTTP ({nome}): {e!r}", "ERROR")
+                await _screenshot_erro(page, tenant, nome)
+
+    await asyncio.gather(*(_uma(n, t, r) for n, t, r in unidades))
+
+async def _processar_unidades(page, tenant: str, unidades: List[Tuple[str, List[str], Pattern]]) -> None:
+    if RPA_ENGINE == "http":
+        await _processar_unidades_http(page, tenant, unidades)
+        return
+    if UNIT_CONCURRENCY <= 1 or len(unidades) <= 1:
+        for nome, termos, rx in unidades:
+            try:
+                await processar_unidade(page, nome, termos, rx)
+            except RodadaCancelada:
+                raise
+            except Exception:
+                await _screenshot_erro(page, tenant, nome)
+                continue
+        return
+    await _processar_unidades_paralelo(page, tenant, unidades)
+
+async def _processar_unidades_paralelo(page, tenant: str, unidades: List[Tuple[str, List[str], Pattern]]) -> None:
+    """
+    Uma aba por unidade (até UNIT_CONCURRENCY simultâneas) no contexto já logado.
+    Se a seleção de unidade vazar entre abas, a unidade afetada (e as seguintes)
+    roda em contexto próprio criado a partir do storage_state da sessão.
+    """
+    context = page.context
+    browser = context.browser
+    guarda = _GuardaUnidade()
+    sem = asyncio.Semaphore(min(UNIT_CONCURRENCY, len(unidades)))
+    estado = {"compartilhar": True, "storage": None}
+    pendentes: List[Tuple[str, List[str], Pattern]] = []
+
+    async def _isolado_storage():
+        if estado["storage"] is None:
+            estado["storage"] = await context.storage_state()
+        return estado["storage"]
+
+    async def _uma(nome: str, termos: List[str], rx: Pattern) -> None:
+        async with sem:
+            compartilhado = estado["compartilhar"]
+            ctx = context if compartilhado else await _novo_contexto_tenant(
+                browser, tenant, storage_state=await _isolado_storage()
+            )
+            aba = await _nova_aba(ctx)
+            try:
+                await aba.goto(_app_home_url(tenant), wait_until="domcontentloaded")
+                await wait_settled(aba, fast=True)
+                await processar_unidade(aba, nome, termos, rx, guarda if compartilhado else None)
+            except UnidadeVazouErro as e:
+                if not compartilhado:
+                    await _screenshot_erro(aba, tenant, nome)
+                    return
+                log(f"{e} — sessão não compartilhável; '{nome}' vai para contexto próprio.")
+                estado["compartilhar"] = False
+                pendentes.append((nome, termos, rx))
+            except RodadaCancelada:
+                raise
+            except Exception:
+                await _screenshot_erro(aba, tenant, nome)
+            finally:
+                guarda.soltar(aba)
+                try:
+                    await aba.close()
+                except Exception:
+                    pass
+                if ctx is not context:
+                    try:
+                        await ctx.close()
+                    except Exception:
+                        pass
 
+    log(f"Processando {len(unidades)} unidades em paralelo (até {UNIT_CONCURRENCY} abas)")
+    await asyncio.gather(*(_uma(n, t, r) for n, t, r in unidades))
+    if pendentes:
+        log(f"Reprocessando {len(pendentes)} unidade(s) em contextos isolados")
+        await asyncio.gather(*(_uma(n, t, r) for n, t, r in pendentes))
 
 # =========================
 # Execução por tenant
 # =========================
 async def run_for_tenant(page, tenant: str, base_login_url: str, user: str, pwd: str) -> None:
-    await do_login(page, tenant, base_login_url, user, pwd)
+    await garantir_login(page, tenant, base_login_url, user, pwd)
 
     if tenant == "bodytech":
         unidades_bt: List[Tuple[str, List[str], Pattern]] = [
@@ -1342,20 +2965,7 @@ async def run_for_tenant(page, tenant: str, base_login_url: str, user: str, pwd:
 
         ## ORDEM DOS SHOPPINGS
 
-        for nome, termos, rx in unidades_bt[2:]:
-            try:
-                await processar_unidade(page, nome, termos, rx)
-            except Exception as e:
-                ts = int(datetime.now().timestamp())
-                nome_sanitizado = re.sub(r'\W+', '_', nome)
-                img = SCREENSHOT_DIR / f"screenshot_erro_{nome_sanitizado}_{ts}.png"
-                try:
-                    await page.screenshot(path=str(img), full_page=True)
-                    log(f"Erro no fluxo ({nome}). Screenshot: {img}")
-                except Exception as se:
-                    log(f"Falha ao salvar screenshot ({nome}): {se}")
-                continue
-
+        await _processar_unidades(page, tenant, unidades_bt[2:])
         return
 
     elif tenant == "formula":
@@ -1367,67 +2977,35 @@ async def run_for_tenant(page, tenant: str, base_login_url: str, user: str, pwd:
              ["moxuara", "shopping moxuara", "moxuará"],
              SHOPPING_MOXUARA_REGEX),
         ]
-        for nome, termos, rx in unidades_formula:
-            try:
-                await processar_unidade(page, nome, termos, rx)
-            except Exception as e:
-                ts = int(datetime.now().timestamp())
-                tag = re.sub(r'\\W+', '_', nome)
-                img = SCREENSHOT_DIR / f"screenshot_erro_{tag}_{ts}.png"
-                try:
-                    await page.screenshot(path=str(img), full_page=True)
-                    log(f"Erro no fluxo ({nome}). Screenshot: {img}")
-                except Exception as se:
-                    log(f"Falha ao salvar screenshot ({nome}): {se}")
-                continue
+        await _processar_unidades(page, tenant, unidades_formula)
         return
 
     else:
-        log(f"Tenant '{tenant}' sem sequência definida. Nada a executar.")
+        log(f"Tenant '{tenant}' sem sequência definida. Nada a executar.", "WARNING")
         return
 
 async def definir_itens_por_pagina(page, qtd: int = 100) -> None:
     try:
         log(f"Ajustando 'Itens por página' para {qtd}")
         paginator = page.locator("mat-paginator").first
-        await paginator.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        await aguardar(paginator, "paginacao", DEFAULT_TIMEOUT)
 
         seletor = paginator.locator("mat-select").first
         await seletor.click()
 
         opcao = page.get_by_role("option", name=re.compile(fr"^\s*{qtd}\s*$")).first
-        await opcao.wait_for(state="visible", timeout=DEFAULT_TIMEOUT)
+        await aguardar(opcao, "paginacao_opcao_itens", DEFAULT_TIMEOUT)
         await opcao.click()
 
-        await wait_loading_quiet(page, fast=True)
+        await wait_settled(page, fast=True)
         log(f"Itens por página ajustado para {qtd}")
     except Exception as e:
-        log(f"Falha ao ajustar itens por página: {e}")
+        log(f"Falha ao ajustar itens por página: {e}", "WARNING")
 
 # =========================
-# Runner principal (contexto novo por tenant + pausa/fechar após bodytech)
+# Runner principal (um browser.new_context() por tenant; sequencial ou concorrente)
 # =========================
-async def _run() -> None:
-    user, pwd = ensure_env()
-    urls = _env_urls_in_order()
-    if not urls:
-        raise RuntimeError("Nenhuma EVO_URL encontrada no ambiente.")
-
-    log(f"HEADLESS={'1' if HEADLESS else '0'} | DEBUG_LOGIN={'1' if DEBUG_LOGIN else '0'}")
-    log("Ordem de execução:")
-    for i, u in enumerate(urls, 1):
-        log(f"  {i}. {u}")
-
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=HEADLESS, args=["--start-maximized"])
-        try:
-            for idx, url in enumerate(urls, 1):
-                tenant = _extract_tenant_from_url(url)
-                log(f"=== ({idx}/{len(urls)}) Tenant '{tenant}' ===")
-                context = await browser.new_context(no_viewport=True)
-                tenant_js = tenant
-                await context.add_init_script(
-                    """
+_TENANT_INIT_SCRIPT = """
 ((tenant) => {
   try {
     localStorage.setItem('tenant', tenant);
@@ -1463,46 +3041,374 @@ async def _run() -> None:
     window.addEventListener('hashchange', forceTenant, true);
   } catch (_err) {}
 })(__TENANT__);
-""".replace("__TENANT__", json.dumps(tenant_js))
-                )
-                page = await context.new_page()
-                await page.set_viewport_size({"width": 1920, "height": 1080})
-                try:
+"""
+
+async def _novo_contexto_tenant(browser, tenant: str, storage_state=None):
+    if LEAN_PROFILE:
+        context = await browser.new_context(
+            viewport={"width": 1366, "height": 768},
+            reduced_motion="reduce",
+            storage_state=storage_state,
+        )
+        await _aplicar_perfil_lean(context)
+    else:
+        context = await browser.new_context(no_viewport=True, storage_state=storage_state)
+    _vincular_metricas(context, _METRICAS.get())
+    _contabilizar_respostas(context)
+    await _iniciar_tracing(context)
+    await context.add_init_script(_TENANT_INIT_SCRIPT.replace("__TENANT__", json.dumps(tenant)))
+    await context.add_init_script("(" + _SETTLE_INSTALL_JS + ")();")
+    if CAPTURE_DIR:
+        _gravar_respostas_api(context, Path(CAPTURE_DIR) / tenant)
+    return context
+
+def _gravar_respostas_api(context, pasta: Path) -> None:
+    """Grava cada resposta JSON de /api/ como {method, path, status, body} (uma por rota + query)."""
+    pasta.mkdir(parents=True, exist_ok=True)
+    tarefas: set = set()
+
+    async def _gravar(response) -> None:
+        try:
+            body = await response.json()
+        except Exception:
+            return
+        req = response.request
+        path = re.sub(r"^https?://[^/]+", "", response.url)
+        rota, _, query = path.partition("?")
+        nome = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{req.method}_{rota}").strip("_")[:150]
+        if query:
+            # uma gravação por rota + query (ex.: cada página da listagem)
+            nome += "_" + hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+        try:
+            with open(pasta / f"{nome}.json", "w", encoding="utf-8") as f:
+                json.dump({"method": req.method, "path": path, "status": response.status, "body": body},
+                          f, ensure_ascii=False)
+        except OSError:
+            pass
+
+    def _on_response(response) -> None:
+        if "/api/" in response.url and "json" in (response.headers.get("content-type") or "").lower():
+            tarefa = asyncio.ensure_future(_gravar(response))
+            tarefas.add(tarefa)
+            tarefa.add_done_callback(tarefas.discard)
+
+    context.on("response", _on_response)
+
+async def _nova_aba(context):
+    page = await context.new_page()
+    if not LEAN_PROFILE:
+        await page.set_viewport_size({"width": 1920, "height": 1080})
+    _medir_cargas(page, context)
+    return page
+
+# === Perfil lean ===
+_LEAN_TIPOS = {t.strip() for t in os.getenv("RPA_LEAN_BLOQUEAR_TIPOS", "image,media,font").split(",") if t.strip()}
+_LEAN_PADROES = re.compile(os.getenv(
+    "RPA_LEAN_BLOQUEAR_URLS",
+    r"google-analytics|googletagmanager|doubleclick|facebook\.(net|com)/tr|hotjar|clarity\.ms|"
+    r"intercom|zendesk|zdassets|tawk\.to|jivosite|crisp\.chat|hubspot|hs-scripts|onesignal|"
+    r"mixpanel|segment\.(io|com)|fullstory|smartlook|newrelic|nr-data\.net",
+), re.IGNORECASE)
+# Tipos bloqueados viram padrões de URL (extensão): só essas URLs passam pelo Python
+# (context.route); o resto segue direto no navegador, com cache HTTP normal
+_LEAN_EXTENSOES = {
+    "image": r"png|jpe?g|gif|webp|avif|svg|ico|bmp",
+    "media": r"mp4|webm|ogg|mp3|wav|m4a",
+    "font": r"woff2?|ttf|otf|eot",
+}
+_LEAN_URLS_TIPOS = re.compile(
+    r"\.(?:" + "|".join(_LEAN_EXTENSOES[t] for t in sorted(_LEAN_TIPOS) if t in _LEAN_EXTENSOES) + r")(?:[?#]|$)",
+    re.IGNORECASE,
+) if _LEAN_TIPOS & set(_LEAN_EXTENSOES) else None
+# Allowlist: o que o app Angular precisa mesmo sendo imagem/fonte (ex.: ícones Material)
+_LEAN_PERMITIR = re.compile(os.getenv(
+    "RPA_LEAN_PERMITIR", r"material-icons|materialicons|fonts\.googleapis\.com/icon"
+), re.IGNORECASE)
+_LEAN_ARGS = [
+    "--disable-extensions", "--disable-background-networking", "--disable-component-update",
+    "--disable-default-apps", "--disable-sync", "--no-first-run", "--mute-audio",
+    "--disable-dev-shm-usage", "--disable-features=Translate,MediaRouter,OptimizationHints",
+    "--blink-settings=imagesEnabled=false",
+]
+# Tamanho aprendido (runs normais) de cada URL que o perfil lean bloquearia
+_LEAN_TAMANHOS_PATH = CACHE_DIR / "lean_tamanhos.json"
+_LEAN_TAMANHOS: Optional[dict] = None
+
+def _lean_tamanhos() -> dict:
+    global _LEAN_TAMANHOS
+    if _LEAN_TAMANHOS is None:
+        try:
+            with open(_LEAN_TAMANHOS_PATH, "r", encoding="utf-8") as f:
+                _LEAN_TAMANHOS = json.load(f) or {}
+        except (OSError, ValueError):
+            _LEAN_TAMANHOS = {}
+    return _LEAN_TAMANHOS
+
+def _salvar_lean_tamanhos() -> None:
+    if not _LEAN_TAMANHOS:
+        return
+    try:
+        _LEAN_TAMANHOS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(_LEAN_TAMANHOS_PATH, "w", encoding="utf-8") as f:
+            json.dump(_LEAN_TAMANHOS, f)
+    except OSError:
+        pass
+
+def _lean_bloqueia(url: str) -> bool:
+    if url.startswith("data:") or _LEAN_PERMITIR.search(url):
+        return False
+    return bool(_LEAN_PADROES.search(url) or (_LEAN_URLS_TIPOS and _LEAN_URLS_TIPOS.search(url)))
+
+async def _aplicar_perfil_lean(context) -> None:
+    contar = _contador(context)
+    async def _rota(route) -> None:
+        url = route.request.url
+        if _lean_bloqueia(url):
+            contar("req_bloqueadas")
+            contar("bytes_bloqueados", _lean_tamanhos().get(url.split("?")[0], 0))
+            await route.abort("blockedbyclient")
+        else:
+            await route.fallback()
+    # só as URLs candidatas a bloqueio são interceptadas
+    await context.route(_LEAN_PADROES, _rota)
+    if _LEAN_URLS_TIPOS is not None:
+        await context.route(_LEAN_URLS_TIPOS, _rota)
+    context.on("request", lambda _req: contar("req_total"))
+
+def _contabilizar_respostas(context) -> None:
+    """Bytes recebidos (Content-Length); em runs normais, aprende o tamanho do que o lean bloquearia."""
+    contar = _contador(context)
+    def _on_response(response) -> None:
+        try:
+            tamanho = int(response.headers.get("content-length") or 0)
+        except ValueError:
+            tamanho = 0
+        contar("bytes_recebidos", tamanho)
+        if not LEAN_PROFILE:
+            contar("req_total")
+            if tamanho and _lean_bloqueia(response.url):
+                _lean_tamanhos()[response.url.split("?")[0]] = tamanho
+    context.on("response", _on_response)
+
+def _medir_cargas(page, context) -> None:
+    """Tempo de carga (navigation timing) de cada load completo da página."""
+    contar = _contador(context)
+    async def _medir() -> None:
+        try:
+            ms = await page.evaluate(
+                "() => { const n = performance.getEntriesByType('navigation')[0];"
+                " return n ? n.loadEventEnd - n.startTime : 0; }"
+            )
+        except Exception:
+            return
+        if ms and ms > 0:
+            contar("cargas")
+            contar("carga_ms", ms)
+    page.on("load", lambda _p: asyncio.ensure_future(_medir()))
+
+async def _executar_tenant(browser, url: str, idx: int, total: int,
+                           creds: tuple[str, str], sem: asyncio.Semaphore,
+                           sequencial: bool, contextos: Optional[dict] = None) -> None:
+    """
+    Roda o fluxo de um tenant. Com `contextos` (worker), reaproveita o contexto
+    autenticado do tenant e fecha só a aba no fim; sem ele, o contexto é descartável.
+    """
+    tenant = _extract_tenant_from_url(url)
+    async with sem:
+        tag_token = _LOG_TAG.set(tenant)
+        metricas_token = _METRICAS.set({})
+        tratados_token = _CLIENTES_TRATADOS.set(set())
+        em_tratamento_token = _CLIENTES_EM_TRATAMENTO.set(set())
+        try:
+            _checar_cancelamento()
+            log(f"=== ({idx}/{total}) Tenant '{tenant}' ===")
+            user, pwd = creds
+            context = contextos.get(tenant) if contextos is not None else None
+            if context is None:
+                context = await _novo_contexto_tenant(browser, tenant, storage_state=carregar_sessao(tenant, user))
+                if contextos is not None:
+                    contextos[tenant] = context
+            _vincular_metricas(context, _METRICAS.get())
+            page = await _nova_aba(context)
+            manter = contextos is not None
+            try:
+                async with span("tenant"):
                     await run_for_tenant(page, tenant, url, user, pwd)
-                    if tenant == "bodytech":
-                        log("Finalizado fluxo do tenant 'bodytech'. Aguardando 5s antes de abrir a próxima URL…")
-                        await asyncio.sleep(5)
-                        try:
-                            await page.close()
-                        except Exception:
-                            pass
-                except Exception:
-                    ts = int(datetime.now().timestamp())
-                    img = SCREENSHOT_DIR / f"screenshot_erro_tenant_{tenant}_{ts}.png"
+                if tenant == "bodytech" and sequencial and not manter:
+                    log("Finalizado fluxo do tenant 'bodytech'. Aguardando 5s antes de abrir a próxima URL…")
+                    await asyncio.sleep(5)
                     try:
-                        await page.screenshot(path=str(img), full_page=True)
-                        log(f"Erro no fluxo (tenant={tenant}). Screenshot: {img}")
-                    except Exception as se:
-                        log(f"Falha ao salvar screenshot (tenant={tenant}): {se}")
-                    raise
-                finally:
-                    try:
-                        await context.close()
+                        await page.close()
                     except Exception:
                         pass
-            log("Pausa final de 5 segundos para inspeção")
-            await asyncio.sleep(5)
+            except Exception:
+                await _screenshot_erro(page, tenant, f"tenant_{tenant}")
+                # contexto possivelmente em estado ruim: o worker recria no próximo heartbeat
+                manter = False
+                if contextos is not None:
+                    contextos.pop(tenant, None)
+                raise
+            finally:
+                # heartbeat e próximas rodadas não contam mais nesta
+                _vincular_metricas(context, None)
+                try:
+                    if manter:
+                        await page.close()
+                    else:
+                        await context.close()
+                except Exception:
+                    pass
+        finally:
+            TIMEOUTS.salvar()
+            resumo = _resumo_metricas()
+            if resumo:
+                log(resumo)
+            _METRICAS.reset(metricas_token)
+            _CLIENTES_TRATADOS.reset(tratados_token)
+            _CLIENTES_EM_TRATAMENTO.reset(em_tratamento_token)
+            _LOG_TAG.reset(tag_token)
+
+async def lancar_navegador(p):
+    args = _LEAN_ARGS if LEAN_PROFILE else ["--start-maximized"]
+    return await p.chromium.launch(headless=HEADLESS, args=args)
+
+async def manter_sessao_tenant(browser, url: str, contextos: dict) -> None:
+    """
+    Heartbeat do worker: garante em `contextos` um contexto autenticado do tenant.
+    Sonda a sessão numa aba descartável; se expirou, refaz o login e regrava o cache.
+    """
+    tenant = _extract_tenant_from_url(url)
+    tag_token = _LOG_TAG.set(tenant)
+    try:
+        user, pwd = credenciais_tenant(tenant)
+        context = contextos.get(tenant)
+        if context is None:
+            context = await _novo_contexto_tenant(browser, tenant, storage_state=carregar_sessao(tenant, user))
+            contextos[tenant] = context
+        page = await _nova_aba(context)
+        try:
+            if await sessao_valida(page, tenant):
+                await salvar_sessao(context, tenant, user, expires_at=_sessao_expires_at(tenant))
+            else:
+                log("Heartbeat: sessão expirada; refazendo login.")
+                await garantir_login(page, tenant, url, user, pwd)
+        except Exception:
+            contextos.pop(tenant, None)
+            try:
+                await context.close()
+            except Exception:
+                pass
+            raise
         finally:
             try:
-                await browser.close()
+                await page.close()
             except Exception:
                 pass
+    finally:
+        TIMEOUTS.salvar()
+        _LOG_TAG.reset(tag_token)
+
+async def _run(browser=None, contextos: Optional[dict] = None, deve_cancelar=None,
+               run_id: Optional[str] = None, retomar: bool = False) -> None:
+    """
+    Uma rodada completa. Sem `browser`, lança e fecha o Chromium (execução avulsa);
+    com `browser`/`contextos` (worker), reaproveita navegador e sessões e não pausa no fim.
+    `deve_cancelar` (agendador) é consultado antes de cada tenant e de cada unidade.
+    Checkpoints vão para `run_id`; com `retomar`, unidades concluídas e etapas
+    persistentes já feitas nesse run_id são puladas.
+    """
+    _DEVE_CANCELAR.set(deve_cancelar)
+    execucao = _Execucao(run_id or str(uuid.uuid4()), retomada=retomar and bool(run_id))
+    _EXECUCAO.set(execucao)
+    evento("run_inicio", f"Execução {execucao.run_id}" + (" (retomada)" if execucao.anteriores else ""))
+    try:
+        await _executar_rodada(browser, contextos)
+    except RodadaCancelada:
+        evento("run_fim", "Execução cancelada.", "WARNING")
+        raise
+    except Exception as e:
+        evento("run_fim", f"Execução terminou com erro: {e!r}", "ERROR")
+        raise
+    else:
+        evento("run_fim", "Execução concluída.")
+    finally:
+        # checkpoints precisam estar no banco antes de o job terminar (retomada)
+        await descarregar_gravacoes()
+        _exportar_last_report(execucao.run_id)
+
+async def _executar_rodada(browser, contextos: Optional[dict]) -> None:
+    urls = _env_urls_in_order()
+    if not urls:
+        raise RuntimeError("Nenhuma EVO_URL encontrada no ambiente.")
+    # valida credenciais de todos os tenants antes de abrir o navegador
+    creds = {url: credenciais_tenant(_extract_tenant_from_url(url)) for url in urls}
+
+    limite = min(TENANT_CONCURRENCY, len(urls))
+    sequencial = limite <= 1
+
+    log(f"HEADLESS={'1' if HEADLESS else '0'} | DEBUG_LOGIN={'1' if DEBUG_LOGIN else '0'} | TENANTS_SIMULTANEOS={limite}")
+    log("Ordem de execução:" if sequencial else "Tenants (execução concorrente):")
+    for i, u in enumerate(urls, 1):
+        log(f"  {i}. {u}")
+
+    async def _todos(browser) -> None:
+        sem = asyncio.Semaphore(limite)
+        if sequencial:
+            for idx, url in enumerate(urls, 1):
+                await _executar_tenant(browser, url, idx, len(urls), creds[url], sem, True, contextos)
+        else:
+            resultados = await asyncio.gather(
+                *(
+                    _executar_tenant(browser, url, idx, len(urls), creds[url], sem, False, contextos)
+                    for idx, url in enumerate(urls, 1)
+                ),
+                return_exceptions=True,
+            )
+            erros = [r for r in resultados if isinstance(r, BaseException)]
+            for url, r in zip(urls, resultados):
+                if isinstance(r, BaseException):
+                    log(f"Tenant '{_extract_tenant_from_url(url)}' terminou com erro: {r!r}", "ERROR")
+            if erros:
+                raise erros[0]
 
+    try:
+        if browser is not None:
+            await _todos(browser)
+            return
 
+        async with async_playwright() as p:
+            browser = await lancar_navegador(p)
+            try:
+                await _todos(browser)
+                log("Pausa final de 5 segundos para inspeção")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+    finally:
+        # tamanhos aprendidos valem mesmo numa rodada que falhou
+        _salvar_lean_tamanhos()
+
+
+
+def _exportar_last_report(run_id: str) -> None:
+    """last_report.json virou exportação opcional (RPA_EXPORT_LAST_REPORT=1) a partir de run_events."""
+    if not (run_events.EXPORT_LAST_REPORT and run_events.EVENTOS_DB):
+        return
+    rpa_logging.descarregar()
+    destino = Path(__file__).resolve().parent / "last_report.json"
+    try:
+        run_events.exportar_last_report(run_id, str(destino))
+    except Exception as e:
+        log(f"Falha ao exportar {destino.name}: {e!r}", "WARNING")
 
 # Mantém a assinatura esperada pelo seu app.py
-def run_rpa_enter_google_folder(extract_dir: str, target_folder: str, base_dir: str) -> None:
-    asyncio.run(_run())
+def run_rpa_enter_google_folder(extract_dir: str, target_folder: str, base_dir: str,
+                                deve_cancelar=None, run_id: Optional[str] = None,
+                                retomar: bool = False) -> None:
+    asyncio.run(_run(deve_cancelar=deve_cancelar, run_id=run_id, retomar=retomar))
 
 # Stub antigo (mantido se for referenciado por app.py)
 def _ensure_local_zip_from_drive(dest_dir: str) -> str:
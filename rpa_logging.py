@@ -0,0 +1,218 @@
+# rpa_logging.py
+# Logger não bloqueante do RPA: log() só enfileira o registro; uma thread em segundo
+# plano grava JSON lines em lote, rotaciona por tamanho (com gzip) e, opcionalmente,
+# espelha no console em texto legível. Vários processos (app, rpa_worker) gravam no
+# mesmo arquivo: cada lote abre, grava e fecha sob uma trava de arquivo (.lock), e a
+# rotação acontece dentro da mesma trava.
+import os
+import sys
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import threading
+import contextlib
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+# =========================
+# Configuração (.env)
+# =========================
+LOG_ARQUIVO = Path(os.getenv("RPA_LOG_ARQUIVO", str(Path(__file__).resolve().parent / "logs" / "rpa.jsonl")))
+LOG_MAX_BYTES = int(float(os.getenv("RPA_LOG_MAX_MB", "10") or 10) * 1024 * 1024)
+LOG_BACKUPS = int(os.getenv("RPA_LOG_BACKUPS", "5") or 5)
+LOG_CONSOLE = os.getenv("RPA_LOG_CONSOLE", "1").strip() == "1"
+LOG_FILA = int(os.getenv("RPA_LOG_FILA", "10000") or 10000)
+
+LOTE_MAX = 500
+INTERVALO_S = 0.5
+
+_FIM = object()
+
+
+class JsonLinesLogger:
+    """Fila limitada + thread escritora. emitir() nunca bloqueia: com a fila cheia, descarta e conta."""
+
+    def __init__(self, arquivo: Path = LOG_ARQUIVO, max_bytes: int = LOG_MAX_BYTES,
+                 backups: int = LOG_BACKUPS, console: bool = LOG_CONSOLE, fila: int = LOG_FILA) -> None:
+        self.arquivo = arquivo
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.console = console
+        self._fila: "queue.Queue" = queue.Queue(maxsize=fila)
+        self.descartados = 0
+        self._descartados_lock = threading.Lock()
+        # destinos extras do lote (ex.: run_events no banco), chamados na thread escritora
+        self.destinos: List[Callable[[List[dict]], None]] = []
+        self._thread = threading.Thread(target=self._loop, name="rpa-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.fechar)
+
+    def emitir(self, registro: dict) -> None:
+        try:
+            self._fila.put_nowait(registro)
+        except queue.Full:
+            with self._descartados_lock:
+                self.descartados += 1
+
+    def descarregar(self, timeout: float = 5.0) -> bool:
+        """Espera a thread gravar tudo o que já foi emitido (ex.: antes de exportar)."""
+        marco = threading.Event()
+        try:
+            self._fila.put(marco, timeout=timeout)
+        except queue.Full:
+            return False
+        return marco.wait(timeout)
+
+    def fechar(self, timeout: float = 5.0) -> None:
+        if not self._thread.is_alive():
+            return
+        try:
+            self._fila.put(_FIM, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    # --- thread escritora ---
+    def _loop(self) -> None:
+        while True:
+            try:
+                item = self._fila.get(timeout=INTERVALO_S)
+            except queue.Empty:
+                continue
+            lote: List[dict] = []
+            marcos: List[threading.Event] = []
+            fim = item is _FIM
+            while True:
+                if isinstance(item, threading.Event):
+                    marcos.append(item)
+                elif item is not _FIM:
+                    lote.append(item)
+                if fim or len(lote) >= LOTE_MAX:
+                    break
+                try:
+                    item = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                fim = item is _FIM
+            with self._descartados_lock:
+                n, self.descartados = self.descartados, 0
+            if n:
+                lote.append(_registro(f"{n} registro(s) de log descartados (fila cheia)", "WARNING"))
+            try:
+                self._escrever(lote)
+            except Exception as e:
+                sys.stderr.write(f"[rpa_logging] falha ao gravar log: {e!r}\n")
+            for destino in list(self.destinos):
+                try:
+                    destino(lote)
+                except Exception as e:
+                    sys.stderr.write(f"[rpa_logging] falha no destino {destino!r}: {e!r}\n")
+            for marco in marcos:
+                marco.set()
+            if fim:
+                return
+
+    def _escrever(self, lote: List[dict]) -> None:
+        if not lote:
+            return
+        if self.console:
+            sys.stdout.write("".join(_legivel(r) + "\n" for r in lote))
+            sys.stdout.flush()
+        self.arquivo.parent.mkdir(parents=True, exist_ok=True)
+        texto = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in lote)
+        girado = None
+        with _trava_arquivo(self.arquivo.with_name(self.arquivo.name + ".lock")):
+            # sem handle aberto entre lotes: outro processo pode ter rotacionado o arquivo
+            with open(self.arquivo, "a", encoding="utf-8") as fh:
+                fh.write(texto)
+                tamanho = fh.tell()
+            if tamanho >= self.max_bytes:
+                carimbo = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+                girado = self.arquivo.with_name(f"{self.arquivo.stem}.{carimbo}-{os.getpid()}{self.arquivo.suffix}")
+                os.replace(self.arquivo, girado)
+        if girado is not None:
+            self._compactar(girado)
+
+    def _compactar(self, girado: Path) -> None:
+        """Fora da trava: só este processo conhece o arquivo renomeado."""
+        with open(girado, "rb") as src, gzip.open(girado.with_name(girado.name + ".gz"), "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(girado)
+        antigos = sorted(self.arquivo.parent.glob(f"{self.arquivo.stem}.*{self.arquivo.suffix}.gz"))
+        for velho in antigos[:-self.backups] if self.backups > 0 else antigos:
+            try:
+                os.remove(velho)
+            except OSError:
+                pass
+
+
+@contextlib.contextmanager
+def _trava_arquivo(caminho: Path):
+    """Trava exclusiva entre processos (flock no POSIX, msvcrt.locking no Windows)."""
+    with open(caminho, "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+            fh.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK desiste após ~10 s; tenta de novo
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def _registro(msg: str, nivel: str = "INFO", **campos) -> dict:
+    reg = {"ts": datetime.now().isoformat(timespec="milliseconds"), "level": nivel, "msg": msg}
+    reg.update({k: v for k, v in campos.items() if v is not None})
+    return reg
+
+
+def _legivel(reg: dict) -> str:
+    tag = reg.get("tenant")
+    prefixo = f"[rpa][{tag}]" if tag else "[rpa]"
+    nivel = reg.get("level", "INFO")
+    return f"{prefixo} {reg['msg']}" if nivel == "INFO" else f"{prefixo} {nivel}: {reg['msg']}"
+
+
+_LOGGER: Optional[JsonLinesLogger] = None
+_LOGGER_LOCK = threading.Lock()
+
+
+def logger() -> JsonLinesLogger:
+    global _LOGGER
+    if _LOGGER is None:
+        with _LOGGER_LOCK:
+            if _LOGGER is None:
+                _LOGGER = JsonLinesLogger()
+    return _LOGGER
+
+
+def emitir(msg: str, nivel: str = "INFO", **campos) -> None:
+    """Campos de contexto usuais: run_id, tenant, unidade, etapa, kind."""
+    logger().emitir(_registro(msg, nivel, **campos))
+
+
+def adicionar_destino(fn: Callable[[List[dict]], None]) -> None:
+    """Registra um consumidor de lotes (idempotente)."""
+    lg = logger()
+    if fn not in lg.destinos:
+        lg.destinos.append(fn)
+
+
+def descarregar(timeout: float = 5.0) -> bool:
+    return logger().descarregar(timeout) if _LOGGER is not None else True
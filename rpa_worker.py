@@ -0,0 +1,236 @@
+# rpa_worker.py
+# Processo dedicado do RPA: mantém o Chromium aberto e um contexto autenticado por
+# tenant (renovado por heartbeat) e recebe comandos do app Flask por socket local.
+# Subir com:  python rpa_worker.py
+import os
+import json
+import secrets
+import asyncio
+import threading
+import time
+import uuid
+from functools import lru_cache
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# =========================
+# Configuração (.env)
+# =========================
+WORKER_ATIVO = os.getenv("RPA_WORKER", "0").strip() == "1"
+WORKER_HOST = os.getenv("RPA_WORKER_HOST", "127.0.0.1")
+WORKER_PORT = int(os.getenv("RPA_WORKER_PORT", "6001") or 6001)
+AUTHKEY_ARQUIVO = Path(os.getenv("RPA_WORKER_AUTHKEY_ARQUIVO") or Path(__file__).resolve().parent / ".rpa_worker.key")
+HEARTBEAT_S = float(os.getenv("RPA_WORKER_HEARTBEAT_S", "300") or 300)
+RESPOSTA_TIMEOUT_S = float(os.getenv("RPA_WORKER_TIMEOUT_S", "5") or 5)
+
+
+@lru_cache(maxsize=None)
+def _authkey() -> bytes:
+    """
+    RPA_WORKER_AUTHKEY explícita; sem ela, uma chave aleatória gravada em
+    AUTHKEY_ARQUIVO (0600) na primeira subida e lida pelo app e pelo worker.
+    Nunca cai para SECRET_KEY nem para um valor fixo.
+    """
+    chave = os.getenv("RPA_WORKER_AUTHKEY", "").strip()
+    if chave:
+        return chave.encode("utf-8")
+    try:
+        fd = os.open(AUTHKEY_ARQUIVO, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(20):
+            # o outro processo pode ter acabado de criar o arquivo e ainda não escrito
+            chave = AUTHKEY_ARQUIVO.read_text(encoding="utf-8").strip()
+            if chave:
+                break
+            time.sleep(0.05)
+        if not chave:
+            raise RuntimeError(f"{AUTHKEY_ARQUIVO} está vazio; apague-o ou defina RPA_WORKER_AUTHKEY.")
+        return chave.encode("utf-8")
+    chave = secrets.token_hex(32)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(chave)
+    return chave.encode("utf-8")
+
+
+# Mensagens trafegam como JSON (send_bytes/recv_bytes), nunca como pickle
+def _enviar(conn, dados: dict) -> None:
+    conn.send_bytes(json.dumps(dados, default=str).encode("utf-8"))
+
+
+def _receber(conn) -> dict:
+    dados = json.loads(conn.recv_bytes(1024 * 1024).decode("utf-8"))
+    if not isinstance(dados, dict):
+        raise ValueError("Mensagem deve ser um objeto JSON.")
+    return dados
+
+
+# =========================
+# Lado do cliente (app Flask)
+# =========================
+def enviar_comando(cmd: str, **dados) -> Optional[dict]:
+    """
+    Envia {"cmd": ..., **dados} ao worker e devolve a resposta.
+    None quando o worker não está no ar (ou não respondeu a tempo).
+    """
+    try:
+        with Client((WORKER_HOST, WORKER_PORT), authkey=_authkey()) as conn:
+            _enviar(conn, {"cmd": cmd, **dados})
+            if not conn.poll(RESPOSTA_TIMEOUT_S):
+                return None
+            return _receber(conn)
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+# =========================
+# Lado do worker
+# =========================
+class RpaWorker:
+    """Navegador quente + contextos por tenant; uma rodada por vez."""
+
+    def __init__(self) -> None:
+        self.playwright = None
+        self.browser = None
+        self.contextos: dict = {}
+        self._lock = asyncio.Lock()
+        self._parar = asyncio.Event()
+        self.rodada: Optional[dict] = None
+        self._cancelar = False
+        self.ultima: Optional[dict] = None
+        self.ultimo_heartbeat: Optional[float] = None
+
+    async def _navegador(self):
+        from rpa import lancar_navegador, log
+        if self.browser is not None and self.browser.is_connected():
+            return self.browser
+        if self.browser is not None:
+            log("[worker] Chromium desconectado; relançando.")
+        self.contextos.clear()
+        self.browser = await lancar_navegador(self.playwright)
+        return self.browser
+
+    async def aquecer(self) -> None:
+        """Login/sonda de cada tenant; falha de um tenant não derruba os outros."""
+        from rpa import _env_urls_in_order, manter_sessao_tenant, log
+        browser = await self._navegador()
+        for url in _env_urls_in_order():
+            try:
+                await manter_sessao_tenant(browser, url, self.contextos)
+            except Exception as e:
+                log(f"[worker] Heartbeat falhou para {url}: {e!r}", "WARNING")
+        self.ultimo_heartbeat = time.time()
+
+    async def _heartbeat(self) -> None:
+        while not self._parar.is_set():
+            try:
+                await asyncio.wait_for(self._parar.wait(), timeout=HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                pass
+            if self._parar.is_set():
+                return
+            async with self._lock:
+                await self.aquecer()
+
+    async def _rodar(self, run_id: str, execucao: Optional[str] = None, retomar: bool = False) -> None:
+        from rpa import _run, log
+        async with self._lock:
+            erro = None
+            try:
+                await _run(await self._navegador(), self.contextos, deve_cancelar=lambda: self._cancelar,
+                           run_id=execucao or run_id, retomar=retomar)
+            except Exception as e:
+                erro = repr(e)
+                log(f"[worker] Rodada {run_id} terminou com erro: {erro}", "ERROR")
+            finally:
+                self.ultima = {**(self.rodada or {}), "fim": time.time(), "erro": erro}
+                self.rodada = None
+
+    def status(self) -> dict:
+        return {
+            "ok": True,
+            "navegador": bool(self.browser is not None and self.browser.is_connected()),
+            "tenants": sorted(self.contextos),
+            "rodando": self.rodada,
+            "ultima": self.ultima,
+            "ultimo_heartbeat": self.ultimo_heartbeat,
+        }
+
+    async def tratar(self, msg: dict) -> dict:
+        cmd = (msg or {}).get("cmd")
+        if cmd == "run":
+            if self.rodada is not None:
+                return {"ok": False, "error": "Já existe uma rodada em andamento.", "rodando": self.rodada}
+            run_id = str(msg.get("run_id") or uuid.uuid4())
+            self._cancelar = False
+            self.rodada = {"run_id": run_id, "inicio": time.time()}
+            asyncio.ensure_future(self._rodar(run_id, msg.get("execucao"), bool(msg.get("retomar"))))
+            return {"ok": True, "run_id": run_id, "started_at": int(self.rodada["inicio"])}
+        if cmd == "cancelar":
+            if self.rodada is None or msg.get("run_id") not in (None, self.rodada["run_id"]):
+                return {"ok": False, "error": "Nenhuma rodada correspondente em andamento."}
+            self._cancelar = True
+            return {"ok": True, "run_id": self.rodada["run_id"]}
+        if cmd in ("status", "ping"):
+            return self.status()
+        if cmd == "parar":
+            self._parar.set()
+            return {"ok": True}
+        return {"ok": False, "error": f"Comando desconhecido: {cmd!r}"}
+
+    def _escutar(self, listener: Listener, loop: asyncio.AbstractEventLoop) -> None:
+        """Thread de accept: cada conexão traz um comando e recebe uma resposta."""
+        while not self._parar.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            except Exception:
+                # authkey errado etc.: ignora a conexão
+                continue
+            with conn:
+                try:
+                    msg = _receber(conn)
+                    fut = asyncio.run_coroutine_threadsafe(self.tratar(msg), loop)
+                    _enviar(conn, fut.result(timeout=RESPOSTA_TIMEOUT_S))
+                except Exception as e:
+                    try:
+                        _enviar(conn, {"ok": False, "error": repr(e)})
+                    except Exception:
+                        pass
+
+    async def servir(self) -> None:
+        from playwright.async_api import async_playwright
+        from rpa import log
+        listener = Listener((WORKER_HOST, WORKER_PORT), authkey=_authkey())
+        log(f"[worker] Escutando em {WORKER_HOST}:{WORKER_PORT} (heartbeat a cada {HEARTBEAT_S:.0f}s)")
+        async with async_playwright() as p:
+            self.playwright = p
+            threading.Thread(target=self._escutar, args=(listener, asyncio.get_running_loop()), daemon=True).start()
+            try:
+                async with self._lock:
+                    await self.aquecer()
+                await self._heartbeat()
+            finally:
+                listener.close()
+                for ctx in list(self.contextos.values()):
+                    try:
+                        await ctx.close()
+                    except Exception:
+                        pass
+                if self.browser is not None:
+                    try:
+                        await self.browser.close()
+                    except Exception:
+                        pass
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(RpaWorker().servir())
+    except KeyboardInterrupt:
+        pass
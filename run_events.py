@@ -0,0 +1,210 @@
+# run_events.py
+# Eventos das execuções (tabela run_events, append-only): recebem os lotes do logger
+# do RPA (rpa_logging), servem o /api/report por cursor e, se pedido, exportam o
+# last_report.json no formato antigo. O /api/report/stream (SSE) espera em
+# aguardar_novos() em vez de consultar em intervalo fixo: cada lote gravado atualiza
+# uma marca d'água (maior id, num arquivo pequeno), vista por todos os processos —
+# o app percebe na hora os eventos gravados pelo rpa_worker, sem tocar no banco.
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import delete, func
+
+import rpa_logging
+from db import SessionLocal
+from models import RunEvent
+
+EVENTOS_DB = os.getenv("RPA_EVENTOS_DB", "1").strip() == "1"
+MAX_DIAS = float(os.getenv("RPA_EVENTOS_MAX_DIAS", "30") or 30)
+MAX_LINHAS = int(os.getenv("RPA_EVENTOS_MAX_LINHAS", "200000") or 200000)
+RETENCAO_INTERVALO_S = 600
+EXPORT_LAST_REPORT = os.getenv("RPA_EXPORT_LAST_REPORT", "0").strip() == "1"
+# Marca d'água entre processos (maior id gravado); por padrão ao lado do log JSONL
+MARCA_ARQUIVO = Path(os.getenv("RPA_EVENTOS_MARCA") or rpa_logging.LOG_ARQUIVO.with_name("run_events.marca"))
+MARCA_POLL_S = 0.25
+
+HEADERS = ["ts", "level", "tenant", "unidade", "etapa", "msg"]
+
+_ultima_retencao = 0.0
+_retencao_lock = threading.Lock()
+# acorda os streams (SSE) deste processo a cada lote gravado
+_NOVOS = threading.Condition()
+
+
+def _ts(reg: dict) -> datetime:
+    try:
+        return datetime.fromisoformat(str(reg.get("ts")))
+    except ValueError:
+        return datetime.now()
+
+
+def gravar_lote(lote: List[dict]) -> None:
+    """Destino do rpa_logging: um INSERT em lote por batch da thread escritora."""
+    if not lote:
+        return
+    with SessionLocal() as db:
+        db.bulk_insert_mappings(RunEvent, [
+            {
+                "run_id": reg.get("run_id"),
+                "ts": _ts(reg),
+                "level": str(reg.get("level") or "INFO")[:10],
+                "kind": str(reg.get("kind") or "log")[:20],
+                "tenant": reg.get("tenant"),
+                "unidade": reg.get("unidade"),
+                "etapa": reg.get("etapa"),
+                "message": str(reg.get("msg") or ""),
+            }
+            for reg in lote
+        ])
+        db.commit()
+        maior = db.query(func.max(RunEvent.id)).scalar()
+    _gravar_marca(maior or 0)
+    with _NOVOS:
+        _NOVOS.notify_all()
+    aplicar_retencao()
+
+
+def _gravar_marca(maior_id: int) -> None:
+    try:
+        MARCA_ARQUIVO.parent.mkdir(parents=True, exist_ok=True)
+        tmp = MARCA_ARQUIVO.with_name(f"{MARCA_ARQUIVO.name}.{os.getpid()}.tmp")
+        tmp.write_text(str(maior_id), encoding="utf-8")
+        os.replace(tmp, MARCA_ARQUIVO)
+    except OSError:
+        pass  # (Windows) leitor com o arquivo aberto: o próximo lote atualiza
+
+
+def marca() -> Optional[int]:
+    """Maior id gravado por qualquer processo; None se nenhum lote foi gravado ainda."""
+    try:
+        return int(MARCA_ARQUIVO.read_text(encoding="utf-8").strip() or 0)
+    except (OSError, ValueError):
+        return None
+
+
+def aguardar_novos(timeout: float, marca_vista: Optional[int] = None) -> Optional[int]:
+    """
+    Espera até a marca d'água mudar em relação a `marca_vista` (ou o timeout) e devolve
+    a marca atual. Lotes deste processo acordam na hora; os de outro processo
+    (rpa_worker) são vistos pela marca em até MARCA_POLL_S.
+    """
+    fim = time.monotonic() + timeout
+    while True:
+        atual = marca()
+        if atual is not None and atual != marca_vista:
+            return atual
+        restante = fim - time.monotonic()
+        if restante <= 0:
+            return atual
+        with _NOVOS:
+            _NOVOS.wait(min(restante, MARCA_POLL_S))
+
+
+def aplicar_retencao(forcar: bool = False) -> None:
+    """Apaga por idade (MAX_DIAS) e mantém no máximo MAX_LINHAS; roda a cada ~10 min."""
+    global _ultima_retencao
+    agora = time.monotonic()
+    with _retencao_lock:
+        if not forcar and agora - _ultima_retencao < RETENCAO_INTERVALO_S:
+            return
+        _ultima_retencao = agora
+    with SessionLocal() as db:
+        db.execute(delete(RunEvent).where(RunEvent.ts < datetime.now() - timedelta(days=MAX_DIAS)))
+        maior = db.query(func.max(RunEvent.id)).scalar()
+        if maior is not None and MAX_LINHAS > 0:
+            db.execute(delete(RunEvent).where(RunEvent.id <= maior - MAX_LINHAS))
+        db.commit()
+
+
+def instalar() -> None:
+    """Liga a gravação dos logs do RPA em run_events (RPA_EVENTOS_DB=0 desliga)."""
+    if EVENTOS_DB:
+        import rpa_logging
+        rpa_logging.adicionar_destino(gravar_lote)
+
+
+def _linha(ev: RunEvent) -> dict:
+    return {
+        "id": ev.id,
+        "ts": ev.ts.strftime("%d/%m/%Y %H:%M:%S") if ev.ts else "",
+        "level": ev.level,
+        "kind": ev.kind,
+        "tenant": ev.tenant or "",
+        "unidade": ev.unidade or "",
+        "etapa": ev.etapa or "",
+        "msg": ev.message,
+    }
+
+
+def ultimo_run_id() -> Optional[str]:
+    with SessionLocal() as db:
+        ev = (
+            db.query(RunEvent.run_id)
+            .filter(RunEvent.run_id.isnot(None))
+            .order_by(RunEvent.id.desc())
+            .first()
+        )
+        return ev[0] if ev else None
+
+
+def estado(run_id: str) -> tuple:
+    """(maior id, ts desse evento) da execução: muda a cada evento novo, barato para validar cache."""
+    with SessionLocal() as db:
+        ev = (
+            db.query(RunEvent.id, RunEvent.ts)
+            .filter(RunEvent.run_id == run_id)
+            .order_by(RunEvent.id.desc())
+            .first()
+        )
+    return (ev[0], ev[1]) if ev else (0, None)
+
+
+def consultar(run_id: Optional[str], since: int = 0, limite: int = 1000) -> dict:
+    """Eventos com id > since (da execução `run_id`), em ordem; `cursor` vai no próximo since."""
+    with SessionLocal() as db:
+        # run_fim antes das linhas: se já existe, a consulta abaixo já o inclui
+        fim = (
+            db.query(RunEvent.id)
+            .filter(RunEvent.run_id == run_id, RunEvent.kind == "run_fim")
+            .first()
+            if run_id else None
+        )
+        q = db.query(RunEvent).filter(RunEvent.id > since)
+        if run_id:
+            q = q.filter(RunEvent.run_id == run_id)
+        eventos = q.order_by(RunEvent.id.asc()).limit(limite).all()
+        rows = [_linha(ev) for ev in eventos]
+    return {
+        "rows": rows,
+        "cursor": rows[-1]["id"] if rows else since,
+        "mais": len(rows) >= limite,
+        "finished": fim is not None,
+    }
+
+
+def exportar_last_report(run_id: str, caminho: str) -> None:
+    """Gera o last_report.json (formato antigo: ready/updated_at/headers/rows/meta) da execução."""
+    rows: List[dict] = []
+    since = 0
+    while True:
+        parte = consultar(run_id, since, limite=5000)
+        rows.extend(parte["rows"])
+        since = parte["cursor"]
+        if not parte["mais"]:
+            break
+    dados = {
+        "ready": True,
+        "updated_at": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+        "headers": HEADERS,
+        "rows": [{h: r.get(h, "") for h in HEADERS} for r in rows],
+        "meta": {"run_id": run_id},
+    }
+    tmp = caminho + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dados, f, ensure_ascii=False)
+    os.replace(tmp, caminho)
@@ -0,0 +1,459 @@
+# scheduler.py
+# Fila de jobs persistida no banco (tabela jobs) + agendador.
+# É o único componente que dispara o RPA: o Flask só enfileira.
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import IntegrityError
+
+import rpa_logging
+from db import SessionLocal
+from models import Job
+
+# =========================
+# Configuração (.env)
+# =========================
+# Quantos jobs executados localmente (ex.: 'rpa') rodam ao mesmo tempo, somando todos os processos
+MAX_CONCORRENTES = max(1, int(os.getenv("RPA_JOBS_CONCORRENCIA", "1") or 1))
+TICK_S = float(os.getenv("RPA_JOBS_TICK_S", "2") or 2)
+# Agenda diária: "07:30,13:00" e/ou cron de 5 campos ("30 7 * * 1-5"), separados por ";"
+AGENDA = os.getenv("RPA_AGENDA", "").strip()
+# Job 'running' sem heartbeat do dono há mais que isso é órfão (processo morreu)
+ORFAO_S = max(float(os.getenv("RPA_JOBS_ORFAO_S", "60") or 60), 5 * TICK_S)
+# Job do agente (pull_zip) entregue e sem upload há mais que isso expira (agente caiu)
+PULL_EXPIRA_S = float(os.getenv("RPA_PULL_ZIP_EXPIRA_S", "1800") or 1800)
+
+# Identifica o processo dono dos jobs que ele reivindica
+DONO = f"{socket.gethostname()}:{os.getpid()}"[:100]
+
+ATIVOS = ("queued", "running")
+FINAIS = ("done", "failed", "cancelled")
+
+
+def _agora() -> datetime:
+    return datetime.utcnow()
+
+
+def job_dict(job: Job) -> dict:
+    def _iso(d):
+        return d.isoformat() + "Z" if d else None
+    def _json(v):
+        try:
+            return json.loads(v) if v else None
+        except ValueError:
+            return v
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "priority": job.priority,
+        "dedup_key": job.dedup_key,
+        "payload": _json(job.payload),
+        "result": _json(job.result),
+        "error": job.error,
+        "cancel_requested": bool(job.cancel_requested),
+        "requested_by": job.requested_by,
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+        "owner": job.owner,
+        "heartbeat_at": _iso(job.heartbeat_at),
+    }
+
+
+# =========================
+# Operações da fila
+# =========================
+# Ao sair de ATIVOS o job devolve a chave de dedup e a vaga (índices únicos no banco)
+_LIBERAR = {"dedup_ativo": None, "vaga": None}
+
+
+def _ativo(db, dedup_key: str) -> Optional[Job]:
+    return (
+        db.query(Job)
+        .filter(Job.dedup_key == dedup_key, Job.status.in_(ATIVOS))
+        .order_by(Job.created_at.desc())
+        .first()
+    )
+
+
+def enfileirar(kind: str, payload: Optional[dict] = None, priority: int = 0,
+               requested_by: Optional[str] = None, dedup_key: Optional[str] = None) -> Tuple[dict, bool]:
+    """
+    Cria um job e devolve (job, criado). Single-flight: se já houver job ativo
+    com a mesma dedup_key, devolve esse (criado=False). Entre processos (vários
+    workers do Flask) quem decide é o índice único de dedup_ativo.
+    """
+    with SessionLocal() as db:
+        for _ in range(3):
+            if dedup_key:
+                existente = _ativo(db, dedup_key)
+                if existente is not None:
+                    if existente.status == "queued" and priority > (existente.priority or 0):
+                        existente.priority = priority
+                        db.commit()
+                    return job_dict(existente), False
+            job = Job(
+                id=str(uuid.uuid4()),
+                kind=kind,
+                status="queued",
+                priority=priority,
+                dedup_key=dedup_key,
+                dedup_ativo=dedup_key,
+                payload=json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                requested_by=requested_by,
+                created_at=_agora(),
+            )
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                # outro processo criou o job da chave entre a consulta e o insert: usa o dele
+                db.rollback()
+                continue
+            return job_dict(job), True
+    raise RuntimeError(f"Não foi possível enfileirar o job (dedup_key={dedup_key!r}).")
+
+
+def obter(job_id: str) -> Optional[dict]:
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        return job_dict(job) if job else None
+
+
+def cancelar(job_id: str) -> Optional[dict]:
+    """Na fila: cancela na hora. Rodando: marca cancel_requested (o executor checa)."""
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        if job is None:
+            return None
+        if job.status == "queued":
+            job.status = "cancelled"
+            job.finished_at = _agora()
+            job.dedup_ativo = job.vaga = None
+        elif job.status == "running":
+            job.cancel_requested = True
+        db.commit()
+        return job_dict(job)
+
+
+def _reivindicar(db, job_id: str, vaga: Optional[int] = None) -> bool:
+    """
+    queued → running de forma atômica (vale entre processos), com este processo como
+    dono. Com `vaga`, só reivindica se nenhum outro job ativo ocupa a mesma vaga.
+    """
+    agora = _agora()
+    try:
+        res = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "queued")
+            .values(status="running", started_at=agora, owner=DONO, heartbeat_at=agora, vaga=vaga)
+        )
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return res.rowcount == 1
+
+
+def _finalizar(job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None) -> None:
+    with SessionLocal() as db:
+        job = db.get(Job, job_id)
+        if job is None or job.status in FINAIS:
+            return
+        job.status = status
+        job.finished_at = _agora()
+        job.dedup_ativo = job.vaga = None
+        if result is not None:
+            job.result = json.dumps(result, ensure_ascii=False)
+        if error:
+            job.error = error
+        db.commit()
+
+
+def deve_cancelar(job_id: str, intervalo_s: float = 2.0) -> Callable[[], bool]:
+    """Hook should_cancel para o executor: consulta o banco no máximo a cada `intervalo_s`."""
+    estado = {"ts": 0.0, "valor": False}
+
+    def _fn() -> bool:
+        if estado["valor"]:
+            return True
+        agora = time.monotonic()
+        if agora - estado["ts"] >= intervalo_s:
+            estado["ts"] = agora
+            with SessionLocal() as db:
+                job = db.get(Job, job_id)
+                estado["valor"] = bool(job is not None and job.cancel_requested)
+        return estado["valor"]
+    return _fn
+
+
+# =========================
+# Jobs consumidos por agente externo (pull_zip)
+# =========================
+def _expirar_externos(db) -> None:
+    """Jobs do agente entregues há mais de PULL_EXPIRA_S sem upload: o agente não vai mais responder."""
+    limite = _agora() - timedelta(seconds=PULL_EXPIRA_S)
+    db.execute(
+        update(Job)
+        .where(Job.status == "running", Job.kind.notin_(list(EXECUTORES)), Job.started_at < limite)
+        .values(status="failed", error="Expirado (agente não enviou o arquivo).", finished_at=_agora(), **_LIBERAR)
+    )
+    db.commit()
+
+
+def job_pendente(kind: str) -> Optional[dict]:
+    """Job ativo mais antigo do tipo; na primeira leitura passa a 'running'."""
+    with SessionLocal() as db:
+        _expirar_externos(db)
+        job = (
+            db.query(Job)
+            .filter(Job.kind == kind, Job.status.in_(ATIVOS))
+            .order_by(Job.priority.desc(), Job.created_at.asc())
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == "queued":
+            _reivindicar(db, job.id)
+            db.refresh(job)
+        return job_dict(job)
+
+
+def concluir(job_id: str, result: Optional[dict] = None) -> None:
+    _finalizar(job_id, "done", result=result)
+
+
+def concluir_ativo(kind: str, result: Optional[dict] = None) -> Optional[str]:
+    """
+    Upload sem job_id (agente antigo): conclui o job ativo do tipo, de preferência o
+    já entregue ('running'). Devolve o id concluído ou None se não havia nenhum.
+    """
+    with SessionLocal() as db:
+        job = (
+            db.query(Job)
+            .filter(Job.kind == kind, Job.status.in_(ATIVOS))
+            .order_by((Job.status == "running").desc(), Job.priority.desc(), Job.created_at.asc())
+            .first()
+        )
+        job_id = job.id if job is not None else None
+    if job_id:
+        concluir(job_id, result)
+    return job_id
+
+
+# =========================
+# Executores locais
+# =========================
+def _executar_rpa(job: dict, cancelado: Callable[[], bool]) -> dict:
+    """Rodada do RPA: no worker (se ativo e no ar) ou numa thread com browser próprio."""
+    from rpa_worker import WORKER_ATIVO, enviar_comando
+    payload = job.get("payload") or {}
+    # checkpoints: uma retomada continua gravando no run_id da execução original
+    execucao = payload.get("retomar") or job["id"]
+    retomar = bool(payload.get("retomar"))
+    if WORKER_ATIVO:
+        resp = enviar_comando("run", run_id=job["id"], execucao=execucao, retomar=retomar)
+        if resp is not None:
+            if not resp.get("ok"):
+                raise RuntimeError(resp.get("error") or "Worker recusou a rodada.")
+            cancelamento_enviado = False
+            while True:
+                time.sleep(TICK_S)
+                if cancelado() and not cancelamento_enviado:
+                    enviar_comando("cancelar", run_id=job["id"])
+                    cancelamento_enviado = True
+                st = enviar_comando("status")
+                if st is None:
+                    continue
+                if (st.get("rodando") or {}).get("run_id") == job["id"]:
+                    continue
+                ultima = st.get("ultima") or {}
+                if ultima.get("run_id") == job["id"]:
+                    if ultima.get("erro"):
+                        raise RuntimeError(ultima["erro"])
+                    return {"modo": "worker", "execucao": execucao}
+                raise RuntimeError("Worker reiniciou e perdeu a rodada.")
+        # worker fora do ar: segue no processo
+    from rpa import run_rpa_enter_google_folder
+    from db import get_paths
+    run_rpa_enter_google_folder(payload.get("extract_dir"), payload.get("target_folder"),
+                                get_paths()[0], deve_cancelar=cancelado,
+                                run_id=execucao, retomar=retomar)
+    return {"modo": "thread", "execucao": execucao}
+
+
+EXECUTORES: Dict[str, Callable[[dict, Callable[[], bool]], Optional[dict]]] = {
+    "rpa": _executar_rpa,
+}
+
+
+# =========================
+# Agenda (cron diário)
+# =========================
+def _campo_cron(campo: str, valor: int, minimo: int, maximo: int) -> bool:
+    for parte in campo.split(","):
+        passo = 1
+        if "/" in parte:
+            parte, p = parte.split("/", 1)
+            passo = int(p)
+        if parte == "*":
+            ini, fim = minimo, maximo
+        elif "-" in parte:
+            a, b = parte.split("-", 1)
+            ini, fim = int(a), int(b)
+        else:
+            ini = fim = int(parte)
+        if ini <= valor <= fim and (valor - ini) % passo == 0:
+            return True
+    return False
+
+
+def _agenda_bate(entrada: str, agora: datetime) -> bool:
+    """'HH:MM' (todo dia) ou cron 'min hora dia mês dia_semana' (0=domingo)."""
+    entrada = entrada.strip()
+    if ":" in entrada and " " not in entrada:
+        h, m = entrada.split(":", 1)
+        return agora.hour == int(h) and agora.minute == int(m)
+    campos = entrada.split()
+    if len(campos) != 5:
+        return False
+    dow = (agora.weekday() + 1) % 7
+    return (_campo_cron(campos[0], agora.minute, 0, 59)
+            and _campo_cron(campos[1], agora.hour, 0, 23)
+            and _campo_cron(campos[2], agora.day, 1, 31)
+            and _campo_cron(campos[3], agora.month, 1, 12)
+            and (_campo_cron(campos[4], dow, 0, 7) or (dow == 0 and _campo_cron(campos[4], 7, 0, 7))))
+
+
+def _entradas_agenda() -> List[str]:
+    """Entradas separadas por ';'; blocos sem espaço ('07:30,13:00') também aceitam ','."""
+    entradas: List[str] = []
+    for bloco in AGENDA.split(";"):
+        bloco = bloco.strip()
+        if " " in bloco:
+            entradas.append(bloco)
+        else:
+            entradas.extend(e.strip() for e in bloco.split(",") if e.strip())
+    return entradas
+
+
+class Scheduler:
+    """
+    Thread única por processo: dispara a agenda e despacha jobs da fila. O limite
+    global vale entre processos: cada rodada ocupa uma das MAX_CONCORRENTES vagas no banco.
+    """
+
+    def __init__(self, payload_rpa: Optional[dict] = None) -> None:
+        self.payload_rpa = payload_rpa or {}
+        self._rodando: Dict[str, threading.Thread] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._parar = threading.Event()
+
+    def iniciar(self) -> None:
+        if self._thread is not None:
+            return
+        self._recuperar_orfaos()
+        self._thread = threading.Thread(target=self._loop, name="rpa-scheduler", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+
+    def _recuperar_orfaos(self) -> None:
+        """
+        Jobs locais 'running' cujo dono parou de renovar o heartbeat morreram com ele.
+        Jobs vivos em processos irmãos (heartbeat recente) não são tocados.
+        """
+        limite = _agora() - timedelta(seconds=ORFAO_S)
+        with SessionLocal() as db:
+            db.execute(
+                update(Job)
+                .where(
+                    Job.status == "running",
+                    Job.kind.in_(list(EXECUTORES)),
+                    or_(Job.heartbeat_at < limite,
+                        and_(Job.heartbeat_at.is_(None), Job.started_at < limite)),
+                )
+                .values(status="failed", error="Interrompido (dono do job parou de responder).",
+                        finished_at=_agora(), **_LIBERAR)
+            )
+            db.commit()
+            _expirar_externos(db)
+
+    def _bater_coracao(self) -> None:
+        if not self._rodando:
+            return
+        with SessionLocal() as db:
+            db.execute(
+                update(Job)
+                .where(Job.id.in_(list(self._rodando)), Job.status == "running", Job.owner == DONO)
+                .values(heartbeat_at=_agora())
+            )
+            db.commit()
+
+    def _loop(self) -> None:
+        ultimo_minuto = None
+        while not self._parar.is_set():
+            try:
+                agora = datetime.now()
+                minuto = agora.strftime("%Y-%m-%dT%H:%M")
+                if AGENDA and minuto != ultimo_minuto:
+                    ultimo_minuto = minuto
+                    self._disparar_agenda(agora)
+                self._rodando = {k: t for k, t in self._rodando.items() if t.is_alive()}
+                self._bater_coracao()
+                self._recuperar_orfaos()
+                self._despachar()
+            except Exception as e:
+                rpa_logging.emitir(f"[scheduler] Erro no loop: {e!r}", "ERROR", kind="scheduler", owner=DONO)
+            self._parar.wait(TICK_S)
+
+    def _disparar_agenda(self, agora: datetime) -> None:
+        for entrada in _entradas_agenda():
+            try:
+                bate = _agenda_bate(entrada, agora)
+            except ValueError:
+                continue
+            if bate:
+                # mesma chave das execuções manuais: nunca duas rodadas ao mesmo tempo
+                enfileirar("rpa", payload=self.payload_rpa, requested_by="agenda", dedup_key="rpa")
+
+    def _despachar(self) -> None:
+        with SessionLocal() as db:
+            ocupadas = {v for (v,) in db.query(Job.vaga).filter(Job.vaga.isnot(None))}
+            livres = [n for n in range(MAX_CONCORRENTES) if n not in ocupadas]
+            if not livres:
+                return
+            candidatos = (
+                db.query(Job)
+                .filter(Job.status == "queued", Job.kind.in_(list(EXECUTORES)))
+                .order_by(Job.priority.desc(), Job.created_at.asc())
+                .limit(len(livres))
+                .all()
+            )
+            for job, vaga in zip(candidatos, livres):
+                # vaga tomada por outro processo no meio do caminho: fica para o próximo tick
+                if not _reivindicar(db, job.id, vaga):
+                    continue
+                db.refresh(job)
+                dados = job_dict(job)
+                t = threading.Thread(target=self._executar, args=(dados,), name=f"job-{job.id[:8]}", daemon=True)
+                self._rodando[job.id] = t
+                t.start()
+
+    def _executar(self, job: dict) -> None:
+        cancelado = deve_cancelar(job["id"])
+        try:
+            result = EXECUTORES[job["kind"]](job, cancelado)
+        except Exception as e:
+            _finalizar(job["id"], "cancelled" if cancelado() else "failed", error=repr(e))
+            return
+        _finalizar(job["id"], "cancelled" if cancelado() else "done", result=result)
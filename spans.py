@@ -0,0 +1,127 @@
+# spans.py
+# Persistência e leitura dos spans de tempo por etapa do RPA (tabela spans):
+# gravação em lote, timeline de uma execução e métricas em texto Prometheus.
+import os
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from db import SessionLocal
+from models import Span
+
+# Janela das métricas agregadas (/api/metrics)
+JANELA_DIAS = float(os.getenv("RPA_METRICS_JANELA_DIAS", "7") or 7)
+QUANTIS = (0.5, 0.95)
+
+
+def gravar(lote: List[dict]) -> None:
+    if not lote:
+        return
+    with SessionLocal() as db:
+        db.add_all(
+            Span(
+                run_id=sp.get("run_id"),
+                tenant=sp.get("tenant"),
+                unidade=sp.get("unidade"),
+                etapa=sp["etapa"],
+                inicio=sp["inicio"],
+                duracao_ms=sp["duracao_ms"],
+                resultado=sp["resultado"],
+                retentativas=sp.get("retentativas", 0),
+                erro=sp.get("erro"),
+            )
+            for sp in lote
+        )
+        db.commit()
+
+
+def timeline(run_id: str) -> List[dict]:
+    """Spans da execução em ordem de início, com offset_ms relativo ao primeiro."""
+    with SessionLocal() as db:
+        rows = db.query(Span).filter_by(run_id=run_id).order_by(Span.inicio.asc(), Span.id.asc()).all()
+    if not rows:
+        return []
+    t0 = rows[0].inicio
+    return [
+        {
+            "tenant": sp.tenant,
+            "unidade": sp.unidade,
+            "etapa": sp.etapa,
+            "inicio": sp.inicio.isoformat() + "Z",
+            "offset_ms": round((sp.inicio - t0).total_seconds() * 1000, 1),
+            "duracao_ms": round(sp.duracao_ms, 1),
+            "resultado": sp.resultado,
+            "retentativas": sp.retentativas,
+            "erro": sp.erro,
+        }
+        for sp in rows
+    ]
+
+
+def _quantil(ordenados: List[float], q: float) -> float:
+    """Nearest-rank sobre a lista já ordenada."""
+    if not ordenados:
+        return 0.0
+    idx = max(0, min(len(ordenados) - 1, math.ceil(q * len(ordenados)) - 1))
+    return ordenados[idx]
+
+
+def agregados() -> Dict[Tuple[str, str], dict]:
+    """Por (tenant, etapa) na janela: durações ordenadas, contagem por resultado e retentativas."""
+    desde = datetime.utcnow() - timedelta(days=JANELA_DIAS)
+    grupos: Dict[Tuple[str, str], dict] = defaultdict(
+        lambda: {"duracoes": [], "resultados": defaultdict(int), "retentativas": 0}
+    )
+    with SessionLocal() as db:
+        q = (
+            db.query(Span.tenant, Span.etapa, Span.duracao_ms, Span.resultado, Span.retentativas)
+            .filter(Span.inicio >= desde)
+        )
+        for tenant, etapa, dur, resultado, ret in q:
+            g = grupos[(tenant or "", etapa)]
+            g["duracoes"].append(dur)
+            g["resultados"][resultado] += 1
+            g["retentativas"] += ret or 0
+    for g in grupos.values():
+        g["duracoes"].sort()
+    return grupos
+
+
+def _escapar(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rotulos(**kv) -> str:
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in kv.items()) + "}"
+
+
+def prometheus() -> str:
+    """Texto no formato de exposição do Prometheus (summary com p50/p95 por tenant/etapa)."""
+    grupos = agregados()
+    linhas = [
+        "# HELP rpa_step_duration_seconds Duração das etapas do RPA (janela móvel).",
+        "# TYPE rpa_step_duration_seconds summary",
+    ]
+    for (tenant, etapa), g in sorted(grupos.items()):
+        d = g["duracoes"]
+        for q in QUANTIS:
+            linhas.append(f"rpa_step_duration_seconds{_rotulos(tenant=tenant, step=etapa, quantile=q)} "
+                          f"{_quantil(d, q) / 1000:.3f}")
+        linhas.append(f"rpa_step_duration_seconds_sum{_rotulos(tenant=tenant, step=etapa)} {sum(d) / 1000:.3f}")
+        linhas.append(f"rpa_step_duration_seconds_count{_rotulos(tenant=tenant, step=etapa)} {len(d)}")
+    # contagens da janela móvel sobem e descem: gauge (counter exige valor monotônico)
+    linhas += [
+        "# HELP rpa_step_outcomes Etapas executadas por resultado (janela móvel).",
+        "# TYPE rpa_step_outcomes gauge",
+    ]
+    for (tenant, etapa), g in sorted(grupos.items()):
+        for resultado, n in sorted(g["resultados"].items()):
+            linhas.append(f"rpa_step_outcomes{_rotulos(tenant=tenant, step=etapa, outcome=resultado)} {n}")
+    linhas += [
+        "# HELP rpa_step_retries Retentativas dentro das etapas (janela móvel).",
+        "# TYPE rpa_step_retries gauge",
+    ]
+    for (tenant, etapa), g in sorted(grupos.items()):
+        linhas.append(f"rpa_step_retries{_rotulos(tenant=tenant, step=etapa)} {g['retentativas']}")
+    return "\n".join(linhas) + "\n"
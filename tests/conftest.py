@@ -0,0 +1,26 @@
+# tests/conftest.py
+# Banco SQLite e pastas temporárias para os testes (antes de importar db/models).
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+_TMP = Path(tempfile.mkdtemp(prefix="faturamento-testes-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP / 'testes.db'}"
+os.environ["RPA_LOG_CONSOLE"] = "0"
+os.environ["RPA_LOG_ARQUIVO"] = str(_TMP / "logs" / "rpa.jsonl")
+os.environ["RPA_EVENTOS_DB"] = "0"
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def banco():
+    """Tabelas recriadas a cada teste."""
+    from db import engine, init_db_and_seed_admin
+    from models import Base
+    Base.metadata.drop_all(engine)
+    init_db_and_seed_admin()
+    yield
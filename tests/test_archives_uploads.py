@@ -0,0 +1,146 @@
+# tests/test_archives_uploads.py
+import io
+import os
+import hashlib
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import archives
+import uploads
+from db import SessionLocal
+from models import Archive, UploadLog
+
+
+def _zip(conteudo: bytes = b"linha\n", nome: str = "a.ret") -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr(nome, conteudo)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def acervo(banco, tmp_path, monkeypatch):
+    store = archives.ArchiveStore(tmp_path / "acervo", max_qtd=50, max_dias=180, max_bytes=0)
+    monkeypatch.setattr(archives, "STORE", store)
+    monkeypatch.setattr(uploads, "SESSOES_DIR", tmp_path / "sessoes")
+    return store
+
+
+def test_receber_grava_no_acervo_e_destino_vira_link(acervo, tmp_path):
+    destino = str(tmp_path / "arquivos.zip")
+    info = uploads.receber(io.BytesIO(_zip()), destino, "x.zip", "teste")
+    assert info["deduplicado"] is False
+    entrada = acervo.atual()
+    assert entrada["sha256"] == info["sha256"]
+    assert os.path.samefile(destino, entrada["path"])
+
+
+def test_receber_mesmo_conteudo_deduplica(acervo, tmp_path):
+    destino = str(tmp_path / "arquivos.zip")
+    dados = _zip()
+    uploads.receber(io.BytesIO(dados), destino, "x.zip", "teste")
+    info = uploads.receber(io.BytesIO(dados), destino, "x.zip", "teste")
+    assert info["deduplicado"] is True
+    with SessionLocal() as db:
+        assert db.query(Archive).count() == 1
+        assert db.query(UploadLog).count() == 2
+
+
+def test_receber_recusa_sem_trocar_o_destino(acervo, tmp_path):
+    destino = str(tmp_path / "arquivos.zip")
+    uploads.receber(io.BytesIO(_zip(b"bom")), destino, "x.zip", "teste")
+    antes = open(destino, "rb").read()
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.receber(io.BytesIO(b"nao e zip"), destino, "x.zip", "teste")
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.receber(io.BytesIO(_zip(b"outro")), destino, "x.zip", "teste", sha256_esperado="0" * 64)
+    assert open(destino, "rb").read() == antes
+
+
+def test_adotar_indexa_sem_sobrescrever(acervo, tmp_path):
+    destino = tmp_path / "arquivos.zip"
+    dados = _zip(b"colocado a mao")
+    destino.write_bytes(dados)
+    mtime = destino.stat().st_mtime
+    assert uploads.sha256_atual(str(destino)) is None
+    info = uploads.adotar(str(destino), "teste")
+    assert destino.read_bytes() == dados
+    assert destino.stat().st_mtime == pytest.approx(mtime)
+    assert info["sha256"] == hashlib.sha256(dados).hexdigest()
+    assert uploads.sha256_atual(str(destino)) == info["sha256"]
+    assert os.path.samefile(destino, acervo.atual()["path"])
+
+
+def test_podar_mantem_o_atual_e_respeita_limites(acervo, tmp_path):
+    agora = datetime.utcnow()
+    origens = []
+    for i in range(4):
+        p = tmp_path / f"o{i}.zip"
+        p.write_bytes(_zip(f"conteudo {i}".encode()))
+        origens.append(p)
+    # o0 é velho demais; o1..o3 recentes, o3 é o atual
+    for i, p in enumerate(origens):
+        visto = agora - timedelta(days=400) if i == 0 else agora - timedelta(minutes=10 - i)
+        acervo.adicionar(str(p), archives.sha256_arquivo(str(p)), p.stat().st_size, "teste", visto_em=visto)
+    with SessionLocal() as db:
+        assert db.query(Archive).count() == 3  # a entrada velha já saiu na retenção do adicionar
+
+    acervo.max_qtd = 2
+    removidos = acervo.podar()
+    assert len(removidos) == 1 and not os.path.exists(removidos[0])
+    atual = acervo.atual()
+    assert atual["sha256"] == archives.sha256_arquivo(str(origens[3]))
+
+    acervo.max_qtd = 50
+    acervo.max_bytes = 1  # menor que qualquer entrada: ainda assim o atual fica
+    acervo.podar()
+    with SessionLocal() as db:
+        assert [a.sha256 for a in db.query(Archive)] == [atual["sha256"]]
+    assert os.path.isfile(atual["path"])
+
+
+def _enviar_partes(sessao, dados, ordem):
+    for n in ordem:
+        parte = dados[n * sessao["chunk_size"]:(n + 1) * sessao["chunk_size"]]
+        uploads.gravar_parte(sessao["id"], n, io.BytesIO(parte), hashlib.sha256(parte).hexdigest())
+
+
+def test_sessao_em_partes_fora_de_ordem_e_commit_idempotente(acervo, tmp_path):
+    destino = str(tmp_path / "arquivos.zip")
+    dados = _zip(os.urandom(200 * 1024), "grande.bin")
+    s = uploads.criar_sessao("grande.zip", len(dados), destino, chunk_size=uploads.PARTE_MIN,
+                             sha256=hashlib.sha256(dados).hexdigest())
+    assert s["missing"] == list(range(s["total_chunks"]))
+    ordem = list(reversed(range(s["total_chunks"])))
+    _enviar_partes(s, dados, ordem[:-1])
+    assert uploads.obter_sessao(s["id"])["missing"] == [0]
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.concluir_sessao(s["id"], "teste")
+    assert uploads.obter_sessao(s["id"])["status"] == "open"
+
+    _enviar_partes(s, dados, [0])
+    r1 = uploads.concluir_sessao(s["id"], "teste")
+    r2 = uploads.concluir_sessao(s["id"], "teste")
+    assert r1 == r2 and open(destino, "rb").read() == dados
+    assert uploads.obter_sessao(s["id"])["status"] == "committed"
+    with pytest.raises(uploads.SessaoFechada):
+        _enviar_partes(s, dados, [0])
+    assert uploads.abortar_sessao(s["id"]) is False
+
+
+def test_sessao_recusa_parte_corrompida_e_abortada(acervo, tmp_path):
+    destino = str(tmp_path / "arquivos.zip")
+    s = uploads.criar_sessao("x.zip", uploads.PARTE_MIN + 10, destino, chunk_size=uploads.PARTE_MIN)
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.gravar_parte(s["id"], 1, io.BytesIO(b"0123456789"), "0" * 64)
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.gravar_parte(s["id"], 1, io.BytesIO(b"curto"), hashlib.sha256(b"curto").hexdigest())
+    with pytest.raises(uploads.UploadInvalido):
+        uploads.gravar_parte(s["id"], 2, io.BytesIO(b""), "0" * 64)
+    assert uploads.obter_sessao(s["id"])["missing"] == [0, 1]
+    assert uploads.abortar_sessao(s["id"]) is True
+    with pytest.raises(uploads.SessaoFechada):
+        uploads.gravar_parte(s["id"], 1, io.BytesIO(b"0123456789"), hashlib.sha256(b"0123456789").hexdigest())
+    assert not (uploads.SESSOES_DIR / s["id"]).exists()
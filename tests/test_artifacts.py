@@ -0,0 +1,42 @@
+# tests/test_artifacts.py
+import os
+from datetime import datetime, timedelta
+
+import artifacts
+from db import SessionLocal
+from models import Artifact
+
+
+def _gravar(store, nome, tamanho, tenant="t1"):
+    caminho = store.caminho(tenant, nome)
+    caminho.write_bytes(b"x" * tamanho)
+    return caminho
+
+
+def test_podar_remove_vencidos_e_menos_acessados_primeiro(banco, tmp_path):
+    store = artifacts.ArtifactStore(tmp_path, max_bytes=10_000, max_dias=14)
+    a = store.adicionar(_gravar(store, "a.zip", 4000), "trace")
+    b = store.adicionar(_gravar(store, "b.zip", 4000), "trace")
+    # 'a' foi baixado depois: passa a ser o mais recente no LRU
+    assert store.abrir(a["id"])
+    c = store.adicionar(_gravar(store, "c.zip", 4000), "trace")  # 12000 > teto: sai 'b'
+
+    restantes = {x["nome"] for x in store.listar()}
+    assert restantes == {"a.zip", "c.zip"}
+    assert not os.path.exists(tmp_path / "t1" / "b.zip")
+    assert store.abrir(b["id"]) is None
+
+    with SessionLocal() as db:
+        velho = db.get(Artifact, c["id"])
+        velho.created_at = datetime.utcnow() - timedelta(days=15)
+        db.commit()
+    assert store.podar() == [str(tmp_path / "t1" / "c.zip")]
+    assert {x["nome"] for x in store.listar()} == {"a.zip"}
+
+
+def test_podar_nao_toca_arquivos_fora_do_indice(banco, tmp_path):
+    store = artifacts.ArtifactStore(tmp_path, max_bytes=1, max_dias=14)
+    solto = _gravar(store, "manual.png", 100)
+    store.adicionar(_gravar(store, "falha.png", 100), "screenshot")
+    assert store.listar() == []
+    assert solto.exists()
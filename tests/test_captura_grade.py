@@ -0,0 +1,46 @@
+# tests/test_captura_grade.py
+import asyncio
+
+from rpa import CapturaGrade
+
+
+class _PaginaFalsa:
+    def on(self, _evento, _fn):
+        pass
+
+
+def _captura(itens, total=None, status=None):
+    cap = CapturaGrade(_PaginaFalsa())
+    payload = {"itens": itens}
+    if total is not None:
+        payload["total"] = total
+    cap.grade.append((1, payload))
+    cap.status_clientes.update(status or {})
+    return cap
+
+
+def test_sem_status_conhecido_devolve_none():
+    cap = _captura([{"idCliente": 1001, "nomeCliente": "Ana"}, {"idCliente": 1002, "nomeCliente": "Bia"}])
+    assert asyncio.run(cap.invalidos()) is None
+
+
+def test_usa_status_da_chamada_separada():
+    cap = _captura(
+        [{"idCliente": 1001, "nomeCliente": "Ana"}, {"idCliente": 1002, "nomeCliente": "Bia"}],
+        status={"1001": "Válido", "1002": "Inválido"},
+    )
+    invalidos, qtd = asyncio.run(cap.invalidos())
+    assert qtd == 2
+    assert [i["cliente"] for i in invalidos] == ["1002 - Bia"]
+    assert invalidos[0]["status"] == "Inválido"
+
+
+def test_status_na_propria_grade():
+    cap = _captura([{"idCliente": 1, "nomeCliente": "Ana", "cadastroValido": False}])
+    invalidos, qtd = asyncio.run(cap.invalidos())
+    assert (qtd, invalidos[0]["status"]) == (1, "Inválido")
+
+
+def test_lista_incompleta_devolve_none():
+    cap = _captura([{"idCliente": 1, "nomeCliente": "Ana", "cadastroValido": True}], total=50)
+    assert asyncio.run(cap.invalidos()) is None
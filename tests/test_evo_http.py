@@ -0,0 +1,85 @@
+# tests/test_evo_http.py
+# EvoHttpClient contra o servidor substituto (servidor_gravado) com gravações na pasta.
+import asyncio
+import json
+import threading
+from datetime import date
+
+import pytest
+
+pytest.importorskip("httpx")
+
+import evo_http  # noqa: E402
+
+
+def _gravar(pasta, nome, method, path, body, status=200):
+    (pasta / f"{nome}.json").write_text(
+        json.dumps({"method": method, "path": path, "status": status, "body": body}), encoding="utf-8")
+
+
+def _query(pagina):
+    return (f"idUnidade=9&dataInicio=2026-01-07&dataFim=2026-01-07&tipoData=lancamento"
+            f"&page={pagina}&size=2")
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    monkeypatch.setattr(evo_http, "PAGE_SIZE", 2)
+    rota = evo_http.ROTA_NFS_LISTAR
+    _gravar(tmp_path, "p1", "GET", f"{rota}?{_query(1)}", {"itens": [{"id": 1}, {"id": 2}]})
+    _gravar(tmp_path, "p2", "GET", f"{rota}?{_query(2)}", {"itens": [{"id": 3}, {"id": 4}]})
+    _gravar(tmp_path, "p3", "GET", f"{rota}?{_query(3)}", {"itens": [{"id": 5}]})
+    status = evo_http.ROTA_CLIENTE_STATUS
+    _gravar(tmp_path, "c1", "GET", status.format(cliente_id=11), {"status": "Válido"})
+    _gravar(tmp_path, "c2", "GET", status.format(cliente_id=12), {"erro": "negado"}, status=403)
+    srv = evo_http.servidor_gravado(str(tmp_path), port=0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield tmp_path, f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def _cliente(base):
+    return evo_http.EvoHttpClient({"cookies": [], "origins": []}, "tenant", base_url=base)
+
+
+async def _listar(base):
+    async with _cliente(base) as api:
+        return await api.listar_nfs("9", date(2026, 1, 7), date(2026, 1, 7))
+
+
+def test_chave_gravacao_ordena_query():
+    a = evo_http._chave_gravacao("get", "/x/?b=2&a=1")
+    assert a == evo_http._chave_gravacao("GET", "/x?a=1&b=2") == "GET /x?a=1&b=2"
+    assert evo_http._chave_gravacao("GET", "/x?a=1", com_query=False) == "GET /x"
+
+
+def test_listar_nfs_percorre_paginas_gravadas(stub):
+    _, base = stub
+    assert [i["id"] for i in asyncio.run(_listar(base))] == [1, 2, 3, 4, 5]
+
+
+def test_listar_nfs_para_quando_a_pagina_repete(stub):
+    pasta, base = stub
+    for n in ("p1", "p2", "p3"):
+        (pasta / f"{n}.json").unlink()
+    # a API ignora "page": toda página devolve o mesmo lote cheio
+    _gravar(pasta, "todas", "GET", evo_http.ROTA_NFS_LISTAR, {"itens": [{"id": 1}, {"id": 2}]})
+    srv = evo_http.servidor_gravado(str(pasta), port=0)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    try:
+        itens = asyncio.run(_listar(f"http://127.0.0.1:{srv.server_address[1]}"))
+    finally:
+        srv.shutdown()
+        srv.server_close()
+    assert [i["id"] for i in itens] == [1, 2]
+
+
+def test_status_clientes_ignora_recusa_e_ausentes(stub):
+    _, base = stub
+
+    async def _status():
+        async with _cliente(base) as api:
+            return await api.status_clientes(["11", "12", "13", "11"])
+
+    assert asyncio.run(_status()) == {"11": {"status": "Válido"}}
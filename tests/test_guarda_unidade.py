@@ -0,0 +1,68 @@
+# tests/test_guarda_unidade.py
+import asyncio
+import re
+
+import pytest
+
+from rpa import UnidadeVazouErro, _GuardaUnidade
+
+
+class _Local:
+    def __init__(self, pagina):
+        self.first = self
+        self._pagina = pagina
+
+    async def inner_text(self, timeout=None):
+        return self._pagina.rotulo
+
+
+class _Requisicao:
+    def __init__(self, url):
+        self.url = url
+
+
+class _PaginaFalsa:
+    def __init__(self, unidade, rotulo):
+        self.url = f"https://evo5.w12app.com.br/#/app/tenant/{unidade}/financeiro/nfs"
+        self.rotulo = rotulo
+        self._ouvintes = []
+
+    def locator(self, _css):
+        return _Local(self)
+
+    def on(self, evento, fn):
+        if evento == "request":
+            self._ouvintes.append(fn)
+
+    def requisitar(self, url):
+        for fn in self._ouvintes:
+            fn(_Requisicao(url))
+
+
+def _fixada(rotulo="Usuário\nUnidade Centro"):
+    guarda = _GuardaUnidade()
+    pagina = _PaginaFalsa(42, rotulo)
+    asyncio.run(guarda.fixar(pagina, "Centro", re.compile("Centro"), ["centro"]))
+    return guarda, pagina
+
+
+def test_confere_pelo_rotulo_do_cabecalho_mesmo_com_url_igual():
+    guarda, pagina = _fixada()
+    asyncio.run(guarda.conferir(pagina))
+    pagina.rotulo = "Usuário\nUnidade Norte"
+    with pytest.raises(UnidadeVazouErro):
+        asyncio.run(guarda.conferir(pagina))
+
+
+def test_confere_pela_unidade_usada_na_api():
+    guarda, pagina = _fixada()
+    pagina.requisitar("https://evo5.w12app.com.br/api/v1/nfs?idUnidade=42&page=1")
+    asyncio.run(guarda.conferir(pagina))
+    pagina.requisitar("https://evo5.w12app.com.br/api/v1/nfs?idUnidade=7&page=1")
+    with pytest.raises(UnidadeVazouErro):
+        asyncio.run(guarda.conferir(pagina))
+
+
+def test_fixar_recusa_cabecalho_de_outra_unidade():
+    with pytest.raises(UnidadeVazouErro):
+        _fixada("Usuário\nUnidade Norte")
@@ -0,0 +1,125 @@
+# tests/test_metricas_worker.py
+import asyncio
+
+import rpa
+
+URL = "https://evo5.w12app.com.br/#/acesso/t1/"
+
+
+class _Requisicao:
+    def __init__(self, url):
+        self.url = url
+
+
+class _Rota:
+    def __init__(self, url):
+        self.request = _Requisicao(url)
+
+    async def abort(self, _motivo):
+        pass
+
+    async def fallback(self):
+        pass
+
+
+class _Aba:
+    def __init__(self, contexto):
+        self.contexto = contexto
+
+    def on(self, _evento, _fn):
+        pass
+
+    async def set_viewport_size(self, _tamanho):
+        pass
+
+    async def close(self):
+        pass
+
+
+class _Contexto:
+    def __init__(self):
+        self.ouvintes = {}
+        self.rotas = []
+
+    async def new_page(self):
+        return _Aba(self)
+
+    def on(self, evento, fn):
+        self.ouvintes.setdefault(evento, []).append(fn)
+
+    async def route(self, _padrao, fn):
+        self.rotas.append(fn)
+
+    async def add_init_script(self, _js):
+        pass
+
+    async def close(self):
+        pass
+
+    async def trafego(self, requisicoes, bloqueadas):
+        """Simula o navegador: dispara os callbacks fora do contexto da rodada."""
+        for _ in range(requisicoes):
+            for fn in self.ouvintes.get("request", []):
+                fn(_Requisicao("https://evo5.w12app.com.br/api/x"))
+        for _ in range(bloqueadas):
+            await self.rotas[0](_Rota("https://www.googletagmanager.com/gtm.js"))
+
+
+class _Navegador:
+    async def new_context(self, **_kw):
+        return _Contexto()
+
+
+def test_worker_conta_cada_rodada_no_contexto_reaproveitado(monkeypatch):
+    monkeypatch.setattr(rpa, "LEAN_PROFILE", True)
+    monkeypatch.setattr(rpa, "TRACE_FALHAS", False)
+    monkeypatch.setattr(rpa, "CAPTURE_DIR", "")
+    monkeypatch.setattr(rpa, "_lean_tamanhos", lambda: {"https://www.googletagmanager.com/gtm.js": 100})
+    rodadas = iter([(3, 1), (5, 2)])
+
+    async def _fluxo(page, *_a):
+        requisicoes, bloqueadas = next(rodadas)
+        await page.contexto.trafego(requisicoes, bloqueadas)
+
+    resumos = []
+    monkeypatch.setattr(rpa, "run_for_tenant", _fluxo)
+    monkeypatch.setattr(rpa, "_resumo_metricas", lambda: resumos.append(dict(rpa._METRICAS.get())))
+
+    async def _worker():
+        navegador, contextos = _Navegador(), {}
+        # aquecer: o contexto nasce fora de qualquer rodada
+        contextos["t1"] = await rpa._novo_contexto_tenant(navegador, "t1")
+        for _ in range(2):
+            await rpa._executar_tenant(navegador, URL, 1, 1, ("u", "p"), asyncio.Semaphore(1), False, contextos)
+            await contextos["t1"].trafego(7, 1)  # heartbeat entre rodadas: não é de ninguém
+        return contextos
+
+    contextos = asyncio.run(_worker())
+    assert len(contextos) == 1
+    assert [(r["req_total"], r["req_bloqueadas"], r["bytes_bloqueados"]) for r in resumos] == [
+        (3, 1, 100), (5, 2, 200),
+    ]
+
+
+def test_perfil_lean_nao_conta_na_rodada_que_criou_o_contexto(monkeypatch):
+    monkeypatch.setattr(rpa, "LEAN_PROFILE", True)
+    monkeypatch.setattr(rpa, "TRACE_FALHAS", False)
+    monkeypatch.setattr(rpa, "CAPTURE_DIR", "")
+    monkeypatch.setattr(rpa, "_lean_tamanhos", lambda: {"https://www.googletagmanager.com/gtm.js": 100})
+    rodadas = iter([1, 4])
+
+    async def _fluxo(page, *_a):
+        await page.contexto.trafego(0, next(rodadas))
+
+    resumos = []
+    monkeypatch.setattr(rpa, "run_for_tenant", _fluxo)
+    monkeypatch.setattr(rpa, "_resumo_metricas", lambda: resumos.append(dict(rpa._METRICAS.get())))
+
+    async def _worker():
+        navegador, contextos = _Navegador(), {}
+        # a primeira rodada cria o contexto; a segunda o reaproveita
+        for _ in range(2):
+            await rpa._executar_tenant(navegador, URL, 1, 1, ("u", "p"), asyncio.Semaphore(1), False, contextos)
+
+    asyncio.run(_worker())
+    assert [(r["req_bloqueadas"], r["bytes_bloqueados"]) for r in resumos] == [(1, 100), (4, 400)]
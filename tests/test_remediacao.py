@@ -0,0 +1,50 @@
+# tests/test_remediacao.py
+import asyncio
+
+import rpa
+
+
+class _Aba:
+    def on(self, _evento, _fn):
+        pass
+
+    async def set_viewport_size(self, _tamanho):
+        pass
+
+    async def close(self):
+        pass
+
+
+class _Contexto:
+    async def new_page(self):
+        return _Aba()
+
+
+class _Pagina:
+    url = "https://evo5.w12app.com.br/#/app/t/1/financeiro/nfs"
+    context = _Contexto()
+
+
+def test_so_marca_como_tratado_depois_de_remediar(monkeypatch):
+    tentativas = []
+
+    async def _analisar(_aba, _url, cid):
+        tentativas.append(cid)
+        if cid == "2" and tentativas.count("2") == 1:
+            raise RuntimeError("perfil não abriu")
+        return {"cliente_id": cid, "decisao": "ok"}
+
+    monkeypatch.setattr(rpa, "_analisar_cliente_invalido", _analisar)
+
+    async def _rodada():
+        rpa._CLIENTES_TRATADOS.set(set())
+        rpa._CLIENTES_EM_TRATAMENTO.set(set())
+        primeira = await rpa.tratar_clientes_invalidos(_Pagina(), ["1", "2"], abas=2)
+        segunda = await rpa.tratar_clientes_invalidos(_Pagina(), ["1", "2"], abas=2)
+        return primeira, segunda, rpa._CLIENTES_TRATADOS.get()
+
+    primeira, segunda, tratados = asyncio.run(_rodada())
+    assert {r["cliente_id"]: r["decisao"] for r in primeira} == {"1": "ok", "2": "falha"}
+    assert [(r["cliente_id"], r["decisao"]) for r in segunda] == [("2", "ok")]
+    assert tratados == {"1", "2"}
+    assert sorted(tentativas) == ["1", "2", "2"]
@@ -0,0 +1,46 @@
+# tests/test_rpa_logging.py
+import gzip
+import multiprocessing
+
+import rpa_logging
+
+
+def _gravar_em_outro_processo(arquivo, n):
+    lg = rpa_logging.JsonLinesLogger(arquivo, max_bytes=4096, backups=1000, console=False)
+    for i in range(n):
+        lg.emitir(rpa_logging._registro(f"linha {i:05d} " + "x" * 40))
+        if i % 50 == 0:
+            lg.descarregar()
+    lg.fechar()
+
+
+def _linhas(pasta):
+    total = 0
+    for p in pasta.iterdir():
+        if p.name.endswith(".jsonl.gz"):
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                total += sum(1 for _ in f)
+        elif p.name.endswith(".jsonl"):
+            total += sum(1 for _ in open(p, encoding="utf-8"))
+    return total
+
+
+def test_dois_processos_rotacionam_o_mesmo_arquivo_sem_perder_linhas(tmp_path):
+    arquivo = tmp_path / "rpa.jsonl"
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_gravar_em_outro_processo, args=(arquivo, 600)) for _ in range(2)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    assert len(list(tmp_path.glob("rpa.*.jsonl.gz"))) > 2
+    assert _linhas(tmp_path) == 1200
+
+
+def test_descartados_sao_contados_e_registrados(tmp_path):
+    lg = rpa_logging.JsonLinesLogger(tmp_path / "rpa.jsonl", console=False, fila=1)
+    lg.fechar()  # thread parada: a fila enche e o resto é descartado
+    for i in range(5):
+        lg.emitir(rpa_logging._registro(f"r{i}"))
+    assert lg.descartados == 4
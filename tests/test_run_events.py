@@ -0,0 +1,54 @@
+# tests/test_run_events.py
+import multiprocessing
+import time
+from datetime import datetime
+
+import run_events
+
+
+def _reg(run_id, msg, kind="log"):
+    return {"ts": datetime.now().isoformat(), "level": "INFO", "kind": kind, "run_id": run_id, "msg": msg}
+
+
+def _gravar_em_outro_processo(run_id):
+    time.sleep(0.5)
+    run_events.gravar_lote([_reg(run_id, "do worker")])
+
+
+def test_consultar_pagina_por_cursor_e_filtra_a_execucao(banco):
+    run_events.gravar_lote([_reg("a", f"a{i}") if i % 2 == 0 else _reg("b", f"b{i}") for i in range(10)])
+    vistos, cursor = [], 0
+    while True:
+        parte = run_events.consultar("a", cursor, limite=2)
+        vistos += [r["msg"] for r in parte["rows"]]
+        assert parte["cursor"] >= cursor
+        cursor = parte["cursor"]
+        if not parte["mais"]:
+            break
+    assert vistos == ["a0", "a2", "a4", "a6", "a8"]
+    assert parte["finished"] is False
+    # nada novo: o cursor fica parado
+    assert run_events.consultar("a", cursor) == {"rows": [], "cursor": cursor, "mais": False, "finished": False}
+
+    run_events.gravar_lote([_reg("a", "Execução concluída.", kind="run_fim")])
+    parte = run_events.consultar("a", cursor)
+    assert [r["msg"] for r in parte["rows"]] == ["Execução concluída."]
+    assert parte["finished"] is True
+
+
+def test_marca_dagua_acorda_quem_espera_em_outro_processo(banco):
+    run_events.gravar_lote([_reg("a", "primeiro")])
+    marca = run_events.marca()
+    assert marca == run_events.estado("a")[0]
+    assert run_events.aguardar_novos(0.2, marca) == marca  # nada novo: volta no timeout
+
+    proc = multiprocessing.get_context("spawn").Process(target=_gravar_em_outro_processo, args=("a",))
+    proc.start()
+    try:
+        t0 = time.monotonic()
+        nova = run_events.aguardar_novos(30, marca)
+        assert nova is not None and nova > marca
+        assert time.monotonic() - t0 < 15
+    finally:
+        proc.join(30)
+    assert [r["msg"] for r in run_events.consultar("a", marca)["rows"]] == ["do worker"]
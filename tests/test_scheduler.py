@@ -0,0 +1,106 @@
+# tests/test_scheduler.py
+import threading
+from datetime import datetime, timedelta
+
+import scheduler
+from db import SessionLocal
+from models import Job
+
+
+def _running(owner, heartbeat):
+    job, _ = scheduler.enfileirar("rpa")
+    with SessionLocal() as db:
+        j = db.get(Job, job["id"])
+        j.status = "running"
+        j.started_at = heartbeat or datetime.utcnow() - timedelta(hours=1)
+        j.owner = owner
+        j.heartbeat_at = heartbeat
+        db.commit()
+    return job["id"]
+
+
+def test_recuperar_orfaos_poupa_job_vivo_de_processo_irmao(banco):
+    vivo = _running("outro-host:123", datetime.utcnow())
+    morto = _running("outro-host:456", datetime.utcnow() - timedelta(seconds=scheduler.ORFAO_S + 5))
+    legado = _running(None, None)
+    scheduler.Scheduler()._recuperar_orfaos()
+    assert scheduler.obter(vivo)["status"] == "running"
+    assert scheduler.obter(morto)["status"] == "failed"
+    assert scheduler.obter(legado)["status"] == "failed"
+
+
+def test_agenda_usa_a_mesma_chave_das_execucoes_manuais(banco, monkeypatch):
+    manual, criado = scheduler.enfileirar("rpa", dedup_key="rpa", requested_by="admin")
+    assert criado
+    monkeypatch.setattr(scheduler, "AGENDA", "* * * * *")
+    scheduler.Scheduler()._disparar_agenda(datetime.now())
+    with SessionLocal() as db:
+        assert db.query(Job).filter(Job.kind == "rpa").count() == 1
+    assert scheduler.obter(manual["id"])["status"] == "queued"
+
+
+def test_upload_sem_job_id_conclui_o_pull_zip_entregue(banco):
+    job, _ = scheduler.enfileirar("pull_zip", dedup_key="pull_zip")
+    assert scheduler.job_pendente("pull_zip")["status"] == "running"
+    assert scheduler.concluir_ativo("pull_zip", {"saved": "x"}) == job["id"]
+    assert scheduler.obter(job["id"])["status"] == "done"
+    assert scheduler.job_pendente("pull_zip") is None
+    _, criado = scheduler.enfileirar("pull_zip", dedup_key="pull_zip")
+    assert criado
+
+
+def test_pull_zip_entregue_e_sem_upload_expira(banco):
+    job, _ = scheduler.enfileirar("pull_zip", dedup_key="pull_zip")
+    scheduler.job_pendente("pull_zip")
+    with SessionLocal() as db:
+        db.get(Job, job["id"]).started_at = datetime.utcnow() - timedelta(seconds=scheduler.PULL_EXPIRA_S + 5)
+        db.commit()
+    assert scheduler.job_pendente("pull_zip") is None
+    assert scheduler.obter(job["id"])["status"] == "failed"
+    novo, criado = scheduler.enfileirar("pull_zip", dedup_key="pull_zip")
+    assert criado and novo["id"] != job["id"]
+
+
+def test_dedup_vale_entre_processos_pelo_indice_unico(banco, monkeypatch):
+    primeiro, _ = scheduler.enfileirar("rpa", dedup_key="rpa")
+    consultas = []
+    ativo = scheduler._ativo
+
+    def _corrida(db, chave):
+        # o outro processo gravou depois da nossa consulta
+        consultas.append(chave)
+        return None if len(consultas) == 1 else ativo(db, chave)
+
+    monkeypatch.setattr(scheduler, "_ativo", _corrida)
+    job, criado = scheduler.enfileirar("rpa", dedup_key="rpa")
+    assert (job["id"], criado) == (primeiro["id"], False)
+    with SessionLocal() as db:
+        assert db.query(Job).count() == 1
+
+    scheduler.concluir(primeiro["id"])
+    _, criado = scheduler.enfileirar("rpa", dedup_key="rpa")
+    assert criado
+
+
+def test_limite_de_concorrencia_vale_entre_processos(banco, monkeypatch):
+    liberar = threading.Event()
+    monkeypatch.setattr(scheduler, "MAX_CONCORRENTES", 1)
+    monkeypatch.setitem(scheduler.EXECUTORES, "rpa", lambda job, cancelado: liberar.wait(10) and {})
+    a, _ = scheduler.enfileirar("rpa")
+    b, _ = scheduler.enfileirar("rpa")
+    # dois processos, cada um com o seu Scheduler (e o seu _rodando vazio)
+    processo_1, processo_2 = scheduler.Scheduler(), scheduler.Scheduler()
+    processo_1._despachar()
+    processo_2._despachar()
+    status = {scheduler.obter(a["id"])["status"], scheduler.obter(b["id"])["status"]}
+    assert status == {"running", "queued"}
+    assert not processo_2._rodando
+
+    liberar.set()
+    for t in processo_1._rodando.values():
+        t.join(10)
+    processo_2._despachar()  # a vaga foi devolvida: agora o outro processo pega o job restante
+    assert len(processo_2._rodando) == 1
+    for t in processo_2._rodando.values():
+        t.join(10)
+    assert [scheduler.obter(j["id"])["status"] for j in (a, b)] == ["done", "done"]
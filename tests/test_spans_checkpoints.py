@@ -0,0 +1,35 @@
+# tests/test_spans_checkpoints.py
+import asyncio
+from datetime import datetime
+
+import checkpoints
+import spans
+
+
+def test_gravacoes_saem_do_loop_e_chegam_no_banco(banco):
+    import rpa
+
+    async def _rodada():
+        execucao = rpa._Execucao("run-1")
+        rpa._EXECUCAO.set(execucao)
+        async with rpa.span("etapa_a", "Unidade X"):
+            execucao.registrar("t1", "Unidade X", "validar", "falha", erro="x")
+            execucao.registrar("t1", "Unidade X", "validar", "ok", data={"n": 1})
+        await rpa.descarregar_gravacoes()
+
+    asyncio.run(_rodada())
+    cps = checkpoints.carregar("run-1")
+    assert cps[("t1", "Unidade X", "validar")] == {"status": "ok", "data": {"n": 1}, "error": None}
+    assert [s["unidade"] for s in spans.timeline("run-1")] == ["Unidade X"]
+
+
+def test_prometheus_exporta_contagens_da_janela_como_gauge(banco):
+    spans.gravar([
+        {"run_id": "r", "tenant": "t", "etapa": "login", "inicio": datetime.utcnow(),
+         "duracao_ms": 1200.0, "resultado": "ok", "retentativas": 2},
+    ])
+    texto = spans.prometheus()
+    assert "# TYPE rpa_step_outcomes gauge" in texto
+    assert 'rpa_step_outcomes{tenant="t",step="login",outcome="ok"} 1' in texto
+    assert 'rpa_step_retries{tenant="t",step="login"} 2' in texto
+    assert "_total" not in texto
@@ -0,0 +1,64 @@
+# tests/test_timeouts.py
+from rpa import TimeoutPolicy, _rotulo_fixo
+
+
+def _politica(tmp_path, **kw):
+    kw.setdefault("min_amostras", 5)
+    return TimeoutPolicy(tmp_path / "timeouts.json", margem=1.5, piso_ms=500, teto_ms=30000, **kw)
+
+
+def test_sem_amostras_suficientes_usa_padrao(tmp_path):
+    p = _politica(tmp_path)
+    for _ in range(4):
+        p.registrar("etapa", "sel", 100, ok=True)
+    assert p.timeout("etapa", "sel", 1500) == 1500
+
+
+def test_nunca_abaixo_do_padrao(tmp_path):
+    p = _politica(tmp_path)
+    for _ in range(10):
+        p.registrar("etapa", "sel", 100, ok=True)
+    assert p.timeout("etapa", "sel", 1500) == 1500
+
+
+def test_estica_pelo_p99_dos_sucessos(tmp_path):
+    p = _politica(tmp_path)
+    for ms in (1000, 1200, 4000, 1100, 1000):
+        p.registrar("etapa", "sel", ms, ok=True)
+    assert p.timeout("etapa", "sel", 1500) == 6000
+
+
+def test_timeouts_seguidos_aumentam_o_limite(tmp_path):
+    p = _politica(tmp_path)
+    for _ in range(5):
+        p.registrar("etapa", "sel", 1500, ok=False)
+    # maioria de timeouts: sem `opcional`, o limite sobe em vez de cair no piso
+    assert p.timeout("etapa", "sel", 1500) == 30000
+    p.registrar("etapa", "sel", 2000, ok=True)
+    assert p.timeout("etapa", "sel", 1500) == 3000
+
+
+def test_opcional_pode_esperar_menos(tmp_path):
+    p = _politica(tmp_path)
+    for _ in range(8):
+        p.registrar("etapa", "sonda", 3000, ok=False)
+    for _ in range(2):
+        p.registrar("etapa", "sonda", 400, ok=True)
+    assert p.timeout("etapa", "sonda", 3000, opcional=True) == 600
+    assert p.timeout("etapa", "sonda", 3000) == 3000
+
+
+def test_congelado_nao_aprende_e_salvar_persiste(tmp_path):
+    p = _politica(tmp_path)
+    for _ in range(5):
+        p.registrar("etapa", "sel", 4000, ok=True)
+    p.salvar()
+    relida = _politica(tmp_path, congelado=True)
+    assert relida.timeout("etapa", "sel", 1000) == 6000
+    relida.registrar("etapa", "sel", 1, ok=True)
+    assert len(relida._historico()["etapa|sel"]) == 5
+
+
+def test_rotulo_fixo_descarta_parte_dinamica():
+    assert _rotulo_fixo("Unidade alvo (scan: 'Academia X')") == "Unidade alvo"
+    assert _rotulo_fixo("Entrar") == "Entrar"
@@ -0,0 +1,390 @@
+# uploads.py
+# Recebimento do arquivos.zip (agente, envio manual, cópia automática): grava em
+# pedaços num temporário ao lado do destino calculando o SHA-256, valida o diretório
+# central do ZIP e só então troca o arquivo com os.replace — quem lê nunca vê um zip
+# pela metade. Conteúdo igual ao atual não é regravado. Tudo vai para o UploadLog e
+# o conteúdo para o acervo endereçado por hash (archives).
+# Para links instáveis há também o upload em partes (sessão → PUT das partes → commit),
+# retomável: as partes ficam em disco até o commit.
+import os
+import json
+import math
+import shutil
+import hashlib
+import tempfile
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+from sqlalchemy import update
+
+import archives
+from db import SessionLocal
+from models import UploadLog, UploadSession
+
+CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024") or 1024) * 1024
+MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "512") or 512) * 1024 * 1024)
+
+# troca + consulta do hash atual são atômicas entre threads deste processo
+_LOCK = threading.Lock()
+
+
+class UploadInvalido(ValueError):
+    """Arquivo recusado: acima do limite, não é ZIP ou está corrompido/vazio."""
+
+
+class SessaoFechada(UploadInvalido):
+    """Sessão de upload já concluída, abortada ou em commit."""
+
+
+def _copiar(stream: BinaryIO, fh) -> tuple:
+    h = hashlib.sha256()
+    total = 0
+    while True:
+        bloco = stream.read(CHUNK_BYTES)
+        if not bloco:
+            break
+        total += len(bloco)
+        if MAX_BYTES and total > MAX_BYTES:
+            raise UploadInvalido(f"Arquivo acima do limite de {MAX_BYTES // (1024 * 1024)} MB.")
+        h.update(bloco)
+        fh.write(bloco)
+    return h.hexdigest(), total
+
+
+def validar_zip(caminho: str) -> int:
+    """Lê só o diretório central (sem descompactar); devolve a quantidade de membros."""
+    try:
+        with zipfile.ZipFile(caminho) as zf:
+            membros = len(zf.infolist())
+    except (zipfile.BadZipFile, OSError) as e:
+        raise UploadInvalido(f"ZIP inválido: {e}") from e
+    if not membros:
+        raise UploadInvalido("ZIP vazio.")
+    return membros
+
+
+def sha256_atual(destino: str) -> Optional[str]:
+    """Hash do arquivo em `destino` pelo último UploadLog, se o tamanho no disco ainda bate."""
+    try:
+        tamanho = os.path.getsize(destino)
+    except OSError:
+        return None
+    with SessionLocal() as db:
+        ultimo = (
+            db.query(UploadLog)
+            .filter(UploadLog.stored_path == destino, UploadLog.sha256.isnot(None))
+            .order_by(UploadLog.id.desc())
+            .first()
+        )
+    if ultimo is None or ultimo.size_bytes != tamanho:
+        return None
+    return ultimo.sha256
+
+
+def _registrar(filename: str, destino: str, enviado_por: str, sha: str, tamanho: int) -> None:
+    with SessionLocal() as db:
+        db.add(UploadLog(
+            filename=(filename or os.path.basename(destino))[:255],
+            stored_path=destino,
+            uploaded_by=enviado_por,
+            sha256=sha,
+            size_bytes=tamanho,
+        ))
+        db.commit()
+
+
+def receber(stream: BinaryIO, destino: str, filename: str, enviado_por: str,
+            sha256_esperado: Optional[str] = None, fonte: str = "agente") -> dict:
+    """
+    Copia `stream` para `destino` (temporário + os.replace). Levanta UploadInvalido
+    se o conteúdo for recusado; o destino anterior fica intacto nesse caso.
+    `fonte` (agente|manual|drive) vai para o índice do acervo.
+    """
+    pasta = os.path.dirname(destino) or "."
+    os.makedirs(pasta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".upload-", suffix=".part", dir=pasta)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            sha, tamanho = _copiar(stream, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if sha256_esperado and sha != sha256_esperado.lower():
+            raise UploadInvalido("SHA-256 do arquivo não confere com o informado.")
+        validar_zip(tmp)
+        arquivo = archives.STORE.adicionar(tmp, sha, tamanho, fonte, filename)
+        with _LOCK:
+            deduplicado = sha == sha256_atual(destino)
+            if not deduplicado:
+                # destino vira link da entrada do acervo; sem link, o temporário mesmo
+                if not archives.vincular(arquivo["path"], destino):
+                    os.replace(tmp, destino)
+                os.utime(destino, None)
+            _registrar(filename, destino, enviado_por, sha, tamanho)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {"saved": destino, "sha256": sha, "size": tamanho, "deduplicado": deduplicado,
+            "archive_id": arquivo["id"]}
+
+
+def adotar(caminho: str, enviado_por: str, fonte: str = "importado") -> dict:
+    """
+    Indexa um .zip que já está no destino mas foi colocado por fora dos endpoints,
+    sem trocar o conteúdo: entra no acervo (data = mtime) e no UploadLog.
+    """
+    validar_zip(caminho)
+    st = os.stat(caminho)
+    sha = archives.sha256_arquivo(caminho)
+    arquivo = archives.STORE.adicionar(caminho, sha, st.st_size, fonte, os.path.basename(caminho),
+                                       visto_em=datetime.utcfromtimestamp(st.st_mtime))
+    with _LOCK:
+        # mesmo conteúdo: só passa a ser link do acervo (uma cópia), mantendo o mtime
+        if archives.vincular(arquivo["path"], caminho):
+            os.utime(caminho, (st.st_atime, st.st_mtime))
+        _registrar(os.path.basename(caminho), caminho, enviado_por, sha, st.st_size)
+    return {"saved": caminho, "sha256": sha, "size": st.st_size, "deduplicado": True,
+            "archive_id": arquivo["id"]}
+
+
+def copiar_arquivo(origem: str, destino: str, enviado_por: str, fonte: str = "drive") -> dict:
+    """Mesmo caminho do upload para um .zip local (ex.: baixado do Drive)."""
+    with open(origem, "rb") as src:
+        return receber(src, destino, os.path.basename(origem), enviado_por, fonte=fonte)
+
+
+# =========================
+# Upload em partes (retomável)
+# =========================
+SESSOES_DIR = Path(os.getenv("UPLOAD_SESSOES_DIR", str(Path(__file__).resolve().parent / "uploads" / ".sessoes")))
+PARTE_PADRAO = int(os.getenv("UPLOAD_PARTE_MB", "8") or 8) * 1024 * 1024
+PARTE_MIN = 64 * 1024
+PARTE_MAX = 64 * 1024 * 1024
+SESSAO_MAX_H = float(os.getenv("UPLOAD_SESSAO_MAX_H", "24") or 24)
+
+
+def _pasta_sessao(sessao_id: str) -> Path:
+    return SESSOES_DIR / sessao_id
+
+
+def _caminho_parte(sessao_id: str, n: int) -> Path:
+    return _pasta_sessao(sessao_id) / f"{n:06d}.part"
+
+
+def _tamanho_parte(s: UploadSession, n: int) -> int:
+    return s.chunk_size if n < s.total_chunks - 1 else s.size_bytes - s.chunk_size * (s.total_chunks - 1)
+
+
+def partes_faltando(s: UploadSession) -> List[int]:
+    """A pasta da sessão é a fonte da verdade: parte presente = recebida e conferida."""
+    try:
+        recebidas = {int(nome[:-5]) for nome in os.listdir(_pasta_sessao(s.id)) if nome.endswith(".part")}
+    except OSError:
+        recebidas = set()
+    return [n for n in range(s.total_chunks) if n not in recebidas]
+
+
+def sessao_dict(s: UploadSession, com_faltando: bool = True) -> dict:
+    d = {
+        "id": s.id,
+        "filename": s.filename,
+        "size": s.size_bytes,
+        "chunk_size": s.chunk_size,
+        "total_chunks": s.total_chunks,
+        "status": s.status,
+        "job_id": s.job_id,
+        "created_at": s.created_at.isoformat() + "Z" if s.created_at else None,
+        "updated_at": s.updated_at.isoformat() + "Z" if s.updated_at else None,
+    }
+    if com_faltando and s.status == "open":
+        d["missing"] = partes_faltando(s)
+    if s.result:
+        d["result"] = json.loads(s.result)
+    return d
+
+
+def criar_sessao(filename: str, size: int, destino: str, chunk_size: Optional[int] = None,
+                 sha256: Optional[str] = None, job_id: Optional[str] = None,
+                 criado_por: Optional[str] = None) -> dict:
+    if size <= 0:
+        raise UploadInvalido("Tamanho do arquivo inválido.")
+    if MAX_BYTES and size > MAX_BYTES:
+        raise UploadInvalido(f"Arquivo acima do limite de {MAX_BYTES // (1024 * 1024)} MB.")
+    if sha256 and (len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256.lower())):
+        raise UploadInvalido("sha256 deve ter 64 dígitos hexadecimais.")
+    chunk = max(PARTE_MIN, min(int(chunk_size or PARTE_PADRAO), PARTE_MAX, MAX_BYTES or PARTE_MAX))
+    limpar_sessoes_antigas()
+    s = UploadSession(
+        id=str(uuid.uuid4()),
+        filename=(filename or os.path.basename(destino))[:255],
+        destino=destino,
+        size_bytes=size,
+        chunk_size=chunk,
+        total_chunks=math.ceil(size / chunk),
+        sha256=sha256.lower() if sha256 else None,
+        status="open",
+        job_id=job_id,
+        created_by=criado_por,
+    )
+    _pasta_sessao(s.id).mkdir(parents=True, exist_ok=True)
+    with SessionLocal() as db:
+        db.add(s)
+        db.commit()
+        return sessao_dict(s)
+
+
+def obter_sessao(sessao_id: str) -> Optional[dict]:
+    with SessionLocal() as db:
+        s = db.get(UploadSession, sessao_id)
+        return sessao_dict(s) if s else None
+
+
+def _tocar(sessao_id: str, **valores) -> None:
+    with SessionLocal() as db:
+        db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == sessao_id)
+            .values(updated_at=datetime.utcnow(), **valores)
+        )
+        db.commit()
+
+
+def gravar_parte(sessao_id: str, n: int, stream: BinaryIO, sha256_parte: str) -> Optional[dict]:
+    """
+    Grava a parte `n` (temporário + os.replace), conferindo tamanho e SHA-256.
+    Partes diferentes podem chegar em paralelo; reenviar uma parte só a substitui.
+    None = sessão inexistente.
+    """
+    with SessionLocal() as db:
+        s = db.get(UploadSession, sessao_id)
+    if s is None:
+        return None
+    if s.status != "open":
+        raise SessaoFechada(f"Sessão {s.status}.")
+    if not 0 <= n < s.total_chunks:
+        raise UploadInvalido(f"Parte {n} fora do intervalo 0..{s.total_chunks - 1}.")
+    if not sha256_parte:
+        raise UploadInvalido("Informe o SHA-256 da parte (cabeçalho X-Chunk-SHA256).")
+    esperado = _tamanho_parte(s, n)
+
+    pasta = _pasta_sessao(s.id)
+    pasta.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{n:06d}-", suffix=".tmp", dir=pasta)
+    try:
+        h = hashlib.sha256()
+        total = 0
+        with os.fdopen(fd, "wb") as fh:
+            while True:
+                bloco = stream.read(CHUNK_BYTES)
+                if not bloco:
+                    break
+                total += len(bloco)
+                if total > esperado:
+                    raise UploadInvalido(f"Parte {n} maior que {esperado} bytes.")
+                h.update(bloco)
+                fh.write(bloco)
+        if total != esperado:
+            raise UploadInvalido(f"Parte {n} com {total} bytes; esperado {esperado}.")
+        if h.hexdigest() != sha256_parte.strip().lower():
+            raise UploadInvalido(f"SHA-256 da parte {n} não confere.")
+        os.replace(tmp, _caminho_parte(s.id, n))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    _tocar(sessao_id)
+    return {"id": sessao_id, "chunk": n, "missing": partes_faltando(s)}
+
+
+class _LeitorPartes:
+    """read(n) sobre as partes em ordem, um arquivo aberto por vez (nada inteiro em memória)."""
+
+    def __init__(self, caminhos: List[Path]) -> None:
+        self._caminhos = list(caminhos)
+        self._fh = None
+
+    def read(self, n: int = -1) -> bytes:
+        while True:
+            if self._fh is None:
+                if not self._caminhos:
+                    return b""
+                self._fh = open(self._caminhos.pop(0), "rb")
+            bloco = self._fh.read(n)
+            if bloco:
+                return bloco
+            self._fh.close()
+            self._fh = None
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def concluir_sessao(sessao_id: str, enviado_por: str) -> Optional[dict]:
+    """
+    Remonta as partes no destino pelo mesmo caminho do upload direto (receber).
+    Repetir o commit de uma sessão já concluída devolve o mesmo resultado.
+    """
+    with SessionLocal() as db:
+        # open → committing de forma atômica: um commit por vez, mesmo entre processos
+        res = db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == sessao_id, UploadSession.status == "open")
+            .values(status="committing", updated_at=datetime.utcnow())
+        )
+        db.commit()
+        s = db.get(UploadSession, sessao_id)
+    if s is None:
+        return None
+    if res.rowcount != 1:
+        if s.status == "committed":
+            return json.loads(s.result or "{}")
+        raise SessaoFechada(f"Sessão {s.status}.")
+
+    resultado = None
+    leitor = None
+    try:
+        faltando = partes_faltando(s)
+        if faltando:
+            raise UploadInvalido(f"Faltam {len(faltando)} parte(s).")
+        leitor = _LeitorPartes([_caminho_parte(s.id, n) for n in range(s.total_chunks)])
+        resultado = receber(leitor, s.destino, s.filename, enviado_por, sha256_esperado=s.sha256, fonte="agente")
+    finally:
+        if leitor is not None:
+            leitor.close()
+        if resultado is None:
+            # falhou: volta a aceitar partes (o cliente pode reenviar e tentar de novo)
+            _tocar(sessao_id, status="open")
+    _tocar(sessao_id, status="committed", result=json.dumps(resultado))
+    shutil.rmtree(_pasta_sessao(sessao_id), ignore_errors=True)
+    return resultado
+
+
+def abortar_sessao(sessao_id: str) -> bool:
+    with SessionLocal() as db:
+        res = db.execute(
+            update(UploadSession)
+            .where(UploadSession.id == sessao_id, UploadSession.status == "open")
+            .values(status="aborted", updated_at=datetime.utcnow())
+        )
+        db.commit()
+    if res.rowcount == 1:
+        shutil.rmtree(_pasta_sessao(sessao_id), ignore_errors=True)
+    return res.rowcount == 1
+
+
+def limpar_sessoes_antigas() -> None:
+    """Sessões abertas sem atividade há mais de SESSAO_MAX_H horas são abortadas e apagadas."""
+    limite = datetime.utcnow() - timedelta(hours=SESSAO_MAX_H)
+    with SessionLocal() as db:
+        velhas = [
+            sid for (sid,) in db.query(UploadSession.id)
+            .filter(UploadSession.status == "open", UploadSession.updated_at < limite)
+            .all()
+        ]
+    for sid in velhas:
+        abortar_sessao(sid)